@@ -9,7 +9,17 @@ from aws_lambda_powertools import Logger, Tracer, Metrics
 from aws_lambda_powertools.event_handler import BedrockAgentResolver
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from aws_lambda_powertools.event_handler.openapi.params import Body, Query
-from utilities.utils import get_stripe_key, parse_raw_items
+from grocerly_shared.rate_limit import TokenBucket
+from grocerly_shared.secrets import get_stripe_key
+from utilities.payment_links import (
+    PaymentLinkCache,
+    build_line_items,
+    create_payment_link,
+    create_payment_links,
+)
+from utilities.price_resolver import DynamoDBPriceResolver
+from utilities.stripe_catalog import catalog
+from utilities.utils import parse_raw_carts, parse_raw_items
 
 tracer = Tracer()
 logger = Logger()
@@ -21,16 +31,21 @@ table_name = os.environ.get("ECOMMERCE_TABLE_NAME")
 
 
 table = dynamodb.Table(table_name)
+price_resolver = DynamoDBPriceResolver(table, fallback=catalog)
+link_cache = PaymentLinkCache(
+    table, ttl_seconds=int(os.environ.get("PAYMENT_LINK_CACHE_TTL_SECONDS", "3600"))
+)
+# Carts of a /payment_links request are linked on this many threads; Stripe
+# allows 100 requests/s in live mode and 25 requests/s in test mode
+PAYMENT_LINK_CONCURRENCY = int(os.environ.get("PAYMENT_LINK_CONCURRENCY", "8"))
+stripe_rate_limiter = TokenBucket(
+    rate=float(os.environ.get("STRIPE_REQUESTS_PER_SECOND", "20")),
+    capacity=PAYMENT_LINK_CONCURRENCY,
+)
 # Set your Stripe API key
 
 
 metrics = Metrics(namespace="grocery_agent_metrics")
-stripe_key = get_stripe_key()
-if stripe_key is None:
-    logger.info("Stripe API key not set")
-    raise HTTPException()
-# set stripe key
-stripe.api_key = stripe_key
 
 
 @tracer.capture_method
@@ -63,69 +78,16 @@ def payment_link(
             str: The payment link URL.
         """
     try:
-        line_items = []
-        logger.info("we're here")
         print("products", products)
         parsed_items = parse_raw_items(products)
-        print("parsed_items:", parsed_items.products[0].name)
-        logger.info(parsed_items.products[0].name)
-        # Iterate through the list of products
-        for product_info in parsed_items.products:
-            logger.info(f"Product info {product_info.name}")
-            product_name = product_info.name
-            qty = product_info.quantity
-
-            if not product_name or not qty:
-                logger.error("Invalid product info:", product_info)
-                raise HTTPException()
-
-            logger.info(f"Processing product: {product_name}, Quantity:{qty} ")
-
-            # Step 1: Retrieve the product by name
-            products_list = stripe.Product.list(limit=100)
-
-            product = None
-
-            # Filter products by name
-            for p in products_list.auto_paging_iter():
-                if p.name.lower() == product_name.lower():
-                    product = p
-                    break
-
-            if not product:
-                logger.error(f"No product found with name: {product_name}")
-                raise HTTPException()
-
-            logger.info(f"Product found! ID: {product.id}")
-
-            # Step 2: Retrieve the price for the product
-            prices = stripe.Price.list(
-                product=product.id, limit=1
-            )  # Get the first price
-            if not prices.data:
-                logger.error("No price found for product ID:", product.id)
-                raise HTTPException()
-
-            price = prices.data[0]  # Get the first price in the list
-            logger.debug(
-                f"Price found! ID: {price.id}, Amount: {price.unit_amount / 100} {price.currency.upper()}"
-            )
-            logger.info(f"line_items 1:{line_items}")
-            # Add the product to the line items
-            line_items.append(
-                {
-                    "price": price.id,
-                    "quantity": qty,
-                }
-            )
-        logger.debug(f"line_items 2: {line_items}")
-
-        # Step 3: Create a payment link with all line items
-        payment_link = stripe.PaymentLink.create(
-            line_items=line_items,
-        )
-        logger.info(f"Payment Link URL: {payment_link.url}")
-        return f"Payment Link URL: {payment_link.url}"
+        logger.info(f"Parsed {len(parsed_items.products)} products")
+
+        # Resolve every product with one DynamoDB read, Stripe only on a miss
+        line_items = build_line_items(parsed_items.products, price_resolver)
+        logger.debug(f"line_items: {line_items}")
+
+        url = create_payment_link(line_items, link_cache)
+        return f"Payment Link URL: {url}"
 
     except stripe.error.StripeError as e:
         logger.error("Stripe Error: ", {e.user_message})
@@ -136,6 +98,44 @@ def payment_link(
         raise HTTPException()
 
 
+@tracer.capture_method
+@app.get(
+    "/payment_links",
+    description="Creates one stripe payment link per cart when given a list of carts, each a list of products,their quantities and units",
+)
+def payment_links(
+    carts: Annotated[
+        list,
+        Query(
+            description="a list of carts, each a list of products and quantities",
+        ),
+    ],
+) -> Annotated[list, Body(description="Payment link or error of each cart, in input order")]:
+    """
+    Create the payment links of many carts in one call; the products of all
+    carts are resolved once and the links created concurrently.
+    """
+    logger.append_keys(
+        session_id=app.current_event.session_id,
+        action_group=app.current_event.action_group,
+        input_text=app.current_event.input_text,
+    )
+    try:
+        parsed_carts = parse_raw_carts(carts)
+        logger.info(f"Parsed {len(parsed_carts)} carts")
+        return create_payment_links(
+            [cart.products for cart in parsed_carts],
+            price_resolver,
+            link_cache,
+            stripe_rate_limiter,
+            max_workers=PAYMENT_LINK_CONCURRENCY,
+        )
+    except Exception as e:
+        logger.exception("An unexpected error occurred", log=e)
+
+        raise HTTPException()
+
+
 @app.get("/current_time", description="Gets the current time in seconds")
 @tracer.capture_method
 def current_time() -> int:
@@ -146,6 +146,8 @@ def current_time() -> int:
 @tracer.capture_lambda_handler
 @metrics.log_metrics(capture_cold_start_metric=True)
 def lambda_handler(event: dict, context: LambdaContext):
+    # Served from the in-memory secret cache after the first invocation
+    stripe.api_key = get_stripe_key()
     return app.resolve(event, context)
 
 
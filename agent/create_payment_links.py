@@ -0,0 +1,51 @@
+import os
+
+import boto3
+import stripe
+from aws_lambda_powertools import Logger, Tracer
+from grocerly_shared.models import ItemList
+from grocerly_shared.rate_limit import TokenBucket
+from grocerly_shared.secrets import get_stripe_key
+from utilities.payment_links import PaymentLinkCache, create_payment_links
+from utilities.price_resolver import DynamoDBPriceResolver
+from utilities.stripe_catalog import catalog
+
+logger = Logger(service="create_payment_links")
+tracer = Tracer(service="create_payment_links")
+dynamodb = boto3.resource("dynamodb")
+
+table = dynamodb.Table(os.environ.get("ECOMMERCE_TABLE_NAME"))
+price_resolver = DynamoDBPriceResolver(table, fallback=catalog)
+link_cache = PaymentLinkCache(
+    table, ttl_seconds=int(os.environ.get("PAYMENT_LINK_CACHE_TTL_SECONDS", "3600"))
+)
+
+# Stripe allows 100 requests/s in live mode and 25 requests/s in test mode
+PAYMENT_LINK_CONCURRENCY = int(os.environ.get("PAYMENT_LINK_CONCURRENCY", "8"))
+stripe_rate_limiter = TokenBucket(
+    rate=float(os.environ.get("STRIPE_REQUESTS_PER_SECOND", "20")),
+    capacity=PAYMENT_LINK_CONCURRENCY,
+)
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event, context):
+    """
+    Resolver of the createPaymentLinks mutation: one payment link per cart,
+    returned in the order of the carts.
+    """
+    carts = [
+        ItemList(products=cart["items"]).products for cart in event["arguments"]["carts"]
+    ]
+    logger.info(f"Creating payment links for {len(carts)} carts")
+
+    # Served from the in-memory secret cache after the first invocation
+    stripe.api_key = get_stripe_key()
+    return create_payment_links(
+        carts,
+        price_resolver,
+        link_cache,
+        stripe_rate_limiter,
+        max_workers=PAYMENT_LINK_CONCURRENCY,
+    )
@@ -2,8 +2,22 @@ import json
 import os
 
 import boto3
+import stripe
 from aws_lambda_powertools import Logger, Tracer
 from aws_lambda_powertools.utilities.data_classes.appsync import scalar_types_utils
+from grocerly_shared.models import ItemList
+from grocerly_shared.secrets import get_stripe_key
+from grocerly_shared.text_store import get_text
+from utilities.payment_links import (
+    PaymentLinkCache,
+    UnresolvedProductsError,
+    build_line_items,
+    counted_items,
+    create_payment_link,
+)
+from utilities.price_resolver import DynamoDBPriceResolver
+from utilities.progress import AppSyncPublisher, ProgressStream
+from utilities.stripe_catalog import catalog
 
 # Initialize Clients
 bedrock_agent_runtime_client = boto3.client(
@@ -19,6 +33,87 @@ dynamodb = boto3.resource("dynamodb")
 table_name = os.environ.get("ECOMMERCE_TABLE_NAME")
 
 table = dynamodb.Table(table_name)
+price_resolver = DynamoDBPriceResolver(table, fallback=catalog)
+link_cache = PaymentLinkCache(
+    table, ttl_seconds=int(os.environ.get("PAYMENT_LINK_CACHE_TTL_SECONDS", "3600"))
+)
+
+# Completion chunks are published to AppSync subscribers at most this often
+appsync_api_url = os.environ.get("APPSYNC_API_URL")
+progress_flush_interval_ms = int(os.environ.get("PROGRESS_FLUSH_INTERVAL_MS", "250"))
+
+
+def progress_stream(session_id, context):
+    publisher = None
+    if appsync_api_url:
+        publisher = AppSyncPublisher(
+            appsync_api_url,
+            region=os.environ.get("AWS_REGION", "us-east-1"),
+            account=context.invoked_function_arn.split(":")[4],
+            source="grocerly.invoke_agent",
+        )
+    return ProgressStream(
+        publisher,
+        session_id,
+        flush_interval_seconds=progress_flush_interval_ms / 1000,
+    )
+
+
+def create_payment_link_directly(items):
+    """
+    Create the payment link in-process from the validated items of the
+    extraction step, without a Bedrock Agent round-trip.
+
+    Returns:
+        str: The completion text, or None when some items can't be resolved
+        or are measured by weight or volume, and the agent has to handle
+        the list.
+    """
+    item_list = ItemList(products=items)
+    if not counted_items(item_list.products):
+        logger.info("Falling back to the agent for items measured by weight or volume")
+        return None
+    stripe.api_key = get_stripe_key()
+    try:
+        line_items = build_line_items(item_list.products, price_resolver)
+    except UnresolvedProductsError as e:
+        logger.info(f"Falling back to the agent for unresolved products: {e.names}")
+        return None
+    return f"Payment Link URL: {create_payment_link(line_items, link_cache)}"
+
+
+def invoke_grocery_agent(grocery_list, session_id, progress):
+    # Create query string
+    query = f"Create and return a single Stripe payment link with the list of products: {grocery_list}"
+
+    # Invoke the Bedrock Agent
+    agent_response = bedrock_agent_runtime_client.invoke_agent(
+        inputText=query,
+        agentId=agent_id,
+        agentAliasId=agent_alias,
+        sessionId=session_id,
+        enableTrace=True,
+    )
+
+    # Ensure the response contains the event stream
+    if "completion" not in agent_response:
+        raise Exception("Agent response is missing `completion` field.")
+
+    event_stream = agent_response["completion"]
+
+    # Collect all chunks from the stream, publishing them as they arrive
+    chunks = []
+    for event in event_stream:
+        chunk = event.get("chunk")
+        if chunk:
+            decoded_bytes = chunk.get("bytes").decode()
+            print("bytes: ", decoded_bytes)
+            chunks.append(decoded_bytes)
+            progress.add_chunk(decoded_bytes)
+        trace = event.get("trace")
+        if trace:
+            progress.add_trace(trace)
+    return " ".join(chunks)
 
 
 @logger.inject_lambda_context
@@ -28,7 +123,7 @@ def handler(event, context):
         logger.info(f"Received event: {json.dumps(event, indent=2)}")
 
         # Parse the event body
-        grocery_list = event["grocery_list"]
+        grocery_list = get_text(event, field="grocery_list")
         logger.info(f"Received event body: {grocery_list}")
 
         # Extract grocery_list and validate
@@ -36,38 +131,31 @@ def handler(event, context):
         if not grocery_list:
             raise ValueError("Error: `grocery_list` is missing or empty.")
 
-        # Create query string
-        query = f"Create and return a single Stripe payment link with the list of products: {grocery_list}"
-
-        # Generate a unique session ID
-        session_id = scalar_types_utils.make_id()
-
-        # Invoke the Bedrock Agent
-        agent_response = bedrock_agent_runtime_client.invoke_agent(
-            inputText=query,
-            agentId=agent_id,
-            agentAliasId=agent_alias,
-            sessionId=session_id,
-            enableTrace=True,
-        )
-
-        # Ensure the response contains the event stream
-        if "completion" not in agent_response:
-            raise Exception("Agent response is missing `completion` field.")
-
-        event_stream = agent_response["completion"]
-
-        # Collect all chunks from the stream
-        chunks = []
-        for event in event_stream:
-            chunk = event.get("chunk")
-            if chunk:
-                decoded_bytes = chunk.get("bytes").decode()
-                print("bytes: ", decoded_bytes)
-                chunks.append(decoded_bytes)
-        completion = " ".join(chunks)
-
-        print(f"Completion: {completion}")
+        # The workflow passes its execution name, which clients subscribe to;
+        # otherwise generate a unique session ID
+        session_id = event.get("session_id") or scalar_types_utils.make_id()
+        progress = progress_stream(session_id, context)
+        progress.status("STARTED")
+
+        try:
+            completion = None
+            items = event.get("items")
+            if "items_ref" in event:
+                items = json.loads(get_text(event, field="items"))
+            if items:
+                progress.status("CREATING_PAYMENT_LINK")
+                completion = create_payment_link_directly(items)
+            if completion is None:
+                progress.status("INVOKING_AGENT")
+                completion = invoke_grocery_agent(grocery_list, session_id, progress)
+
+            print(f"Completion: {completion}")
+            progress.status("COMPLETED", completion=completion)
+        except Exception:
+            progress.status("FAILED")
+            raise
+        finally:
+            progress.close()
 
         # save result to database
         stripe_response = {
@@ -0,0 +1,289 @@
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Dict, List, Optional
+
+import stripe
+from aws_lambda_powertools import Logger
+from grocerly_shared.models import Item
+from grocerly_shared.products import normalize_product_name
+from grocerly_shared.rate_limit import TokenBucket, call_with_backoff
+
+logger = Logger(child=True)
+
+# Units whose quantity is a number of catalog products. Weights and volumes
+# ("500 g flour") are not, so those carts can't become line items directly.
+COUNT_UNITS = {
+    "pc",
+    "pcs",
+    "piece",
+    "pieces",
+    "pack",
+    "packs",
+    "packet",
+    "packets",
+    "bottle",
+    "bottles",
+    "can",
+    "cans",
+    "tin",
+    "tins",
+    "box",
+    "boxes",
+    "bag",
+    "bags",
+    "bunch",
+    "bunches",
+    "jar",
+    "jars",
+    "loaf",
+    "loaves",
+}
+
+
+def counted_items(products: List[Item]) -> bool:
+    """True when every item quantity is a count of products, i.e. it has no unit or a count unit."""
+    return all(
+        item.unit is None or item.unit.strip().lower() in COUNT_UNITS
+        for item in products
+    )
+
+
+class UnresolvedProductsError(Exception):
+    """Raised when cart items don't match any product of the catalog."""
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        super().__init__(f"No product found with name: {', '.join(names)}")
+
+
+def canonical_line_items(line_items: List[dict]) -> List[dict]:
+    """
+    Merge repeated prices and sort by price id so equal carts compare equal.
+    """
+    quantities: Dict[str, int] = {}
+    for line_item in line_items:
+        quantities[line_item["price"]] = (
+            quantities.get(line_item["price"], 0) + line_item["quantity"]
+        )
+    return [
+        {"price": price, "quantity": quantity}
+        for price, quantity in sorted(quantities.items())
+    ]
+
+
+def cart_fingerprint(line_items: List[dict]) -> str:
+    """
+    Content hash of a cart: sha256 over its sorted (price_id, quantity) pairs.
+    """
+    pairs = [
+        [line_item["price"], line_item["quantity"]]
+        for line_item in canonical_line_items(line_items)
+    ]
+    return hashlib.sha256(json.dumps(pairs, separators=(",", ":")).encode()).hexdigest()
+
+
+class PaymentLinkCache:
+    """
+    Maps cart fingerprints to payment links already created in Stripe.
+
+    Items live in GroceryAppTable under PK CARTLINK#<fingerprint> and carry an
+    expiresAt epoch used both by the table TTL and on read, since DynamoDB only
+    deletes expired items eventually. Entries marked inactive are never reused.
+
+    A link deactivated in Stripe is noticed on the first hit more than
+    verify_after_seconds after it was last checked: the link is retrieved
+    from Stripe and, when no longer active, the entry is invalidated and the
+    cart gets a new link.
+    """
+
+    def __init__(self, table, ttl_seconds: int = 3600, verify_after_seconds: int = 300):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.verify_after_seconds = verify_after_seconds
+
+    @staticmethod
+    def _key(fingerprint: str) -> dict:
+        return {"PK": f"CARTLINK#{fingerprint}", "SK": "CARTLINK"}
+
+    def get(self, fingerprint: str) -> Optional[str]:
+        try:
+            item = self.table.get_item(Key=self._key(fingerprint)).get("Item")
+        except Exception as e:
+            logger.warning(f"Failed to read cached payment link: {e}")
+            return None
+        if not item or not item.get("active", False):
+            return None
+        if int(item.get("expiresAt", 0)) <= time():
+            return None
+        if int(item.get("verifiedAt", 0)) + self.verify_after_seconds <= time():
+            if not self._still_active(fingerprint, item["paymentLinkId"]):
+                return None
+        return item["url"]
+
+    def _still_active(self, fingerprint: str, payment_link_id: str) -> bool:
+        try:
+            active = bool(stripe.PaymentLink.retrieve(payment_link_id).active)
+        except stripe.error.StripeError as e:
+            logger.warning(f"Failed to check payment link {payment_link_id}: {e}")
+            return False
+        try:
+            if active:
+                self.table.update_item(
+                    Key=self._key(fingerprint),
+                    UpdateExpression="SET verifiedAt = :now",
+                    ExpressionAttributeValues={":now": int(time())},
+                )
+            else:
+                logger.info(f"Payment link {payment_link_id} was deactivated in Stripe")
+                self.invalidate(fingerprint)
+        except Exception as e:
+            logger.warning(f"Failed to update cached payment link {payment_link_id}: {e}")
+        return active
+
+    def put(self, fingerprint: str, payment_link) -> None:
+        try:
+            self.table.put_item(
+                Item={
+                    **self._key(fingerprint),
+                    "paymentLinkId": payment_link.id,
+                    "url": payment_link.url,
+                    "active": bool(payment_link.active),
+                    "verifiedAt": int(time()),
+                    "expiresAt": int(time()) + self.ttl_seconds,
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Failed to cache payment link {payment_link.id}: {e}")
+
+    def invalidate(self, fingerprint: str) -> None:
+        """Stop reusing the link of a cart, e.g. after it was deactivated."""
+        self.table.update_item(
+            Key=self._key(fingerprint),
+            UpdateExpression="SET active = :inactive",
+            ExpressionAttributeValues={":inactive": False},
+        )
+
+
+def _resolve_line_items(products: List[Item], resolved: dict) -> List[dict]:
+    line_items, missing = [], []
+    for item in products:
+        entry = resolved.get(normalize_product_name(item.name))
+        if not entry:
+            missing.append(item.name)
+            continue
+        logger.debug(
+            f"Price found! Product ID: {entry.product_id}, Price ID: {entry.price_id}"
+        )
+        line_items.append({"price": entry.price_id, "quantity": item.quantity})
+
+    if missing:
+        raise UnresolvedProductsError(missing)
+    return canonical_line_items(line_items)
+
+
+def build_line_items(products: List[Item], price_resolver) -> List[dict]:
+    """
+    Resolve the cart items to canonical Stripe line items.
+
+    Raises:
+        UnresolvedProductsError: when any item has no matching product.
+    """
+    resolved = price_resolver.resolve(item.name for item in products)
+    return _resolve_line_items(products, resolved)
+
+
+def create_payment_link(
+    line_items: List[dict],
+    link_cache: PaymentLinkCache,
+    limiter: Optional[TokenBucket] = None,
+) -> str:
+    """
+    Return the URL of a payment link for the line items, reusing the link of
+    an identical cart when one is still active.
+
+    Args:
+        limiter: Shared Stripe rate limiter of concurrent callers; rate limit
+            errors are then retried with backoff.
+    """
+    fingerprint = cart_fingerprint(line_items)
+    cached_url = link_cache.get(fingerprint)
+    if cached_url:
+        logger.info(f"Reusing payment link for cart {fingerprint}")
+        return cached_url
+
+    # Create a payment link with all line items
+    if limiter is None:
+        payment_link = stripe.PaymentLink.create(
+            line_items=line_items,
+        )
+    else:
+        payment_link = call_with_backoff(
+            limiter, stripe.PaymentLink.create, line_items=line_items
+        )
+    link_cache.put(fingerprint, payment_link)
+    logger.info(f"Payment Link URL: {payment_link.url}")
+    return payment_link.url
+
+
+def create_payment_links(
+    carts: List[List[Item]],
+    price_resolver,
+    link_cache: PaymentLinkCache,
+    limiter: TokenBucket,
+    max_workers: int = 8,
+) -> List[dict]:
+    """
+    Create the payment links of several carts at once.
+
+    The distinct products of all carts are resolved with one resolver call,
+    identical carts share one link and links are created on at most
+    max_workers threads.
+
+    Returns:
+        list: One result per cart, in input order: {"index", "paymentLink"},
+        or {"index", "error"} plus "missingProducts" when items don't match
+        any product.
+    """
+    resolved = price_resolver.resolve(item.name for cart in carts for item in cart)
+
+    results = [{"index": index} for index in range(len(carts))]
+    line_items_by_cart: Dict[str, List[dict]] = {}
+    indexes_by_cart: Dict[str, List[int]] = {}
+    for index, cart in enumerate(carts):
+        if not cart:
+            results[index]["error"] = "Cart has no items"
+            continue
+        try:
+            line_items = _resolve_line_items(cart, resolved)
+        except UnresolvedProductsError as e:
+            results[index].update(error=str(e), missingProducts=e.names)
+            continue
+        fingerprint = cart_fingerprint(line_items)
+        line_items_by_cart[fingerprint] = line_items
+        indexes_by_cart.setdefault(fingerprint, []).append(index)
+
+    if indexes_by_cart:
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(indexes_by_cart))
+        ) as pool:
+            futures = {
+                fingerprint: pool.submit(
+                    create_payment_link, line_items, link_cache, limiter
+                )
+                for fingerprint, line_items in line_items_by_cart.items()
+            }
+        for fingerprint, future in futures.items():
+            try:
+                outcome = {"paymentLink": future.result()}
+            except stripe.error.StripeError as e:
+                logger.error(f"Failed to create payment link for cart {fingerprint}: {e}")
+                outcome = {"error": e.user_message or str(e)}
+            for index in indexes_by_cart[fingerprint]:
+                results[index].update(outcome)
+
+    logger.info(
+        f"Created links for {len(line_items_by_cart)} distinct carts of {len(carts)}"
+    )
+    return results
@@ -0,0 +1,96 @@
+from time import sleep
+from typing import Dict, Iterable, List
+
+from aws_lambda_powertools import Logger
+
+from utilities.stripe_catalog import CatalogEntry, StripeCatalog
+from grocerly_shared.products import normalize_product_name
+
+logger = Logger(child=True)
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+MAX_UNPROCESSED_RETRIES = 5
+
+
+def product_lookup_key(normalized_name: str) -> dict:
+    return {"PK": f"PRODUCTNAME#{normalized_name}", "SK": "STRIPEPRICE"}
+
+
+class DynamoDBPriceResolver:
+    """
+    Resolve cart product names to Stripe prices from the name lookup items that
+    create_stripe_products writes into GroceryAppTable.
+
+    Only names missing from the table are resolved through the Stripe catalog,
+    and those results are written back so the next cart finds them.
+    """
+
+    def __init__(self, table, fallback: StripeCatalog):
+        self.table = table
+        self.fallback = fallback
+
+    def resolve(self, product_names: Iterable[str]) -> Dict[str, CatalogEntry]:
+        """
+        Args:
+            product_names: Product names as written by the customer.
+
+        Returns:
+            dict: Normalized product name -> CatalogEntry for every name found.
+        """
+        names = {normalize_product_name(name) for name in product_names}
+        found = self._batch_get(sorted(names))
+
+        missing = names - found.keys()
+        if missing:
+            logger.info(f"Resolving {len(missing)} products through Stripe: {missing}")
+            from_stripe = self.fallback.resolve(missing)
+            self._write_back(from_stripe)
+            found.update(from_stripe)
+        return found
+
+    def _batch_get(self, names: List[str]) -> Dict[str, CatalogEntry]:
+        found = {}
+        client = self.table.meta.client
+        for start in range(0, len(names), BATCH_GET_LIMIT):
+            request = {
+                self.table.name: {
+                    "Keys": [
+                        product_lookup_key(name)
+                        for name in names[start : start + BATCH_GET_LIMIT]
+                    ],
+                    "ProjectionExpression": "PK, stripeProductId, stripePriceId, price",
+                }
+            }
+            for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+                response = client.batch_get_item(RequestItems=request)
+                for item in response["Responses"].get(self.table.name, []):
+                    name = item["PK"].split("#", 1)[1]
+                    found[name] = CatalogEntry(
+                        product_id=item["stripeProductId"],
+                        price_id=item["stripePriceId"],
+                        unit_amount=int(item["price"]) if "price" in item else None,
+                    )
+                request = response.get("UnprocessedKeys")
+                if not request:
+                    break
+                sleep(0.05 * 2**attempt)
+            else:
+                logger.warning("Giving up on unprocessed keys, falling back to Stripe")
+        return found
+
+    def _write_back(self, entries: Dict[str, CatalogEntry]) -> None:
+        try:
+            with self.table.batch_writer() as batch:
+                for name, entry in entries.items():
+                    item = {
+                        **product_lookup_key(name),
+                        "stripeProductId": entry.product_id,
+                        "stripePriceId": entry.price_id,
+                    }
+                    if entry.unit_amount is not None:
+                        item["price"] = entry.unit_amount
+                    batch.put_item(Item=item)
+        except Exception as e:
+            # The lookup items are only a cache of Stripe, never fail the cart on them
+            logger.warning(f"Failed to write product lookup items: {e}")
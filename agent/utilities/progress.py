@@ -0,0 +1,183 @@
+import json
+import queue
+import threading
+import urllib.request
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Optional
+
+import boto3
+from aws_lambda_powertools import Logger
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+
+logger = Logger(child=True)
+
+PUBLISH_MUTATION = """mutation Publish($data:String!,$detailType:String!,$id:String!,$source:String!,$account:String!,$time:String!,$region:String!){publish(data:$data,detailType:$detailType,id:$id,source:$source,account:$account,time:$time,region:$region){data detailType id source account time region}}"""
+
+# Trace details published to subscribers are cut to this many characters
+MAX_TRACE_TEXT = 1000
+
+
+class AppSyncPublisher:
+    """Calls the `publish` mutation of the AppSync API with IAM (SigV4) auth."""
+
+    def __init__(self, api_url: str, region: str, account: str, source: str):
+        self.api_url = api_url
+        self.region = region
+        self.account = account
+        self.source = source
+        self._credentials = boto3.Session().get_credentials()
+
+    def publish(self, detail_type: str, event_id: str, data: dict) -> None:
+        body = json.dumps(
+            {
+                "query": PUBLISH_MUTATION,
+                "variables": {
+                    "data": json.dumps(data),
+                    "detailType": detail_type,
+                    "id": event_id,
+                    "source": self.source,
+                    "account": self.account,
+                    "time": datetime.now(timezone.utc).isoformat(),
+                    "region": self.region,
+                },
+            }
+        ).encode()
+        request = AWSRequest(
+            method="POST",
+            url=self.api_url,
+            data=body,
+            headers={"Content-Type": "application/json"},
+        )
+        SigV4Auth(self._credentials, "appsync", self.region).add_auth(request)
+        with urllib.request.urlopen(
+            urllib.request.Request(
+                self.api_url, data=body, headers=dict(request.headers), method="POST"
+            ),
+            timeout=5,
+        ) as response:
+            result = json.loads(response.read())
+        if result.get("errors"):
+            raise RuntimeError(f"AppSync publish failed: {result['errors']}")
+
+
+class ProgressStream:
+    """
+    Publishes the agent completion to subscribers while it is being generated.
+
+    Chunks are coalesced into one publish per flush interval (or max_chars),
+    trace steps are published as they arrive. Publishing runs on a background
+    thread in arrival order so reading the agent stream never waits on AppSync,
+    and publish failures are logged without failing the invocation. The
+    thread also flushes chunks left pending once the interval has passed, so
+    the last chunks before a pause in the stream are not held back.
+    """
+
+    def __init__(
+        self,
+        publisher: Optional[AppSyncPublisher],
+        session_id: str,
+        detail_type: str = "agent-progress",
+        context: Optional[dict] = None,
+        flush_interval_seconds: float = 0.25,
+        max_chars: int = 2000,
+    ):
+        self.publisher = publisher
+        self.session_id = session_id
+        self.detail_type = detail_type
+        self.context = context or {}
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_chars = max_chars
+        self._pending = []
+        self._pending_chars = 0
+        self._last_flush = monotonic()
+        self._sequence = 0
+        self._queue = queue.Queue()
+        # Guards the pending chunks and the sequence, shared with the worker
+        self._lock = threading.Lock()
+        self._worker = None
+        if publisher is not None:
+            self._worker = threading.Thread(target=self._drain, daemon=True)
+            self._worker.start()
+
+    def status(self, status: str, **details) -> None:
+        with self._lock:
+            self._flush()
+            self._enqueue({"type": "status", "status": status, **details})
+
+    def add_chunk(self, text: str) -> None:
+        with self._lock:
+            self._pending.append(text)
+            self._pending_chars += len(text)
+            if (
+                self._pending_chars >= self.max_chars
+                or monotonic() - self._last_flush >= self.flush_interval_seconds
+            ):
+                self._flush()
+
+    def add_trace(self, trace: dict) -> None:
+        """Publish one step of the agent orchestration trace."""
+        steps = trace.get("trace", {}).get("orchestrationTrace", {})
+        with self._lock:
+            self._flush()
+            for step, details in steps.items():
+                text = None
+                if step == "rationale":
+                    text = details.get("text")
+                elif step == "invocationInput":
+                    text = json.dumps(details.get("actionGroupInvocationInput", details), default=str)
+                elif step == "observation":
+                    text = details.get("type")
+                self._enqueue(
+                    {"type": "trace", "step": step, "text": text[:MAX_TRACE_TEXT] if text else None}
+                )
+
+    def close(self, timeout_seconds: float = 5) -> None:
+        """Flush what is left and wait for the publishes to complete."""
+        with self._lock:
+            self._flush()
+        if self._worker is not None:
+            self._queue.put(None)
+            self._worker.join(timeout_seconds)
+
+    def _flush_if_due(self) -> None:
+        with self._lock:
+            if (
+                self._pending
+                and monotonic() - self._last_flush >= self.flush_interval_seconds
+            ):
+                self._flush()
+
+    def _flush(self) -> None:
+        # Called with the lock held
+        self._last_flush = monotonic()
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending, self._pending_chars = [], 0
+        self._enqueue({"type": "chunk", "text": text})
+
+    def _enqueue(self, data: dict) -> None:
+        if self.publisher is None:
+            return
+        self._sequence += 1
+        self._queue.put(
+            {**self.context, **data, "sessionId": self.session_id, "sequence": self._sequence}
+        )
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                data = self._queue.get(timeout=self.flush_interval_seconds)
+            except queue.Empty:
+                # The stream paused, publish the chunks still pending
+                self._flush_if_due()
+                continue
+            if data is None:
+                return
+            try:
+                self.publisher.publish(self.detail_type, self.session_id, data)
+            except Exception as e:
+                logger.warning(f"Failed to publish progress: {e}")
+            self._flush_if_due()
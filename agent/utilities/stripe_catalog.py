@@ -0,0 +1,159 @@
+import os
+import threading
+from time import monotonic
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import stripe
+from aws_lambda_powertools import Logger
+
+from grocerly_shared.products import normalize_product_name, price_lookup_key
+
+logger = Logger(child=True)
+
+# Price.list accepts at most 10 lookup_keys per request
+LOOKUP_KEYS_LIMIT = 10
+
+
+class CatalogEntry(NamedTuple):
+    product_id: str
+    price_id: str
+    unit_amount: Optional[int]
+
+
+class StripeCatalog:
+    """
+    Process-wide index of active Stripe products keyed by normalized product name.
+
+    Names missing from the index are first resolved in batches through the
+    deterministic price lookup_keys assigned by create_stripe_products. Only
+    names that still can't be found trigger a paged scan of the whole catalog,
+    at most once per min_refresh_interval_seconds. Entries expire after the
+    TTL and the whole index can be dropped with invalidate().
+    """
+
+    def __init__(self, ttl_seconds: int = 900, min_refresh_interval_seconds: int = 30):
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_interval_seconds = min_refresh_interval_seconds
+        self._entries: Dict[str, CatalogEntry] = {}
+        self._expires_at: Dict[str, float] = {}
+        self._scanned_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        """Drop the index so the next lookup goes back to Stripe."""
+        with self._lock:
+            self._entries = {}
+            self._expires_at = {}
+            self._scanned_at = None
+
+    def refresh(self) -> None:
+        """Rebuild the index with a full scan of the Stripe catalog."""
+        entries = self._scan_catalog()
+        with self._lock:
+            self._entries = {}
+            self._expires_at = {}
+            self._store(entries)
+            self._scanned_at = monotonic()
+        logger.info(f"Stripe catalog index built with {len(entries)} products")
+
+    def get(self, product_name: str) -> Optional[CatalogEntry]:
+        return self.resolve([product_name]).get(normalize_product_name(product_name))
+
+    def resolve(self, product_names: Iterable[str]) -> Dict[str, CatalogEntry]:
+        """
+        Resolve product names to catalog entries.
+
+        Args:
+            product_names: Product names as written by the customer.
+
+        Returns:
+            dict: Normalized product name -> CatalogEntry for every name found.
+        """
+        names = {normalize_product_name(name) for name in product_names}
+        now = monotonic()
+        with self._lock:
+            found = {
+                name: self._entries[name]
+                for name in names
+                if name in self._entries and self._expires_at[name] > now
+            }
+
+        missing = names - found.keys()
+        if missing:
+            by_lookup_key = self._resolve_lookup_keys(sorted(missing))
+            with self._lock:
+                self._store(by_lookup_key)
+            found.update(by_lookup_key)
+            missing -= by_lookup_key.keys()
+
+        # Products without a lookup_key (created before they were assigned) can
+        # only be found by name. Rescan at most once per interval so unknown
+        # names can't hammer Stripe.
+        if missing and (
+            self._scanned_at is None
+            or monotonic() - self._scanned_at > self.min_refresh_interval_seconds
+        ):
+            self.refresh()
+            with self._lock:
+                found.update(
+                    {name: self._entries[name] for name in missing if name in self._entries}
+                )
+        return found
+
+    def _store(self, entries: Dict[str, CatalogEntry]) -> None:
+        expires_at = monotonic() + self.ttl_seconds
+        for name, entry in entries.items():
+            self._entries[name] = entry
+            self._expires_at[name] = expires_at
+
+    @staticmethod
+    def _resolve_lookup_keys(names: List[str]) -> Dict[str, CatalogEntry]:
+        names_by_key = {price_lookup_key(name): name for name in names}
+        keys = list(names_by_key)
+        found = {}
+        for start in range(0, len(keys), LOOKUP_KEYS_LIMIT):
+            prices = stripe.Price.list(
+                lookup_keys=keys[start : start + LOOKUP_KEYS_LIMIT],
+                active=True,
+                limit=LOOKUP_KEYS_LIMIT,
+                expand=["data.product"],
+            )
+            for price in prices.data:
+                product = price.product
+                product_id = product if isinstance(product, str) else product.id
+                found[names_by_key[price.lookup_key]] = CatalogEntry(
+                    product_id=product_id,
+                    price_id=price.id,
+                    unit_amount=price.unit_amount,
+                )
+        return found
+
+    @staticmethod
+    def _scan_catalog() -> Dict[str, CatalogEntry]:
+        entries = {}
+        products = stripe.Product.list(
+            active=True, limit=100, expand=["data.default_price"]
+        )
+        for product in products.auto_paging_iter():
+            price = product.get("default_price")
+            if price is None:
+                # Products created without a default price: take the first price.
+                prices = stripe.Price.list(product=product.id, active=True, limit=1)
+                price = prices.data[0] if prices.data else None
+            if price is None:
+                logger.warning(f"Skipping product without price: {product.id}")
+                continue
+            if isinstance(price, str):
+                price = stripe.Price.retrieve(price)
+            entries.setdefault(
+                normalize_product_name(product.name),
+                CatalogEntry(
+                    product_id=product.id,
+                    price_id=price.id,
+                    unit_amount=price.unit_amount,
+                ),
+            )
+        return entries
+
+
+catalog = StripeCatalog(ttl_seconds=int(os.environ.get("CATALOG_TTL_SECONDS", "900")))
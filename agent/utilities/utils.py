@@ -1,71 +1,142 @@
 import re
 
-import boto3
-import json
-from typing import List, Optional
-from pydantic import BaseModel
+from typing import Dict, Iterator, List
 
+from grocerly_shared.models import ItemList, items_adapter
 
-def get_stripe_key() -> str:
-    """
-    Fetch Stripe secret key from AWS Secrets Manager.
-    Adjust the SecretId and region name based on your setup.
+# Start of a field inside an item, e.g. " quantity=" after a comma
+_FIELD = re.compile(r"\s*(name|quantity|unit)\s*=")
+_STRUCTURE = re.compile(r"[{},]")
+_BRACKETS_AND_BRACES = re.compile(r"[{}\[\]]")
+_NO_UNIT = {"", "null", "none"}
+
+
+def _iter_raw_items(text: str) -> Iterator[Dict[str, str]]:
     """
-    secret_name = "dev/stripe-secret"  # Replace with your actual secret name for Stripe
-    region_name = "us-east-1"  # Replace with your secrets region
+    Single pass over the agent's `[{name=..., quantity=..., unit=...}]`
+    serialization, yielding the raw field values of each top-level item.
 
-    # Create a session and Secrets Manager client
-    session = boto3.session.Session()
-    client = session.client(service_name="secretsmanager", region_name=region_name)
+    A comma only ends a field when the next field name follows it, so names
+    may contain commas; braces nested inside a value are kept as text.
+    """
+    depth = 0
+    position = 0
+    fields: Dict[str, str] = {}
+    field = None
+    value_start = 0
+    for match in _STRUCTURE.finditer(text):
+        char, index = match.group(), match.start()
+        if index < position:
+            continue
+        if depth == 0 and text[position:index].strip(" \t\r\n[],"):
+            raise ValueError(f"Unexpected text outside of an item at {position}")
+
+        if char == "{":
+            depth += 1
+            if depth > 1:
+                continue
+            field_match = _FIELD.match(text, index + 1)
+            if field_match is None:
+                raise ValueError(f"Item at {index} does not start with a field")
+            fields, field = {}, field_match.group(1)
+            value_start = position = field_match.end()
+        elif char == "}":
+            if depth == 0:
+                raise ValueError(f"Unbalanced '}}' at {index}")
+            depth -= 1
+            position = index + 1
+            if depth == 0:
+                fields[field] = text[value_start:index].strip()
+                yield fields
+        elif depth == 1:
+            field_match = _FIELD.match(text, index + 1)
+            if field_match is None:
+                # Comma inside a value
+                continue
+            fields[field] = text[value_start:index].strip()
+            field = field_match.group(1)
+            if field in fields:
+                raise ValueError(f"Duplicate field {field!r} at {index}")
+            value_start = position = field_match.end()
+        else:
+            position = index + 1
+
+    if depth:
+        raise ValueError("Unterminated item")
+    if text[position:].strip(" \t\r\n[],"):
+        raise ValueError(f"Unexpected text outside of an item at {position}")
+
+
+def _parse_items(text: str) -> ItemList:
+    raw_items = []
+    for fields in _iter_raw_items(text):
+        unit = fields.get("unit")
+        if unit is not None and unit.lower() in _NO_UNIT:
+            fields["unit"] = None
+        raw_items.append(fields)
+
+    return ItemList(products=items_adapter.validate_python(raw_items))
 
-    try:
-        # Retrieve the secret value
-        response = client.get_secret_value(SecretId=secret_name)
-        secret_string = response[
-            "SecretString"
-        ]  # e.g., '{"STRIPE_SECRET_KEY": "sk_test_123..."}'
-        secret_dict = json.loads(secret_string)
 
-        # Adjust the key used here to match your secret's JSON structure
-        return secret_dict.get("STRIPE_SECRET_KEY", "")
-    except Exception as e:
-        print(f"Error retrieving Stripe secret key: {e}")
-        return ""
+def parse_raw_items(raw_data: List[str]) -> ItemList:
+    """
+    Parse the products parameter of the Bedrock agent.
 
+    Args:
+        raw_data: The agent's `[{name=..., quantity=..., unit=...}]` list,
+            split on commas by the action group.
 
-class Item(BaseModel):
-    name: str
-    quantity: int
-    unit: Optional[str] = None  # Make unit optional
+    Raises:
+        ValueError: When the list is malformed or an item is invalid.
+    """
+    # The action group splits the array on commas, including those in names
+    return _parse_items(",".join(raw_data))
 
 
-class ItemList(BaseModel):
-    products: List[Item]
+def parse_raw_carts(raw_data: List[str]) -> List[ItemList]:
+    """
+    Parse the carts parameter of the Bedrock agent, a list of product lists
+    (`[[{name=..., ...}, ...], [...]]`) split on commas by the action group.
 
+    Carts are the innermost brackets outside of any item; empty carts are
+    kept so every cart keeps its index.
 
-def parse_raw_items(raw_data: List[str]) -> ItemList:
-    # Join the list into a single string and normalize spacing
-    raw_string = " ".join(raw_data)
-    raw_string = re.sub(r"\s+", " ", raw_string).strip()
-
-    # Update regex to make unit optional
-    matches = re.findall(
-        r"name=([^,]+?)\s+quantity=(\d+)(?:\s+unit=([^}]+))?", raw_string
-    )
-
-    # Convert to structured data
-    items = [
-        Item(
-            name=name.strip(),
-            quantity=int(quantity),
-            unit=unit.strip() if unit else None,
-        )
-        for name, quantity, unit in matches
-    ]
-
-    return ItemList(products=items)
-
-
-"""data = ['[{name=Fresh Smoothies', ' quantity=2}', ' {name=fresh strawberries', ' quantity=3}', ' {name=mixed fruits', ' quantity=4}', ' {name=packaged fruits', ' quantity=2}', ' {name=Pineapples', ' quantity=5}]']
-result = parse_raw_items(data)
-print("parsed_items:", result.products[0].name)"""
+    Raises:
+        ValueError: When a cart is malformed or an item is invalid.
+    """
+    text = ",".join(raw_data)
+    brackets, depth = [], 0
+    for match in _BRACKETS_AND_BRACES.finditer(text):
+        char = match.group()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            brackets.append((char, match.start()))
+
+    cart_level, level = 0, 0
+    for char, _ in brackets:
+        level += 1 if char == "[" else -1
+        cart_level = max(cart_level, level)
+
+    carts, level, start, outside = [], 0, 0, []
+    for char, index in brackets:
+        if char == "[":
+            level += 1
+            if level == cart_level:
+                outside.append(text[start:index])
+                start = index + 1
+        else:
+            if level == cart_level:
+                carts.append(_parse_items(text[start:index]))
+                start = index + 1
+            level -= 1
+            if level < 0:
+                raise ValueError(f"Unbalanced ']' at {index}")
+    if level:
+        raise ValueError("Unterminated cart")
+    outside.append(text[start:])
+    if any("{" in segment for segment in outside):
+        raise ValueError("Item outside of a cart")
+    return carts
\ No newline at end of file
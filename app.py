@@ -13,12 +13,23 @@ sqs_stack = SQSStack(app, "SQSStack")
 # Create the database stack
 db_stack = DatabaseStack(app, "DatabaseStack")
 
+# cdk deploy -c enable_express_image_workflow=false sends images through the
+# Standard workflow as well
+express_context = app.node.try_get_context("enable_express_image_workflow")
+enable_express_image_workflow = str(express_context).lower() != "false"
+
+# cdk deploy -c extraction_mode=bedrock calls Bedrock from the state machine
+# instead of buffering every document in the SQS queue for the poller
+extraction_mode = app.node.try_get_context("extraction_mode") or "sqs"
+
 # Create the API and Lambda stack, passing the DynamoDB table
 api_lambda_stack = ApiLambdaS3SfnStack(
     app,
     "ApiLambdaS3SfnStack",
     sqs_queue=sqs_stack.sqs_queue,
     ecommerce_table=db_stack.ecommerce_table,
+    enable_express_image_workflow=enable_express_image_workflow,
+    extraction_mode=extraction_mode,
 )
 
 pipes_eb_stack = PipesAndEventbridgeStack(
@@ -37,6 +48,7 @@ ai_agent_stack = AiAgentStack(
     secret=api_lambda_stack.secret,
     invoke_agent_lambda=api_lambda_stack.invoke_agent_lambda,
     ecommerce_table=db_stack.ecommerce_table,
+    shared_layer=api_lambda_stack.shared_layer,
 )
 
 app.synth()
@@ -1,50 +1,191 @@
+import codecs
 import json
 import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from time import monotonic, sleep
 
 import boto3
+from boto3.dynamodb.types import TypeSerializer
 
-dynamodb = boto3.resource('dynamodb')
+dynamodb_client = boto3.client('dynamodb')
+s3_client = boto3.client('s3')
 table_name = os.environ.get("ECOMMERCE_TABLE_NAME")
-table = dynamodb.Table(table_name)
 
-with open("product_list.json", "r") as product_list:
-    product_list = json.load(product_list)
+# BatchWriteItem accepts at most 25 items per request
+BATCH_SIZE = 25
+WRITE_CONCURRENCY = int(os.environ.get("WRITE_CONCURRENCY", "8"))
+MAX_UNPROCESSED_RETRIES = 8
+READ_CHUNK_SIZE = 64 * 1024
+
+serializer = TypeSerializer()
+
+
+def iter_json_lines(stream):
+    """Yield one product per non-empty line of a JSON-lines body."""
+    for line in stream.iter_lines():
+        if line.strip():
+            yield json.loads(line, parse_float=Decimal)
+
+
+def iter_json_array(stream):
+    """
+    Yield the elements of a top-level JSON array without loading the whole
+    body: only the current chunk and the element being decoded are in memory.
+    """
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    for chunk in stream.iter_chunks(READ_CHUNK_SIZE):
+        buffer += utf8.decode(chunk)
+        position = 0
+        while True:
+            # Skip whitespace, the opening bracket and separators
+            while position < len(buffer) and buffer[position] in " \t\r\n,[]":
+                if buffer[position] == "[":
+                    started = True
+                position += 1
+            if position >= len(buffer):
+                break
+            if not started:
+                raise ValueError("Catalog object is not a JSON array")
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The element continues in the next chunk
+                break
+            yield element
+            position = end
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise ValueError("Truncated catalog object")
+
+
+def iter_s3_products(bucket, key):
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    if key.endswith((".jsonl", ".ndjson")):
+        return iter_json_lines(body)
+    return iter_json_array(body)
+
+
+def iter_bundled_products():
+    with open("product_list.json", "r") as product_list:
+        yield from json.load(product_list, parse_float=Decimal)
+
+
+def product_item(item):
+    return {
+        "PK": f"PRODUCT",
+        "SK": f"PRODUCT#{item['productId']}",
+        "productId": item["productId"],
+        "category": item["category"],
+        "createdDate": item["createdDate"],
+        "description": item["description"],
+        "modifiedDate": item["modifiedDate"],
+        "name": item["name"],
+        "package": item["package"],
+        "pictures": item["pictures"],
+        "price": item["price"],
+        "tags": item["tags"],
+    }
+
+
+def write_batch(items):
+    """
+    Write up to 25 items with BatchWriteItem, retrying UnprocessedItems with
+    exponential backoff. Returns the number of items that could not be written.
+    """
+    request = {
+        table_name: [
+            {
+                "PutRequest": {
+                    "Item": {k: serializer.serialize(v) for k, v in item.items()}
+                }
+            }
+            for item in items
+        ]
+    }
+    for attempt in range(MAX_UNPROCESSED_RETRIES + 1):
+        try:
+            response = dynamodb_client.batch_write_item(RequestItems=request)
+        except dynamodb_client.exceptions.ProvisionedThroughputExceededException:
+            response = {"UnprocessedItems": request}
+        request = response.get("UnprocessedItems")
+        if not request:
+            return 0
+        sleep(random.uniform(0, 0.05 * 2**attempt))
+    return len(request.get(table_name, []))
+
+
+def ingest(products):
+    """
+    Fan 25-item batches out over a bounded pool of writers. At most
+    2 * WRITE_CONCURRENCY batches are buffered, so memory stays bounded
+    whatever the catalog size.
+    """
+    started = monotonic()
+    slots = threading.BoundedSemaphore(2 * WRITE_CONCURRENCY)
+    lock = threading.Lock()
+    counts = {"rows": 0, "failed": 0, "invalid": 0}
+
+    def on_done(future, size):
+        try:
+            unprocessed = future.result()
+        except Exception as e:
+            print(f"Exception: {e}")
+            unprocessed = size
+        with lock:
+            counts["rows"] += size - unprocessed
+            counts["failed"] += unprocessed
+        slots.release()
+
+    def submit(pool, batch):
+        slots.acquire()
+        future = pool.submit(write_batch, batch)
+        future.add_done_callback(lambda f, size=len(batch): on_done(f, size))
+
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as pool:
+        batch = []
+        for product in products:
+            try:
+                batch.append(product_item(product))
+            except KeyError as e:
+                print(f"Skipping invalid product, missing {e}")
+                counts["invalid"] += 1
+                continue
+            if len(batch) == BATCH_SIZE:
+                submit(pool, batch)
+                batch = []
+        if batch:
+            submit(pool, batch)
+
+    elapsed = monotonic() - started
+    return {
+        **counts,
+        "elapsedSeconds": round(elapsed, 3),
+        "rowsPerSecond": round(counts["rows"] / elapsed, 2) if elapsed else 0.0,
+    }
+
 
 def handler(event, context):
-    print("Retrieving all products: %s", product_list)
-    print(f"item id is {product_list[0]['productId']}")
+    # AppSync passes the mutation arguments, direct invocations the keys themselves
+    arguments = (event or {}).get("arguments") or event or {}
+    bucket = arguments.get("bucket") or os.environ.get("CATALOG_BUCKET_NAME")
+    key = arguments.get("key")
 
     try:
-        with table.batch_writer() as batch:
-            for item in product_list:
-                batch.put_item(
-                    Item={
-                        "PK": f"PRODUCT",
-                        "SK": f"PRODUCT#{item['productId']}",
-                        "productId": item["productId"],
-                        "category": item["category"],
-                        "createdDate": item["createdDate"],
-                        "description": item["description"],
-                        "modifiedDate": item["modifiedDate"],
-                        "name": item["name"],
-                        "package": item["package"],
-                        "pictures": item["pictures"],
-                        "price": item["price"],
-                        "tags": item["tags"],
-                    }
-                )
-        return True
+        if bucket and key:
+            print(f"Streaming catalog from s3://{bucket}/{key}")
+            products = iter_s3_products(bucket, key)
+        else:
+            print("Loading bundled product_list.json")
+            products = iter_bundled_products()
+        report = ingest(products)
+        print(f"Ingest report: {report}")
+        return json.dumps(report)
     except Exception as e:
         print(f"Exception: {e}")
-        return False
-
-
-
-
-
-
-
-
-
-
-
+        return json.dumps({"error": str(e)})
@@ -0,0 +1,91 @@
+"""
+Accuracy and latency of the sqs_poller fast-path grocery list parser.
+
+Every corpus document is labeled with the items the fast path must return, or
+null when the document must fall through to Bedrock. Run from the repository
+root:
+
+    python -m benchmarks.fast_path_parser.benchmark [--threshold 0.9] [--rounds 200]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from time import perf_counter
+
+from sqs_poller.fast_path_parser import parse_grocery_list
+
+CORPUS = os.path.join(os.path.dirname(__file__), "corpus.json")
+
+
+def _items(result):
+    return [
+        {"name": item.name, "quantity": item.quantity, "unit": item.unit}
+        for item in result.items
+    ]
+
+
+def evaluate(corpus, threshold):
+    accepted = correct = false_accepts = wrong_items = 0
+    for document in corpus:
+        result = parse_grocery_list(document["text"])
+        if result.confidence < threshold:
+            continue
+        accepted += 1
+        if document["expected"] is None:
+            false_accepts += 1
+            print(f"false accept: {document['text']!r}")
+        elif _items(result) == document["expected"]:
+            correct += 1
+        else:
+            wrong_items += 1
+            print(f"wrong items: {document['text']!r} -> {_items(result)}")
+
+    should_accept = sum(document["expected"] is not None for document in corpus)
+    return {
+        "documents": len(corpus),
+        "accepted": accepted,
+        "precision": round(correct / accepted, 3) if accepted else 1.0,
+        "recall": round(correct / should_accept, 3) if should_accept else 1.0,
+        "false_accepts": false_accepts,
+        "wrong_items": wrong_items,
+    }
+
+
+def measure_latency(corpus, rounds):
+    timings = []
+    for _ in range(rounds):
+        for document in corpus:
+            started = perf_counter()
+            parse_grocery_list(document["text"])
+            timings.append((perf_counter() - started) * 1e6)
+    timings.sort()
+    return {
+        "mean_us": round(statistics.fmean(timings), 1),
+        "p50_us": round(timings[len(timings) // 2], 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with open(CORPUS) as corpus_file:
+        corpus = json.load(corpus_file)
+
+    report = {
+        "threshold": args.threshold,
+        **evaluate(corpus, args.threshold),
+        **measure_latency(corpus, args.rounds),
+    }
+    print(json.dumps(report, indent=2))
+    # Accepting a document that is not a clean list is the costly mistake
+    return 1 if report["false_accepts"] or report["wrong_items"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+Throughput of the agent's parse_raw_items on carts of 10 to 10,000 items.
+
+Carts are serialized the way the Bedrock agent sends them and split on commas
+like the action group does; names with commas and items without a unit are
+mixed in. Run from the repository root:
+
+    python -m benchmarks.parse_raw_items.benchmark [--sizes 10 100 1000 10000] [--rounds 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+from time import perf_counter
+
+for directory in ("agent", "layers/shared"):
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", directory))
+
+from utilities.utils import parse_raw_items  # noqa: E402
+
+NAMES = ["Fresh Smoothies", "Salt, sea, coarse", "Pineapples", "Bread {whole wheat}"]
+UNITS = ["kg", None, "pack", "lb"]
+
+
+def build_cart(size):
+    items = []
+    for index in range(size):
+        name = f"{NAMES[index % len(NAMES)]} {index}"
+        unit = UNITS[index % len(UNITS)]
+        fields = f"name={name}, quantity={index % 9 + 1}"
+        items.append(f"{{{fields}, unit={unit}}}" if unit else f"{{{fields}}}")
+    return f"[{', '.join(items)}]".split(",")
+
+
+def measure(size, rounds):
+    raw_data = build_cart(size)
+    parsed = parse_raw_items(raw_data)
+    if len(parsed.products) != size:
+        raise AssertionError(f"parsed {len(parsed.products)} of {size} items")
+
+    timings = []
+    for _ in range(rounds):
+        started = perf_counter()
+        parse_raw_items(raw_data)
+        timings.append(perf_counter() - started)
+    median = statistics.median(timings)
+    return {
+        "items": size,
+        "median_ms": round(median * 1000, 3),
+        "items_per_second": round(size / median),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    print(json.dumps([measure(size, args.rounds) for size in args.sizes], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
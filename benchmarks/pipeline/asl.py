@@ -0,0 +1,339 @@
+"""
+Local executor for the JSONata state machine definitions in state_machine/.
+
+Supports the states and integrations the definitions use: Pass, Choice, Wait,
+Succeed, Fail, Task (with Retry, Catch and .waitForTaskToken), Map and
+Parallel. Task resources are dispatched to plain Python callables and boto3
+style clients, so the harness decides what is real and what is faked.
+"""
+import json
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from time import sleep
+
+import jsonata
+
+WAIT_FOR_TASK_TOKEN = ".waitForTaskToken"
+# Stands in for $states.context.Task.Token until the task starts
+PENDING_TOKEN = "__pending_task_token__"
+
+
+class StatesError(Exception):
+    def __init__(self, error: str, cause: str = ""):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+class TaskDoesNotExist(StatesError):
+    def __init__(self, token: str):
+        super().__init__("TaskDoesNotExist", token)
+
+
+class ExecutionAlreadyExists(StatesError):
+    def __init__(self, name: str):
+        super().__init__("ExecutionAlreadyExists", name)
+
+
+def _snake_case(action: str) -> str:
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", action[0].upper() + action[1:]).lower()
+
+
+def _matches(error_equals, error: str) -> bool:
+    return "States.ALL" in error_equals or error in error_equals
+
+
+class LocalStateMachine:
+    """
+    Runs executions of one state machine definition on a thread pool.
+
+    Args:
+        definition: The ASL document as text, with ${...} placeholders.
+        clients: Service name -> boto3 style client serving the optimized
+            (arn:aws:states:::sqs:sendMessage) and aws-sdk integrations.
+        functions: Lambda function name -> handler(event, context).
+        recorder: Collects the duration of every state as "state:<name>".
+        substitutions: Values of the ${...} definition placeholders.
+        wait_scale: Multiplier applied to Wait states and retry intervals.
+    """
+
+    def __init__(
+        self,
+        definition: str,
+        clients: dict,
+        functions: dict,
+        recorder,
+        context_factory,
+        substitutions: dict = None,
+        wait_scale: float = 1.0,
+        task_timeout_seconds: float = 60,
+        max_executions: int = 32,
+        on_complete=None,
+    ):
+        for name, value in (substitutions or {}).items():
+            definition = definition.replace("${%s}" % name, value)
+        self.definition = json.loads(definition)
+        self.clients = clients
+        self.functions = functions
+        self.recorder = recorder
+        self.context_factory = context_factory
+        self.wait_scale = wait_scale
+        self.task_timeout_seconds = task_timeout_seconds
+        self.on_complete = on_complete
+        self._pool = ThreadPoolExecutor(max_workers=max_executions)
+        self._executions = []
+        self._inputs = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    # Step Functions API used by the handlers
+
+    exceptions = SimpleNamespace(
+        TaskDoesNotExist=TaskDoesNotExist,
+        TaskTimedOut=TaskDoesNotExist,
+        InvalidToken=TaskDoesNotExist,
+        ExecutionAlreadyExists=ExecutionAlreadyExists,
+    )
+
+    def start_execution(self, stateMachineArn: str, input: str = "{}", name: str = None):
+        name = name or str(uuid.uuid4())
+        execution_arn = f"{stateMachineArn.replace(':stateMachine:', ':execution:')}:{name}"
+        with self._lock:
+            # Like Standard workflows: same name and input is idempotent
+            if name in self._inputs:
+                if self._inputs[name] != input:
+                    raise ExecutionAlreadyExists(name)
+                return {"executionArn": execution_arn}
+            self._inputs[name] = input
+            self._executions.append(
+                self._pool.submit(self._run_execution, execution_arn, name, json.loads(input))
+            )
+        return {"executionArn": execution_arn}
+
+    def send_task_success(self, taskToken: str, output: str):
+        self._resolve(taskToken, json.loads(output), None)
+        return {}
+
+    def send_task_failure(self, taskToken: str, error: str = "", cause: str = ""):
+        self._resolve(taskToken, None, StatesError(error, cause))
+        return {}
+
+    def wait(self, timeout: float = None):
+        """Wait for every started execution; returns their (output, error) pairs."""
+        with self._lock:
+            executions = list(self._executions)
+        return [future.result(timeout) for future in executions]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # Execution
+
+    def _run_execution(self, execution_arn, name, execution_input):
+        context = {
+            "Execution": {"Id": execution_arn, "Name": name, "Input": execution_input},
+            "StateMachine": {"Id": execution_arn.rsplit(":", 1)[0]},
+        }
+        output, error = None, None
+        with self.recorder.stage("state_machine"):
+            try:
+                output = self._run_states(self.definition, execution_input, context, {})
+            except StatesError as e:
+                error = e
+        if self.on_complete:
+            self.on_complete(execution_input, output, error)
+        return output, error
+
+    def _run_states(self, machine, state_input, context, variables):
+        name = machine["StartAt"]
+        while True:
+            state = machine["States"][name]
+            with self.recorder.stage(f"state:{name}"):
+                state_input, next_name = self._run_state(state, state_input, context, variables)
+            if next_name is None:
+                return state_input
+            name = next_name
+
+    def _run_state(self, state, state_input, context, variables):
+        kind = state["Type"]
+        states = {"input": state_input, "context": context}
+        next_name = None if state.get("End") else state.get("Next")
+
+        if kind == "Fail":
+            raise StatesError(state.get("Error", "States.Fail"), state.get("Cause", ""))
+        if kind == "Succeed":
+            return state_input, None
+        if kind == "Choice":
+            next_name = state.get("Default")
+            for choice in state["Choices"]:
+                if self._evaluate(choice["Condition"], states, variables):
+                    next_name = choice["Next"]
+                    break
+            if next_name is None:
+                raise StatesError("States.NoChoiceMatched")
+            return self._output(state, states, variables, state_input), next_name
+        if kind == "Wait":
+            sleep(float(self._evaluate(state.get("Seconds", 0), states, variables)) * self.wait_scale)
+            return state_input, next_name
+        if kind == "Pass":
+            return self._output(state, states, variables, state_input), next_name
+
+        try:
+            if kind == "Task":
+                result = self._run_task(state, states, variables, context)
+            elif kind == "Map":
+                result = self._run_map(state, states, variables, context)
+            elif kind == "Parallel":
+                result = self._run_parallel(state, states, variables, context)
+            else:
+                raise StatesError("States.Runtime", f"Unsupported state type {kind}")
+        except StatesError as e:
+            for catcher in state.get("Catch", []):
+                if _matches(catcher["ErrorEquals"], e.error):
+                    states = {**states, "errorOutput": {"Error": e.error, "Cause": e.cause}}
+                    output = self._output(catcher, states, variables, states["errorOutput"])
+                    return output, catcher["Next"]
+            raise
+
+        states = {**states, "result": result}
+        return self._output(state, states, variables, result), next_name
+
+    def _output(self, state, states, variables, default):
+        if "Assign" in state:
+            variables.update(self._evaluate(state["Assign"], states, variables))
+        if "Output" in state:
+            return self._evaluate(state["Output"], states, variables)
+        return default
+
+    def _run_task(self, state, states, variables, context):
+        resource = state["Resource"]
+        arguments = self._evaluate(state.get("Arguments", {}), states, variables)
+        retriers = state.get("Retry", [])
+        attempts = [0] * len(retriers)
+        while True:
+            try:
+                return self._invoke(resource, arguments, state)
+            except StatesError as e:
+                for index, retrier in enumerate(retriers):
+                    if not _matches(retrier["ErrorEquals"], e.error):
+                        continue
+                    if attempts[index] >= retrier.get("MaxAttempts", 3):
+                        raise
+                    delay = retrier.get("IntervalSeconds", 1) * retrier.get(
+                        "BackoffRate", 2.0
+                    ) ** attempts[index]
+                    attempts[index] += 1
+                    sleep(delay * self.wait_scale)
+                    break
+                else:
+                    raise
+
+    def _invoke(self, resource, arguments, state):
+        if not resource.endswith(WAIT_FOR_TASK_TOKEN):
+            return self._call(resource, arguments)
+
+        # The token is only known here, so the arguments referencing
+        # $states.context.Task.Token are evaluated again with it
+        token = str(uuid.uuid4())
+        waiter = {"event": threading.Event()}
+        with self._lock:
+            self._tokens[token] = waiter
+        try:
+            arguments = json.loads(json.dumps(arguments).replace(PENDING_TOKEN, token))
+            self._call(resource[: -len(WAIT_FOR_TASK_TOKEN)], arguments)
+            timeout = state.get("TimeoutSeconds", self.task_timeout_seconds)
+            if not waiter["event"].wait(timeout):
+                raise StatesError("States.Timeout", "Task token was not returned in time")
+        finally:
+            with self._lock:
+                self._tokens.pop(token, None)
+        if waiter["error"] is not None:
+            raise waiter["error"]
+        return waiter["output"]
+
+    def _resolve(self, token, output, error):
+        with self._lock:
+            waiter = self._tokens.get(token)
+        if waiter is None:
+            raise TaskDoesNotExist(token)
+        waiter["output"], waiter["error"] = output, error
+        waiter["event"].set()
+
+    def _call(self, resource, arguments):
+        service_action = resource.split(":::", 1)[1]
+        if service_action.startswith("aws-sdk:"):
+            service_action = service_action[len("aws-sdk:"):]
+        service, action = service_action.split(":", 1)
+
+        if service == "lambda" and action == "invoke":
+            function_name = arguments["FunctionName"]
+            handler = self.functions[function_name.split(":")[-1]]
+            try:
+                payload = handler(arguments.get("Payload"), self.context_factory(function_name))
+            except Exception as e:
+                raise StatesError(type(e).__name__, str(e))
+            return {"Payload": payload, "StatusCode": 200}
+
+        if service == "sqs" and not isinstance(arguments.get("MessageBody"), str):
+            arguments = {**arguments, "MessageBody": json.dumps(arguments["MessageBody"])}
+        client = self.clients[service]
+        try:
+            return getattr(client, _snake_case(action))(**arguments)
+        except StatesError:
+            raise
+        except Exception as e:
+            code = getattr(e, "response", {}).get("Error", {}).get("Code", type(e).__name__)
+            raise StatesError(f"{service.capitalize()}.{code}", str(e))
+
+    def _run_map(self, state, states, variables, context):
+        items = self._evaluate(state.get("Items", "{% $states.input %}"), states, variables)
+        processor = state["ItemProcessor"]
+
+        def run_item(index_item):
+            index, item = index_item
+            item_context = {**context, "Map": {"Item": {"Index": index, "Value": item}}}
+            item_input = item
+            if "ItemSelector" in state:
+                item_input = self._evaluate(
+                    state["ItemSelector"], {**states, "context": item_context}, variables
+                )
+            return self._run_states(processor, item_input, item_context, dict(variables))
+
+        max_concurrency = state.get("MaxConcurrency") or len(items) or 1
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            return list(pool.map(run_item, enumerate(items)))
+
+    def _run_parallel(self, state, states, variables, context):
+        branches = state["Branches"]
+        with ThreadPoolExecutor(max_workers=len(branches)) as pool:
+            return list(
+                pool.map(
+                    lambda branch: self._run_states(
+                        branch, states["input"], context, dict(variables)
+                    ),
+                    branches,
+                )
+            )
+
+    def _evaluate(self, template, states, variables):
+        if isinstance(template, dict):
+            return {key: self._evaluate(value, states, variables) for key, value in template.items()}
+        if isinstance(template, list):
+            return [self._evaluate(value, states, variables) for value in template]
+        if not isinstance(template, str):
+            return template
+        stripped = template.strip()
+        if not (stripped.startswith("{%") and stripped.endswith("%}")):
+            return template
+
+        if "context" in states and "Task" not in states["context"]:
+            states = {**states, "context": {**states["context"], "Task": {"Token": PENDING_TOKEN}}}
+        expression = jsonata.Jsonata(stripped[2:-2])
+        expression.assign("states", states)
+        for name, value in variables.items():
+            expression.assign(name, value)
+        return expression.evaluate(None)
+
@@ -0,0 +1,435 @@
+"""
+End-to-end latency of the ingestion pipeline, from S3 upload to stored payment link.
+
+The real handlers (step_functions_workflow_trigger, sqs_poller, invoke_agent
+and the agent action group in agent/app.py) are wired together through a
+local executor of state_machine_definition.asl.json. S3, SQS, DynamoDB and
+Secrets Manager are moto; Stripe is a local HTTP server; Bedrock, the Bedrock
+agent and Textract are stubs with configurable latency. Install the harness
+dependencies and run from the repository root:
+
+    pip install -r benchmarks/pipeline/requirements.txt
+    python -m benchmarks.pipeline.benchmark [--documents 40] [--baseline report.json]
+
+Reports p50/p95/p99 per stage (every handler and every state) and the calls
+made to each external service. With --baseline, exits 1 when a stage p95 or a
+call count grows past --tolerance, so regressions fail CI.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+from time import perf_counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+BUCKET_NAME = "grocerly-harness-uploads"
+QUEUE_NAME = "grocerly-harness-queue"
+TABLE_NAME = "GroceryAppTable"
+STATE_MACHINE_ARN = "arn:aws:states:us-east-1:123456789012:stateMachine:GroceryHarness"
+
+# (name, unit amount in cents); the first SEEDED_PRODUCTS have DynamoDB lookup
+# items, the others are only found in Stripe
+CATALOG = [
+    ("apples", 299),
+    ("milk", 149),
+    ("eggs", 349),
+    ("bread", 249),
+    ("bananas", 99),
+    ("chicken breast", 899),
+    ("rice", 399),
+    ("tomatoes", 199),
+    ("cheddar cheese", 549),
+    ("orange juice", 429),
+]
+SEEDED_PRODUCTS = 8
+
+
+def configure_environment():
+    """Environment the handlers read at import time."""
+    os.environ.update(
+        {
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_SESSION_TOKEN": "testing",
+            "AWS_DEFAULT_REGION": "us-east-1",
+            "AWS_REGION": "us-east-1",
+            "ECOMMERCE_TABLE_NAME": TABLE_NAME,
+            "TEXT_STORE_BUCKET": BUCKET_NAME,
+            "STATE_MACHINE_ARN": STATE_MACHINE_ARN,
+            "AGENT_ID": "HARNESSAGENT",
+            "AGENT_ALIAS": "TSTALIASID",
+            "POWERTOOLS_LOG_LEVEL": "ERROR",
+            "POWERTOOLS_TRACE_DISABLED": "true",
+            "POWERTOOLS_METRICS_DISABLED": "true",
+            "POWERTOOLS_METRICS_NAMESPACE": "grocerly_harness",
+        }
+    )
+    for directory in (
+        "agent",
+        "sqs_poller",
+        "step_functions_workflow_trigger",
+        "textract_completion",
+        "textract_results",
+        "layers/shared",
+    ):
+        sys.path.insert(0, os.path.join(ROOT, directory))
+
+
+class LambdaContext:
+    def __init__(self, function_name: str, timeout_ms: int = 120000):
+        self.function_name = function_name.split(":")[-1]
+        self.function_version = "$LATEST"
+        self.invoked_function_arn = f"arn:aws:lambda:us-east-1:123456789012:function:{self.function_name}"
+        self.memory_limit_in_mb = 512
+        self.aws_request_id = "harness"
+        self.log_group_name = f"/aws/lambda/{self.function_name}"
+        self.log_stream_name = "harness"
+        self._deadline = perf_counter() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - perf_counter()) * 1000))
+
+
+def build_documents(count: int, pdf_every: int):
+    """
+    Cycle through typed lists (fast path), prose lists (model) and documents
+    without a list. Returns (key, text, model answer) triples.
+    """
+    documents = []
+    for index in range(count):
+        quantity = index % 3 + 1
+        first, second, third = (CATALOG[(index + offset) % len(CATALOG)][0] for offset in range(3))
+        kind = index % 3
+        if kind == 0:
+            text = f"Shopping list:\n- {first} {quantity}\n- {second} - 2\n- {third}: 1"
+            answer = None
+        elif kind == 1:
+            text = (
+                f"Hi! On your way home could you pick up {quantity} {first},\n"
+                f"a couple of {second} and one {third}? Thanks!"
+            )
+            answer = [
+                {"name": first, "quantity": quantity, "unit": None},
+                {"name": second, "quantity": 2, "unit": None},
+                {"name": third, "quantity": 1, "unit": None},
+            ]
+        else:
+            text = f"Meeting notes {index}\nDiscussed the quarterly roadmap.\nNext sync on Monday."
+            answer = None
+        extension = "pdf" if pdf_every and index % pdf_every == 0 else "png"
+        documents.append((f"uploads/document-{index}.{extension}", text, answer))
+    return documents
+
+
+def s3_event(bucket: str, key: str, size: int, etag: str) -> dict:
+    return {
+        "Records": [
+            {
+                "eventVersion": "2.1",
+                "eventSource": "aws:s3",
+                "awsRegion": "us-east-1",
+                "eventName": "ObjectCreated:Put",
+                "s3": {
+                    "s3SchemaVersion": "1.0",
+                    "bucket": {"name": bucket, "arn": f"arn:aws:s3:::{bucket}"},
+                    "object": {"key": key, "size": size, "eTag": etag},
+                },
+            }
+        ]
+    }
+
+
+class SqsEventSource:
+    """Event source mapping polling the queue and invoking the poller with batches."""
+
+    def __init__(self, sqs_client, queue_url, handler, recorder, batch_size=10):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.handler = handler
+        self.recorder = recorder
+        self.batch_size = batch_size
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        queue_arn = f"arn:aws:sqs:us-east-1:123456789012:{QUEUE_NAME}"
+        while not self._stopped.is_set():
+            messages = self.sqs_client.receive_message(
+                QueueUrl=self.queue_url,
+                MaxNumberOfMessages=self.batch_size,
+                AttributeNames=["ApproximateReceiveCount"],
+            ).get("Messages", [])
+            if not messages:
+                self._stopped.wait(0.01)
+                continue
+            event = {
+                "Records": [
+                    {
+                        "messageId": message["MessageId"],
+                        "receiptHandle": message["ReceiptHandle"],
+                        "body": message["Body"],
+                        "attributes": message.get("Attributes", {}),
+                        "messageAttributes": {},
+                        "md5OfBody": message["MD5OfBody"],
+                        "eventSource": "aws:sqs",
+                        "eventSourceARN": queue_arn,
+                        "awsRegion": "us-east-1",
+                    }
+                    for message in messages
+                ]
+            }
+            with self.recorder.stage("lambda:sqs_poller"):
+                response = self.handler(event, LambdaContext("sqs_poller", 30000))
+            failed = {failure["itemIdentifier"] for failure in response.get("batchItemFailures", [])}
+            for message in messages:
+                if message["MessageId"] not in failed:
+                    self.sqs_client.delete_message(
+                        QueueUrl=self.queue_url, ReceiptHandle=message["ReceiptHandle"]
+                    )
+
+
+def count_aws_calls(recorder):
+    """Count every botocore API call (moto serves them) per service and operation."""
+    from botocore.client import BaseClient
+
+    make_api_call = BaseClient._make_api_call
+
+    def counting(client, operation_name, api_params):
+        recorder.call(client.meta.service_model.endpoint_prefix, operation_name)
+        return make_api_call(client, operation_name, api_params)
+
+    BaseClient._make_api_call = counting
+
+
+def compare(report: dict, baseline: dict, tolerance: float):
+    regressions = []
+    for name, stage in baseline.get("stages", {}).items():
+        current = report["stages"].get(name)
+        if current and current["p95_ms"] > stage["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stage['p95_ms']} -> {current['p95_ms']} ms")
+    for name, count in report["calls"].items():
+        if count > baseline.get("calls", {}).get(name, 0) * (1 + tolerance):
+            regressions.append(f"{name}: {baseline.get('calls', {}).get(name, 0)} -> {count} calls")
+    return regressions
+
+
+def run(args):
+    configure_environment()
+
+    import boto3
+    import stripe
+    from boto3.dynamodb.conditions import Key
+    from moto import mock_aws
+
+    from benchmarks.pipeline.asl import LocalStateMachine
+    from benchmarks.pipeline.fakes import (
+        FakeBedrockAgentRuntime,
+        FakeBedrockRuntime,
+        FakeStripeServer,
+        FakeTextract,
+        Recorder,
+    )
+
+    recorder = Recorder()
+    count_aws_calls(recorder)
+    documents = build_documents(args.documents, args.pdf_every)
+
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        sqs_client = boto3.client("sqs")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        queue_url = sqs_client.create_queue(QueueName=QUEUE_NAME)["QueueUrl"]
+        boto3.client("dynamodb").create_table(
+            TableName=TABLE_NAME,
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        boto3.client("secretsmanager").create_secret(
+            Name="dev/stripe-secret",
+            SecretString=json.dumps({"STRIPE_SECRET_KEY": "sk_test_harness"}),
+        )
+
+        # Handlers create their clients at import time, inside the mock
+        import app
+        import invoke_agent
+        import lambda_sqs_poller
+        import step_functions_workflow_trigger
+        import textract_completion
+        import textract_results
+        from grocerly_shared.products import price_lookup_key
+        from prompts import NO_GROCERY_LIST
+        from utilities.price_resolver import product_lookup_key
+
+        stripe_server = FakeStripeServer(
+            recorder,
+            [(name, price_lookup_key(name), amount) for name, amount in CATALOG],
+            args.stripe_ms / 1000,
+        )
+        stripe.api_base = stripe_server.start()
+        stripe.max_network_retries = 0
+        table = boto3.resource("dynamodb").Table(TABLE_NAME)
+        for product_id, price in list(stripe_server.prices.items())[:SEEDED_PRODUCTS]:
+            name = stripe_server.products[price["product"]]["name"]
+            table.put_item(
+                Item={
+                    **product_lookup_key(name),
+                    "stripeProductId": price["product"],
+                    "stripePriceId": price["id"],
+                    "price": price["unit_amount"],
+                }
+            )
+
+        uploaded_at, outcomes, trigger_statuses = {}, [], []
+
+        def on_complete(execution_input, output, error):
+            key = execution_input.get("object_key")
+            if key in uploaded_at:
+                recorder.record("end_to_end", perf_counter() - uploaded_at[key])
+            outcomes.append(error.error if error else "SUCCEEDED")
+
+        def timed(name, handler):
+            def wrapper(event, context):
+                with recorder.stage(f"lambda:{name}"):
+                    return handler(event, context)
+
+            return wrapper
+
+        def notify_textract_completion(job_id, status):
+            # SNS delivery of the Textract completion notification
+            message = {"JobId": job_id, "Status": status, "API": "StartDocumentTextDetection"}
+            event = {"Records": [{"EventSource": "aws:sns", "Sns": {"Message": json.dumps(message)}}]}
+            timed("textract_completion", textract_completion.handler)(
+                event, LambdaContext("textract_completion")
+            )
+
+        machine = LocalStateMachine(
+            open(os.path.join(ROOT, "state_machine", "state_machine_definition.asl.json")).read(),
+            clients={
+                "textract": FakeTextract(
+                    recorder,
+                    s3_client,
+                    args.textract_ms / 1000,
+                    args.textract_job_ms / 1000,
+                    notify=notify_textract_completion,
+                ),
+                "s3": s3_client,
+                "sqs": sqs_client,
+                "dynamodb": boto3.client("dynamodb"),
+            },
+            functions={
+                "invoke_agent": timed("invoke_agent", invoke_agent.handler),
+                "textract_completion": timed("textract_completion", textract_completion.handler),
+                "textract_results": timed("textract_results", textract_results.handler),
+                "textract_assemble": timed("textract_assemble", textract_results.assemble_handler),
+            },
+            recorder=recorder,
+            context_factory=LambdaContext,
+            substitutions={
+                "SQS_QUEUE_URL": queue_url,
+                "INVOKE_LAMBDA_FUNCTION_ARN": "invoke_agent",
+                "TEXTRACT_SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:123456789012:TextractCompletion",
+                "TEXTRACT_SNS_ROLE_ARN": "arn:aws:iam::123456789012:role/TextractSnsPublish",
+                "TEXTRACT_COMPLETION_FUNCTION_ARN": "textract_completion",
+                "TEXTRACT_RESULTS_FUNCTION_ARN": "textract_results",
+                "TEXTRACT_ASSEMBLE_FUNCTION_ARN": "textract_assemble",
+            },
+            wait_scale=args.wait_scale,
+            on_complete=on_complete,
+        )
+
+        step_functions_workflow_trigger.stepfunctions_client = machine
+        lambda_sqs_poller.stepfunctions_client = machine
+        textract_completion.stepfunctions_client = machine
+        lambda_sqs_poller.bedrock_client = FakeBedrockRuntime(
+            recorder,
+            {" ".join(text.split()): answer for _, text, answer in documents if answer},
+            args.bedrock_ms / 1000,
+            NO_GROCERY_LIST,
+        )
+        invoke_agent.bedrock_agent_runtime_client = FakeBedrockAgentRuntime(
+            recorder, app.lambda_handler, LambdaContext, args.agent_ms / 1000
+        )
+
+        event_source = SqsEventSource(sqs_client, queue_url, lambda_sqs_poller.handler, recorder)
+        event_source.start()
+        started = perf_counter()
+        # The handlers print freely, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            for key, text, _ in documents:
+                uploaded_at[key] = perf_counter()
+                response = s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=text.encode())
+                with recorder.stage("lambda:trigger"):
+                    triggered = step_functions_workflow_trigger.handler(
+                        s3_event(BUCKET_NAME, key, len(text), response["ETag"].strip('"')),
+                        LambdaContext("trigger"),
+                    )
+                trigger_statuses.extend(result["status"] for result in triggered["results"])
+            machine.wait(args.timeout)
+        elapsed = perf_counter() - started
+        event_source.stop()
+        machine.shutdown()
+        stripe_server.stop()
+
+        links = table.query(
+            KeyConditionExpression=Key("PK").eq("PAYMENLINK")
+        )["Items"]
+
+    report = recorder.report()
+    report["documents"] = len(documents)
+    report["uploads"] = {status: trigger_statuses.count(status) for status in sorted(set(trigger_statuses))}
+    report["executions"] = {outcome: outcomes.count(outcome) for outcome in sorted(set(outcomes))}
+    report["payment_links_stored"] = len(links)
+    report["documents_per_second"] = round(len(documents) / elapsed, 2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documents", type=int, default=30)
+    parser.add_argument("--pdf-every", type=int, default=4, help="Every Nth upload is a PDF (0: none)")
+    parser.add_argument("--textract-ms", type=float, default=300)
+    parser.add_argument("--textract-job-ms", type=float, default=3000, help="Duration of async PDF jobs")
+    parser.add_argument("--bedrock-ms", type=float, default=800)
+    parser.add_argument("--agent-ms", type=float, default=1500)
+    parser.add_argument("--stripe-ms", type=float, default=100)
+    parser.add_argument("--wait-scale", type=float, default=0.01, help="Multiplier for Wait states")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--baseline", help="Report of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="Write the report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,373 @@
+"""
+Stand-ins for the services moto does not cover: Stripe (a local HTTP server
+the real stripe library talks to), Bedrock runtime, the Bedrock agent and
+Textract. Each sleeps for a configurable latency and counts its calls on the
+shared Recorder.
+"""
+import io
+import json
+import re
+import threading
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+from urllib.parse import parse_qsl, urlparse
+
+
+class Recorder:
+    """Stage durations and external calls of a harness run."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - started)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.durations[name].append(seconds)
+
+    def call(self, service: str, operation: str) -> None:
+        with self._lock:
+            self.calls[f"{service}:{operation}"] += 1
+
+    def report(self) -> dict:
+        def percentile(timings, fraction):
+            return round(timings[min(len(timings) - 1, int(len(timings) * fraction))] * 1000, 1)
+
+        stages = {}
+        for name, durations in sorted(self.durations.items()):
+            timings = sorted(durations)
+            stages[name] = {
+                "count": len(timings),
+                "p50_ms": percentile(timings, 0.5),
+                "p95_ms": percentile(timings, 0.95),
+                "p99_ms": percentile(timings, 0.99),
+            }
+        return {"stages": stages, "calls": dict(sorted(self.calls.items()))}
+
+
+def _lines(text: str):
+    return [line for line in text.splitlines() if line.strip()]
+
+
+class FakeTextract:
+    """
+    Textract answering with the LINE blocks of the uploaded text file.
+
+    Asynchronous jobs take job_seconds and write their result pages of up to
+    page_lines lines under the OutputConfig prefix. When started with a
+    NotificationChannel the completion is handed to notify(job_id, status),
+    like the SNS topic.
+    """
+
+    def __init__(
+        self,
+        recorder: Recorder,
+        s3_client,
+        latency_seconds: float,
+        job_seconds: float,
+        notify=None,
+        page_lines: int = 2,
+    ):
+        self.recorder = recorder
+        self.s3_client = s3_client
+        self.latency_seconds = latency_seconds
+        self.job_seconds = job_seconds
+        self.notify = notify
+        self.page_lines = page_lines
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _blocks(self, s3_object: dict) -> list:
+        body = self.s3_client.get_object(Bucket=s3_object["Bucket"], Key=s3_object["Name"])["Body"]
+        lines = _lines(body.read().decode())
+        return [{"BlockType": "PAGE", "Id": "page-1", "Page": 1}] + [
+            {"BlockType": "LINE", "Id": f"line-{index}", "Page": 1, "Text": line}
+            for index, line in enumerate(lines)
+        ]
+
+    def detect_document_text(self, Document: dict, **kwargs):
+        self.recorder.call("textract", "DetectDocumentText")
+        sleep(self.latency_seconds)
+        return {"Blocks": self._blocks(Document["S3Object"]), "DocumentMetadata": {"Pages": 1}}
+
+    def _write_output(self, job_id: str, s3_object: dict, output_config: dict) -> None:
+        blocks = [block for block in self._blocks(s3_object) if block["BlockType"] == "LINE"]
+        for page, start in enumerate(range(0, len(blocks), self.page_lines), start=1):
+            self.s3_client.put_object(
+                Bucket=output_config["S3Bucket"],
+                Key=f"{output_config.get('S3Prefix', '')}{job_id}/{page}",
+                Body=json.dumps(
+                    {"JobStatus": "SUCCEEDED", "Blocks": blocks[start : start + self.page_lines]}
+                ).encode(),
+            )
+
+    def start_document_text_detection(
+        self, DocumentLocation: dict, NotificationChannel: dict = None, OutputConfig: dict = None, **kwargs
+    ):
+        self.recorder.call("textract", "StartDocumentTextDetection")
+        job_id = uuid.uuid4().hex
+        if OutputConfig:
+            self._write_output(job_id, DocumentLocation["S3Object"], OutputConfig)
+        with self._lock:
+            self._jobs[job_id] = {"started": perf_counter(), "location": DocumentLocation["S3Object"]}
+        if NotificationChannel and self.notify:
+            threading.Timer(self.job_seconds, self.notify, (job_id, "SUCCEEDED")).start()
+        return {"JobId": job_id}
+
+    def get_document_text_detection(self, JobId: str, **kwargs):
+        self.recorder.call("textract", "GetDocumentTextDetection")
+        with self._lock:
+            job = self._jobs[JobId]
+        if perf_counter() - job["started"] < self.job_seconds:
+            return {"JobStatus": "IN_PROGRESS"}
+        sleep(self.latency_seconds)
+        return {
+            "JobStatus": "SUCCEEDED",
+            "Blocks": self._blocks(job["location"]),
+            "DocumentMetadata": {"Pages": 1},
+        }
+
+
+class _ResponseStream:
+    def __init__(self, events, delay_seconds):
+        self._events = events
+        self._delay_seconds = delay_seconds
+        self.closed = False
+
+    def __iter__(self):
+        for event in self._events:
+            if self.closed:
+                return
+            sleep(self._delay_seconds)
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockRuntime:
+    """
+    Bedrock runtime answering extraction prompts from the labeled answers of
+    the harness documents (normalized text -> items, or None for no list).
+    """
+
+    def __init__(self, recorder: Recorder, answers: dict, latency_seconds: float, no_list_answer: str):
+        self.recorder = recorder
+        self.answers = answers
+        self.latency_seconds = latency_seconds
+        self.no_list_answer = no_list_answer
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    def _answer(self, prompt: str) -> str:
+        documents = re.findall(r'<document id="([^"]+)">\n(.*?)\n</document>', prompt, re.S)
+        if documents:
+            return json.dumps(
+                [
+                    {"id": document_id, "items": self.answers.get(self._normalize(text))}
+                    for document_id, text in documents
+                ]
+            )
+        text = prompt.split("Here is the text:", 1)[-1]
+        items = self.answers.get(self._normalize(text))
+        if not items:
+            return self.no_list_answer
+        return "\n".join(json.dumps(item) for item in items)
+
+    def invoke_model(self, modelId: str, body: str, **kwargs):
+        self.recorder.call("bedrock-runtime", "InvokeModel")
+        prompt = json.loads(body)["messages"][0]["content"]
+        sleep(self.latency_seconds)
+        payload = {"content": [{"type": "text", "text": self._answer(prompt)}]}
+        return {"body": io.BytesIO(json.dumps(payload).encode())}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs):
+        self.recorder.call("bedrock-runtime", "InvokeModelWithResponseStream")
+        text = self._answer(json.loads(body)["messages"][0]["content"])
+        pieces = [text[start : start + 16] for start in range(0, len(text), 16)]
+        events = [
+            {"chunk": {"bytes": json.dumps({"type": "content_block_delta", "delta": {"type": "text_delta", "text": piece}}).encode()}}
+            for piece in pieces
+        ] + [{"chunk": {"bytes": json.dumps({"type": "message_stop"}).encode()}}]
+        return {"body": _ResponseStream(events, self.latency_seconds / len(events))}
+
+
+class FakeBedrockAgentRuntime:
+    """
+    Bedrock agent that reasons for latency_seconds and calls the real action
+    group handler (agent/app.py) with the products of the query.
+    """
+
+    _LIST_LINE = re.compile(r"^-\s*(?P<name>.+?),\s*(?P<quantity>\d+)(?:\s+(?P<unit>.+))?$")
+
+    def __init__(self, recorder: Recorder, action_group_handler, context_factory, latency_seconds: float):
+        self.recorder = recorder
+        self.action_group_handler = action_group_handler
+        self.context_factory = context_factory
+        self.latency_seconds = latency_seconds
+
+    def _products(self, input_text: str) -> str:
+        items = []
+        for line in input_text.split("list of products:", 1)[-1].splitlines():
+            match = self._LIST_LINE.match(line.strip())
+            if not match:
+                continue
+            fields = f"name={match['name']}, quantity={match['quantity']}"
+            if match["unit"]:
+                fields += f", unit={match['unit']}"
+            items.append("{" + fields + "}")
+        return "[" + ", ".join(items) + "]"
+
+    def _completion(self, inputText, agentId, sessionId):
+        yield {"trace": {"trace": {"orchestrationTrace": {"rationale": {"text": "Creating the payment link."}}}}}
+        sleep(self.latency_seconds / 2)
+        event = {
+            "messageVersion": "1.0",
+            "agent": {"name": "grocery-agent", "id": agentId, "alias": "TSTALIASID", "version": "DRAFT"},
+            "inputText": inputText,
+            "sessionId": sessionId,
+            "actionGroup": "payment_link",
+            "apiPath": "/payment_link",
+            "httpMethod": "GET",
+            "parameters": [{"name": "products", "type": "array", "value": self._products(inputText)}],
+            "sessionAttributes": {},
+            "promptSessionAttributes": {},
+        }
+        with self.recorder.stage("lambda:agent_action_group"):
+            response = self.action_group_handler(event, self.context_factory("agent_action_group"))
+        body = response["response"]["responseBody"]["application/json"]["body"]
+        try:
+            text = json.loads(body)
+        except (TypeError, ValueError):
+            text = body
+        sleep(self.latency_seconds / 2)
+        yield {"chunk": {"bytes": str(text).encode()}}
+
+    def invoke_agent(self, inputText, agentId, agentAliasId, sessionId, enableTrace=False, **kwargs):
+        self.recorder.call("bedrock-agent-runtime", "InvokeAgent")
+        return {"completion": self._completion(inputText, agentId, sessionId)}
+
+
+class FakeStripeServer:
+    """
+    Local HTTP server implementing the Stripe endpoints the agent uses, for
+    the catalog of (name, lookup_key, unit_amount) products.
+    """
+
+    def __init__(self, recorder: Recorder, catalog, latency_seconds: float):
+        self.recorder = recorder
+        self.latency_seconds = latency_seconds
+        self.products = {}
+        self.prices = {}
+        self.prices_by_lookup_key = {}
+        for index, (name, lookup_key, unit_amount) in enumerate(catalog):
+            product_id, price_id = f"prod_harness{index}", f"price_harness{index}"
+            self.products[product_id] = {
+                "id": product_id,
+                "object": "product",
+                "name": name,
+                "active": True,
+                "default_price": price_id,
+            }
+            self.prices[price_id] = {
+                "id": price_id,
+                "object": "price",
+                "active": True,
+                "currency": "usd",
+                "lookup_key": lookup_key,
+                "product": product_id,
+                "unit_amount": unit_amount,
+            }
+            self.prices_by_lookup_key[lookup_key] = price_id
+        self._server = None
+
+    def _price(self, price_id, expand_product):
+        price = dict(self.prices[price_id])
+        if expand_product:
+            price["product"] = self.products[price["product"]]
+        return price
+
+    def _list(self, url, data):
+        return {"object": "list", "url": url, "has_more": False, "data": data}
+
+    def handle(self, method: str, path: str, params: dict) -> dict:
+        expand = [value for key, value in params if key.startswith("expand")]
+        if method == "GET" and path == "/v1/prices":
+            keys = [value for key, value in params if key.startswith("lookup_keys")]
+            product = dict(params).get("product")
+            price_ids = [self.prices_by_lookup_key[key] for key in keys if key in self.prices_by_lookup_key]
+            if product:
+                price_ids = [price_id for price_id, price in self.prices.items() if price["product"] == product]
+            return self._list(path, [self._price(price_id, "data.product" in expand) for price_id in price_ids])
+        if method == "GET" and path.startswith("/v1/prices/"):
+            return self._price(path.rsplit("/", 1)[1], False)
+        if method == "GET" and path == "/v1/products":
+            products = []
+            for product in self.products.values():
+                product = dict(product)
+                if "data.default_price" in expand:
+                    product["default_price"] = self.prices[product["default_price"]]
+                products.append(product)
+            return self._list(path, products)
+        if method == "POST" and path == "/v1/payment_links":
+            link_id = uuid.uuid4().hex[:14]
+            return {
+                "id": f"plink_{link_id}",
+                "object": "payment_link",
+                "active": True,
+                "url": f"https://buy.stripe.com/test_{link_id}",
+            }
+        raise KeyError(f"{method} {path}")
+
+    def start(self) -> str:
+        harness = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _respond(self, method):
+                url = urlparse(self.path)
+                params = parse_qsl(url.query)
+                if method == "POST":
+                    length = int(self.headers.get("Content-Length") or 0)
+                    params += parse_qsl(self.rfile.read(length).decode())
+                harness.recorder.call("stripe", f"{method} {url.path}")
+                sleep(harness.latency_seconds)
+                try:
+                    status, body = 200, harness.handle(method, url.path, params)
+                except KeyError as e:
+                    status, body = 404, {"error": {"type": "invalid_request_error", "message": str(e)}}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond("GET")
+
+            def do_POST(self):
+                self._respond("POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server:
+            self._server.shutdown()
@@ -1,12 +1,18 @@
+import hashlib
 import json
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from time import monotonic
+
 import boto3
 from botocore.exceptions import ClientError
 from aws_lambda_powertools import Logger, Tracer
 import stripe
 from stripe import StripeError
 
-from utilities.utils import get_stripe_key
+from grocerly_shared.rate_limit import TokenBucket, call_with_backoff
+from grocerly_shared.secrets import get_stripe_key
+from grocerly_shared.products import normalize_product_name, price_lookup_key
 
 dynamodb = boto3.resource("dynamodb")
 table_name = os.environ.get("ECOMMERCE_TABLE_NAME")
@@ -20,6 +26,18 @@ with open("product_list.json", "r") as product_list_file:
 logger = Logger(service="create_stripe_products")
 tracer = Tracer(service="create_stripe_products_service")
 
+# Stripe allows 100 requests/s in live mode and 25 requests/s in test mode
+SEED_CONCURRENCY = int(os.environ.get("SEED_CONCURRENCY", "8"))
+stripe_rate_limiter = TokenBucket(
+    rate=float(os.environ.get("STRIPE_REQUESTS_PER_SECOND", "20")),
+    capacity=SEED_CONCURRENCY,
+)
+# Stop submitting new products when less time than this is left in the invocation
+TIMEOUT_MARGIN_MS = 30_000
+CHECKPOINT_FLUSH_SIZE = 25
+# Written once the Stripe products created before sync state have been adopted
+ADOPTION_MARKER_KEY = {"PK": "STRIPE_SYNC", "SK": "ADOPTED"}
+
 
 def bulk_add_products_to_dynamodb(products):
     """
@@ -28,6 +46,11 @@ def bulk_add_products_to_dynamodb(products):
     - PK: productId
     - SK: stripe_price_id
     - stripe: stripe_product_id
+
+    A name lookup item (PK: PRODUCTNAME#<normalized name>, SK: STRIPEPRICE) is
+    written alongside so carts can be priced with a single BatchGetItem, and a
+    sync state item (PK: STRIPE_SYNC, SK: PRODUCT#<productId>) records the
+    Stripe ids and content hash so later runs only push what changed.
     """
     failed_items = []
     try:
@@ -55,6 +78,48 @@ def bulk_add_products_to_dynamodb(products):
                         ],  # Stripe Product ID
                     }
                     batch.put_item(Item=item)
+                    batch.put_item(
+                        Item={
+                            "PK": f"PRODUCTNAME#{normalize_product_name(product['name'])}",
+                            "SK": "STRIPEPRICE",
+                            "name": product["name"],
+                            "price": product["price"],
+                            "stripeProductId": product["stripe_product_id"],
+                            "stripePriceId": product["stripe_price_id"],
+                        }
+                    )
+                    batch.put_item(
+                        Item={
+                            "PK": "STRIPE_SYNC",
+                            "SK": f"PRODUCT#{product['productId']}",
+                            "stripeProductId": product["stripe_product_id"],
+                            "stripePriceId": product["stripe_price_id"],
+                            "name": product["name"],
+                            "price": product["price"],
+                            "modifiedDate": product["modifiedDate"],
+                            "contentHash": product_content_hash(product),
+                        }
+                    )
+                    previous_name = product.get("previous_name")
+                    if previous_name and normalize_product_name(
+                        previous_name
+                    ) != normalize_product_name(product["name"]):
+                        # Renamed, the old name must no longer resolve to a price
+                        batch.delete_item(
+                            Key={
+                                "PK": f"PRODUCTNAME#{normalize_product_name(previous_name)}",
+                                "SK": "STRIPEPRICE",
+                            }
+                        )
+                    previous_price_id = product.get("previous_stripe_price_id")
+                    if previous_price_id and previous_price_id != product["stripe_price_id"]:
+                        # The product row is keyed by price id, drop the archived one
+                        batch.delete_item(
+                            Key={
+                                "PK": product["stripe_product_id"],
+                                "SK": previous_price_id,
+                            }
+                        )
                 except ClientError as e:
                     logger.error(
                         f"Failed to add product {product['productId']} to DynamoDB: {e}"
@@ -69,65 +134,387 @@ def bulk_add_products_to_dynamodb(products):
         raise
 
 
-@logger.inject_lambda_context
-@tracer.capture_lambda_handler
-def handler(event, context):
-    stripe_key = get_stripe_key()
-    if stripe_key is None:
-        logger.error("Stripe API key not set")
-        raise ValueError("Stripe API key not set")
-
-    # Set Stripe key
-    stripe.api_key = stripe_key
-    logger.info("Retrieving all products: %s", product_list)
-
-    products_to_insert = []
+def backfill_price_lookup_keys():
+    """
+    Assign the deterministic lookup_key to the default price of every active
+    product created before lookup keys were introduced.
+    """
+    updated = 0
+    products = stripe.Product.list(
+        active=True, limit=100, expand=["data.default_price"]
+    )
+    for product in products.auto_paging_iter():
+        price = product.get("default_price")
+        if price is None:
+            prices = stripe.Price.list(product=product.id, active=True, limit=1)
+            price = prices.data[0] if prices.data else None
+        if price is None or isinstance(price, str):
+            logger.warning(f"Skipping product without expanded price: {product.id}")
+            continue
 
-    # Iterate through the list and create products and prices
-    for product_data in product_list:
+        lookup_key = price_lookup_key(product.name)
+        if price.get("lookup_key") == lookup_key:
+            continue
         try:
-            # Create a product in Stripe
-            product = stripe.Product.create(
-                name=product_data["name"],
-                description=product_data["description"],
-                metadata={
-                    "category": product_data["category"],
-                    "createdDate": product_data["createdDate"],
-                    "modifiedDate": product_data["modifiedDate"],
-                    "productId": product_data["productId"],
-                    "tags": ", ".join(product_data["tags"]),
-                    "package": json.dumps(product_data["package"]),
-                },
-                images=product_data["pictures"],
+            stripe.Price.modify(price.id, lookup_key=lookup_key, transfer_lookup_key=True)
+            updated += 1
+            logger.info(f"Assigned lookup_key {lookup_key} to price {price.id}")
+        except StripeError as e:
+            logger.error(
+                f"Error assigning lookup_key to price {price.id}: {e.user_message}"
             )
-            logger.info(f"Product created: {product.name} (ID: {product.id})")
+    return updated
 
-            # Create a price for the product in Stripe
-            price = stripe.Price.create(
-                unit_amount=product_data["price"],  # Price in cents
-                currency="usd",  # Currency code
-                product=product.id,  # Link to the product
-            )
-            logger.info(
-                f"Price created: {price.unit_amount / 100} {price.currency} (ID: {price.id})"
+
+def product_content_hash(product_data):
+    """
+    Hash of the catalog fields of a product that are pushed to Stripe.
+    """
+    content = {
+        key: product_data[key]
+        for key in (
+            "name",
+            "description",
+            "category",
+            "createdDate",
+            "modifiedDate",
+            "tags",
+            "package",
+            "pictures",
+            "price",
+        )
+    }
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def load_sync_state():
+    """
+    Sync state of every product already in Stripe, keyed by productId.
+    """
+    state = {}
+    query = {
+        "KeyConditionExpression": "PK = :pk AND begins_with(SK, :product)",
+        "ExpressionAttributeValues": {":pk": "STRIPE_SYNC", ":product": "PRODUCT#"},
+    }
+    while True:
+        response = table.query(**query)
+        for item in response["Items"]:
+            state[item["SK"].split("#", 1)[1]] = item
+        if "LastEvaluatedKey" not in response:
+            return state
+        query["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def adoption_done():
+    return "Item" in table.get_item(Key=ADOPTION_MARKER_KEY, ConsistentRead=True)
+
+
+def adopt_existing_products(products, sync_state):
+    """
+    Add the sync state of products created in Stripe before sync state was
+    recorded, matched by the productId metadata every created product has.
+
+    Runs once: the adopted sync state and a marker item are written right
+    away, so later runs send products without sync state straight to creation
+    instead of scanning Stripe again. Adopted products have no content hash,
+    so plan_sync updates them once instead of creating them again.
+    """
+    missing = {
+        product_data["productId"]
+        for product_data in products
+        if product_data["productId"] not in sync_state
+    }
+    adopted = {}
+    if missing:
+        adopted = _find_stripe_products(missing)
+        sync_state.update(adopted)
+
+    with table.batch_writer() as batch:
+        for product_id, state in adopted.items():
+            batch.put_item(
+                Item={"PK": "STRIPE_SYNC", "SK": f"PRODUCT#{product_id}", **state}
             )
+        batch.put_item(Item={**ADOPTION_MARKER_KEY, "adopted": len(adopted)})
+    logger.info(
+        f"Adopted {len(adopted)} existing Stripe products, {len(missing) - len(adopted)} are new"
+    )
+    return sync_state
 
-            # Prepare product data for DynamoDB
-            product_data["stripe_product_id"] = product.id  # Stripe Product ID
-            product_data["stripe_price_id"] = price.id  # Stripe Price ID
-            products_to_insert.append(product_data)
 
-        except StripeError as e:
-            logger.error(
-                f"Error creating product or price for {product_data['name']}: {e.user_message}"
+def _find_stripe_products(product_ids):
+    """
+    Sync state of the active Stripe products with one of product_ids as
+    productId metadata, keyed by productId.
+    """
+    found = {}
+    stripe_products = call_with_backoff(
+        stripe_rate_limiter,
+        stripe.Product.list,
+        active=True,
+        limit=100,
+        expand=["data.default_price"],
+    )
+    for product in stripe_products.auto_paging_iter():
+        product_id = (product.get("metadata") or {}).get("productId")
+        if product_id not in product_ids or product_id in found:
+            continue
+        price = product.get("default_price")
+        if price is None:
+            prices = call_with_backoff(
+                stripe_rate_limiter,
+                stripe.Price.list,
+                product=product.id,
+                active=True,
+                limit=1,
             )
-            continue  # Skip this product and continue with the next one
+            price = prices.data[0] if prices.data else None
+        if price is None or isinstance(price, str):
+            logger.warning(f"Not adopting product without a price: {product.id}")
+            continue
 
-    # Bulk add products to DynamoDB
-    try:
-        bulk_add_products_to_dynamodb(products_to_insert)
-    except Exception as e:
-        logger.error(f"Failed to bulk add products to DynamoDB: {e}")
-        raise
+        found[product_id] = {
+            "name": product.name,
+            "stripeProductId": product.id,
+            "stripePriceId": price.id,
+            "price": price.unit_amount,
+        }
+    return found
+
+
+def _product_fields(product_data):
+    return {
+        "name": product_data["name"],
+        "description": product_data["description"],
+        "metadata": {
+            "category": product_data["category"],
+            "createdDate": product_data["createdDate"],
+            "modifiedDate": product_data["modifiedDate"],
+            "productId": product_data["productId"],
+            "tags": ", ".join(product_data["tags"]),
+            "package": json.dumps(product_data["package"]),
+        },
+        "images": product_data["pictures"],
+    }
+
+
+def _create_price(product_data, stripe_product_id, content_hash):
+    price = call_with_backoff(
+        stripe_rate_limiter,
+        stripe.Price.create,
+        unit_amount=product_data["price"],  # Price in cents
+        currency="usd",  # Currency code
+        product=stripe_product_id,  # Link to the product
+        lookup_key=price_lookup_key(product_data["name"]),
+        transfer_lookup_key=True,
+        idempotency_key=f"create-price-{product_data['productId']}-{content_hash}",
+    )
+    logger.info(
+        f"Price created: {price.unit_amount / 100} {price.currency} (ID: {price.id})"
+    )
+    return price
+
+
+def create_stripe_product(product_data):
+    """
+    Create a product and its price in Stripe.
+
+    Idempotency keys are derived from the productId (and content hash for the
+    price) so a retried or resumed run never creates the same object twice.
+    """
+    content_hash = product_content_hash(product_data)
+    product = call_with_backoff(
+        stripe_rate_limiter,
+        stripe.Product.create,
+        **_product_fields(product_data),
+        idempotency_key=f"create-product-{product_data['productId']}",
+    )
+    logger.info(f"Product created: {product.name} (ID: {product.id})")
+
+    price = _create_price(product_data, product.id, content_hash)
+    return {
+        **product_data,
+        "stripe_product_id": product.id,
+        "stripe_price_id": price.id,
+    }
+
+
+def update_stripe_product(product_data, sync_state):
+    """
+    Push the changes of an existing product to Stripe.
+
+    A price change creates a new Price, makes it the default and archives the
+    old one, since Stripe prices are immutable. A rename moves the lookup_key
+    of the new name to the current price.
+    """
+    content_hash = product_content_hash(product_data)
+    product_id = sync_state["stripeProductId"]
+    price_id = sync_state["stripePriceId"]
+
+    previous_amount = sync_state.get("price")
+    if previous_amount is None:
+        # Sync state written before prices were recorded
+        previous_amount = call_with_backoff(
+            stripe_rate_limiter, stripe.Price.retrieve, price_id
+        ).unit_amount
+    repriced = int(previous_amount) != product_data["price"]
+    # Sync state written before names were recorded may hide a rename
+    previous_name = sync_state.get("name")
+    renamed = previous_name is None or normalize_product_name(
+        previous_name
+    ) != normalize_product_name(product_data["name"])
+
+    update = _product_fields(product_data)
+    if repriced:
+        # Created with the lookup_key of the new name
+        price = _create_price(product_data, product_id, content_hash)
+        update["default_price"] = price.id
+    elif renamed:
+        call_with_backoff(
+            stripe_rate_limiter,
+            stripe.Price.modify,
+            price_id,
+            lookup_key=price_lookup_key(product_data["name"]),
+            transfer_lookup_key=True,
+            idempotency_key=f"rename-price-{price_id}-{content_hash}",
+        )
+
+    call_with_backoff(
+        stripe_rate_limiter,
+        stripe.Product.modify,
+        product_id,
+        **update,
+        idempotency_key=f"update-product-{product_data['productId']}-{content_hash}",
+    )
+
+    if repriced:
+        call_with_backoff(
+            stripe_rate_limiter,
+            stripe.Price.modify,
+            price_id,
+            active=False,
+            idempotency_key=f"archive-price-{price_id}",
+        )
+        logger.info(f"Repriced {product_data['name']}: {price_id} -> {price.id}")
+        price_id = price.id
+    else:
+        logger.info(f"Product updated: {product_data['name']} (ID: {product_id})")
+
+    return {
+        **product_data,
+        "stripe_product_id": product_id,
+        "stripe_price_id": price_id,
+        "previous_stripe_price_id": sync_state["stripePriceId"],
+        "previous_name": previous_name,
+    }
+
+
+def plan_sync(products, sync_state):
+    """
+    Split the catalog into products to create, products to update and the
+    number of unchanged products.
+    """
+    to_create, to_update, unchanged = [], [], 0
+    for product_data in products:
+        state = sync_state.get(product_data["productId"])
+        if state is None:
+            to_create.append(product_data)
+        elif state.get("modifiedDate") == product_data["modifiedDate"] and state.get(
+            "contentHash"
+        ) == product_content_hash(product_data):
+            unchanged += 1
+        else:
+            to_update.append((product_data, state))
+    return to_create, to_update, unchanged
+
+
+def sync_products(products, context):
+    """
+    Push the delta between the catalog and Stripe with a bounded worker pool,
+    recording the sync state of every completed product in DynamoDB.
+
+    Submission stops when the invocation is close to its timeout; the report
+    then has complete=False and invoking the function again resumes from the
+    recorded state.
+    """
+    started = monotonic()
+    sync_state = load_sync_state()
+    if not adoption_done():
+        sync_state = adopt_existing_products(products, sync_state)
+    to_create, to_update, unchanged = plan_sync(products, sync_state)
+    logger.info(
+        f"{len(to_create)} products to create, {len(to_update)} to update, {unchanged} unchanged"
+    )
+
+    counts = {"created": 0, "updated": 0}
+    failed, completed = [], []
+    remaining = [
+        (update_stripe_product, (product_data, state), "updated")
+        for product_data, state in reversed(to_update)
+    ] + [
+        (create_stripe_product, (product_data,), "created")
+        for product_data in reversed(to_create)
+    ]
+    in_flight = {}
+
+    with ThreadPoolExecutor(max_workers=SEED_CONCURRENCY) as pool:
+        while remaining or in_flight:
+            while (
+                remaining
+                and len(in_flight) < SEED_CONCURRENCY
+                and context.get_remaining_time_in_millis() > TIMEOUT_MARGIN_MS
+            ):
+                operation, args, outcome = remaining.pop()
+                in_flight[pool.submit(operation, *args)] = (args[0], outcome)
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                product_data, outcome = in_flight.pop(future)
+                try:
+                    completed.append(future.result())
+                    counts[outcome] += 1
+                except StripeError as e:
+                    logger.error(
+                        f"Error syncing product {product_data['name']}: {e.user_message}"
+                    )
+                    failed.append(
+                        {"productId": product_data["productId"], "error": str(e)}
+                    )
+
+            if len(completed) >= CHECKPOINT_FLUSH_SIZE:
+                bulk_add_products_to_dynamodb(completed)
+                completed = []
+
+    if completed:
+        bulk_add_products_to_dynamodb(completed)
+
+    elapsed = monotonic() - started
+    synced = counts["created"] + counts["updated"]
+    return {
+        "complete": not remaining,
+        **counts,
+        "unchanged": unchanged,
+        "remaining": len(remaining),
+        "failed": failed,
+        "elapsedSeconds": round(elapsed, 3),
+        "productsPerSecond": round(synced / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+@logger.inject_lambda_context
+@tracer.capture_lambda_handler
+def handler(event, context):
+    # Set Stripe key
+    stripe.api_key = get_stripe_key()
+
+    if (event or {}).get("backfill_lookup_keys"):
+        updated = backfill_price_lookup_keys()
+        return f"Assigned lookup keys to {updated} prices"
 
-    return "Products and prices created successfully!"
+    logger.info(f"Syncing {len(product_list)} products")
+    report = sync_products(product_list, context)
+    logger.info("Sync report", extra=report)
+    return report
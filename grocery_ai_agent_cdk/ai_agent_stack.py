@@ -1,7 +1,7 @@
 from aws_cdk import Stack, Duration, CfnOutput
 from aws_cdk.aws_dynamodb import Table
 from aws_cdk.aws_lambda import Runtime, Tracing
-from aws_cdk.aws_lambda_python_alpha import PythonFunction
+from aws_cdk.aws_lambda_python_alpha import PythonFunction, PythonLayerVersion
 from aws_cdk.aws_secretsmanager import Secret
 from constructs import Construct
 from cdklabs.generative_ai_cdk_constructs.bedrock import (
@@ -24,6 +24,7 @@ class AiAgentStack(Stack):
         secret: Secret,
         invoke_agent_lambda: PythonFunction,
         ecommerce_table: Table,
+        shared_layer: PythonLayerVersion,
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
@@ -35,6 +36,7 @@ class AiAgentStack(Stack):
             entry="./agent",
             index="app.py",
             handler="lambda_handler",
+            layers=[shared_layer],
             timeout=Duration.minutes(2),
             memory_size=512,
         )
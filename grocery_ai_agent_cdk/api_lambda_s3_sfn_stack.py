@@ -13,6 +13,9 @@ from aws_cdk import (
     aws_iam as iam,
     aws_s3,
     aws_s3_notifications,
+    aws_sns as sns,
+    aws_sns_subscriptions as sns_subscriptions,
+    aws_logs as logs,
 )
 from aws_cdk.aws_dynamodb import Table
 from aws_cdk.aws_lambda import (
@@ -20,7 +23,13 @@ from aws_cdk.aws_lambda import (
 )
 from aws_cdk.aws_sqs import Queue
 from constructs import Construct
-from aws_cdk.aws_lambda_python_alpha import PythonFunction
+from aws_cdk.aws_lambda_python_alpha import PythonFunction, PythonLayerVersion
+
+from grocery_ai_agent_cdk.workflow_definitions import (
+    EXTRACTION_MODES,
+    use_bedrock_extraction,
+)
+from sqs_poller.prompts import MODEL_ID
 
 
 class ApiLambdaS3SfnStack(Stack):
@@ -30,10 +39,17 @@ class ApiLambdaS3SfnStack(Stack):
         construct_id: str,
         sqs_queue: Queue,
         ecommerce_table: Table,
+        enable_express_image_workflow: bool = True,
+        extraction_mode: str = "sqs",
         **kwargs,
     ) -> None:
         super().__init__(scope, construct_id, **kwargs)
 
+        if extraction_mode not in EXTRACTION_MODES:
+            raise ValueError(
+                f"Unknown extraction_mode {extraction_mode!r}, expected one of {EXTRACTION_MODES}"
+            )
+
         # Step 1: Define the secret (if it doesn't already exist)
         secret = secretsmanager.Secret.from_secret_name_v2(
             self,
@@ -41,12 +57,32 @@ class ApiLambdaS3SfnStack(Stack):
             secret_name="dev/stripe-secret",  # Name of the existing secret
         )
 
+        # Code shared by the Lambda functions (secrets, claim check, rate limits,
+        # product names and item models)
+        shared_layer = PythonLayerVersion(
+            self,
+            "GrocerlySharedLayer",
+            entry="./layers/shared",
+            compatible_runtimes=[Runtime.PYTHON_3_11],
+            description="Grocerly shared utilities",
+        )
+
         grocery_list_bucket = s3.Bucket(
             self,
             "grocery-list-bucket",
             versioned=False,
             encryption=s3.BucketEncryption.S3_MANAGED,
             block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            lifecycle_rules=[
+                # Claim check texts; every put rewrites the object, so it
+                # outlives the queue and DLQ retention (14 days each) of the
+                # messages referencing it
+                s3.LifecycleRule(
+                    id="ExpireExtractedTexts",
+                    prefix="extracted/",
+                    expiration=Duration.days(30),
+                )
+            ],
         )
 
         # AppSync API
@@ -80,6 +116,8 @@ class ApiLambdaS3SfnStack(Stack):
             entry="./batch_upload_products",
             index="batch_upload_products.py",
             handler="handler",
+            timeout=Duration.minutes(15),
+            memory_size=512,
         )
 
         create_stripe_products_lambda = PythonFunction(
@@ -89,11 +127,23 @@ class ApiLambdaS3SfnStack(Stack):
             entry="./create_stripe_products",
             index="create_stripe_products.py",
             handler="handler",
+            layers=[shared_layer],
+            # Seeding runs a Stripe worker pool and resumes from its checkpoint
+            timeout=Duration.minutes(15),
+            memory_size=512,
         )
 
         # Grant permissions
         ecommerce_table.grant_write_data(batch_upload_products_lambda)
-        ecommerce_table.grant_write_data(create_stripe_products_lambda)
+        batch_upload_products_lambda.add_environment(
+            "ECOMMERCE_TABLE_NAME", ecommerce_table.table_name
+        )
+        # Large catalogs are streamed from the bucket instead of being bundled
+        grocery_list_bucket.grant_read(batch_upload_products_lambda)
+        batch_upload_products_lambda.add_environment(
+            "CATALOG_BUCKET_NAME", grocery_list_bucket.bucket_name
+        )
+        ecommerce_table.grant_read_write_data(create_stripe_products_lambda)
         secret.grant_read(create_stripe_products_lambda)
         create_stripe_products_lambda.add_environment(
             "ECOMMERCE_TABLE_NAME", ecommerce_table.table_name
@@ -107,6 +157,11 @@ class ApiLambdaS3SfnStack(Stack):
             entry="./step_functions_workflow_trigger",
             index="step_functions_workflow_trigger.py",
             handler="handler",
+            environment={"ECOMMERCE_TABLE_NAME": ecommerce_table.table_name},
+        )
+        # Content hash index of the uploads (UPLOAD#<ETag>) deduplicates workflows
+        ecommerce_table.grant_read_write_data(
+            trigger_step_function_products_lambda_function
         )
         # create products in stripe lambda Function for Resolver
         invoke_agent_lambda = PythonFunction(
@@ -116,6 +171,7 @@ class ApiLambdaS3SfnStack(Stack):
             entry="./agent",
             index="invoke_agent.py",
             handler="handler",
+            layers=[shared_layer],
             timeout=Duration.minutes(2),
             memory_size=512,
         )
@@ -126,11 +182,21 @@ class ApiLambdaS3SfnStack(Stack):
             handler="handler",
             index="lambda_sqs_poller.py",
             entry="./sqs_poller",
+            layers=[shared_layer],
             timeout=Duration.seconds(30),
         )
 
         # Step 11: Grant the second Lambda function permissions to poll the SQS queue
         sqs_queue.grant_consume_messages(sqs_poller_lambda)
+        # Extraction results are cached in the table
+        ecommerce_table.grant_read_write_data(sqs_poller_lambda)
+        sqs_poller_lambda.add_environment(
+            "ECOMMERCE_TABLE_NAME", ecommerce_table.table_name
+        )
+        # The last delivery before the DLQ fails the waiting task
+        sqs_poller_lambda.add_environment(
+            "MAX_RECEIVE_COUNT", str(sqs_queue.dead_letter_queue.max_receive_count)
+        )
         """
         invoke_agent_lambda_url = invoke_agent_lambda.add_function_url(
             auth_type=FunctionUrlAuthType.NONE,  # Public access
@@ -156,7 +222,44 @@ class ApiLambdaS3SfnStack(Stack):
                 # Grant access to all Bedrock models
             )
         )
-        ecommerce_table.grant_write_data(invoke_agent_lambda)
+        # Validated item lists are priced and linked in-process, without the agent
+        ecommerce_table.grant_read_write_data(invoke_agent_lambda)
+        secret.grant_read(invoke_agent_lambda)
+
+        # Long document texts and grocery lists are passed by reference to
+        # gzip compressed copies under extracted/ (claim check)
+        for function in (sqs_poller_lambda, invoke_agent_lambda):
+            function.add_environment(
+                "TEXT_STORE_BUCKET", grocery_list_bucket.bucket_name
+            )
+        grocery_list_bucket.grant_read_write(sqs_poller_lambda, "extracted/*")
+        grocery_list_bucket.grant_read(invoke_agent_lambda, "extracted/*")
+
+        # createPaymentLinks links many carts in one call, products resolved once
+        create_payment_links_lambda = PythonFunction(
+            self,
+            "CreatePaymentLinks",
+            runtime=Runtime.PYTHON_3_11,
+            entry="./agent",
+            index="create_payment_links.py",
+            handler="handler",
+            layers=[shared_layer],
+            # AppSync waits at most 30 seconds for a Lambda resolver
+            timeout=Duration.seconds(30),
+            memory_size=512,
+            environment={"ECOMMERCE_TABLE_NAME": ecommerce_table.table_name},
+        )
+        ecommerce_table.grant_read_write_data(create_payment_links_lambda)
+        secret.grant_read(create_payment_links_lambda)
+        api.add_lambda_data_source(
+            "CreatePaymentLinksDataSource", create_payment_links_lambda
+        ).create_resolver(
+            id="CreatePaymentLinksResolver",
+            type_name="Mutation",
+            field_name="createPaymentLinks",
+            request_mapping_template=aws_appsync.MappingTemplate.lambda_request(),
+            response_mapping_template=aws_appsync.MappingTemplate.lambda_result(),
+        )
 
         # Add Lambda as a DataSource for AppSync
         lambda_ds = api.add_lambda_data_source(
@@ -191,13 +294,17 @@ class ApiLambdaS3SfnStack(Stack):
                              "time": "$context.arguments.time",
                              "region": "$context.arguments.region",
                              "detailType": "$context.arguments.detailType",
-                             "data": "$context.arguments.data"
+                             "data": $util.toJson($context.arguments.data)
                          }
                        }
                    """,
             response_mapping_template="$util.toJson($context.result)",
         )
 
+        # invoke_agent publishes completion chunks and agent trace steps as they arrive
+        invoke_agent_lambda.add_environment("APPSYNC_API_URL", api.graphql_url)
+        api.grant_mutation(invoke_agent_lambda, "publish")
+
         # Ensure the resolver depends on the DataSource
         mutation_resolver.add_dependency(none_data_source)
 
@@ -225,14 +332,71 @@ class ApiLambdaS3SfnStack(Stack):
 
         sqs_poller_lambda.add_to_role_policy(
             iam.PolicyStatement(
-                actions=["bedrock:InvokeModel"],
+                actions=["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"],
                 resources=["*"],  # Grant access to all Bedrock models
             )
         )
 
+        # Textract publishes asynchronous job completions to SNS, the
+        # textract_completion Lambda resumes the execution waiting on the job
+        textract_completion_topic = sns.Topic(self, "TextractCompletionTopic")
+        textract_sns_role = iam.Role(
+            self,
+            "TextractSnsPublishRole",
+            assumed_by=iam.ServicePrincipal("textract.amazonaws.com"),
+        )
+        textract_completion_topic.grant_publish(textract_sns_role)
+
+        textract_completion_lambda = PythonFunction(
+            self,
+            "TextractCompletion",
+            runtime=Runtime.PYTHON_3_11,
+            entry="./textract_completion",
+            index="textract_completion.py",
+            handler="handler",
+            timeout=Duration.seconds(30),
+            environment={"ECOMMERCE_TABLE_NAME": ecommerce_table.table_name},
+        )
+        ecommerce_table.grant_read_write_data(textract_completion_lambda)
+        textract_completion_topic.add_subscription(
+            sns_subscriptions.LambdaSubscription(textract_completion_lambda)
+        )
+
+        # Reads the text of the asynchronous Textract result files, one per Map item
+        textract_results_lambda = PythonFunction(
+            self,
+            "TextractResults",
+            runtime=Runtime.PYTHON_3_11,
+            entry="./textract_results",
+            index="textract_results.py",
+            handler="handler",
+            layers=[shared_layer],
+            timeout=Duration.seconds(60),
+            memory_size=512,
+            environment={"TEXT_STORE_BUCKET": grocery_list_bucket.bucket_name},
+        )
+        textract_assemble_lambda = PythonFunction(
+            self,
+            "TextractAssembleText",
+            runtime=Runtime.PYTHON_3_11,
+            entry="./textract_results",
+            index="textract_results.py",
+            handler="assemble_handler",
+            layers=[shared_layer],
+            timeout=Duration.seconds(60),
+            memory_size=512,
+            environment={"TEXT_STORE_BUCKET": grocery_list_bucket.bucket_name},
+        )
+        grocery_list_bucket.grant_read(textract_results_lambda)
+        for function in (textract_results_lambda, textract_assemble_lambda):
+            grocery_list_bucket.grant_read_write(function, "extracted/*")
+
         # Load the ASL definition from the JSON file
         with open("./state_machine/state_machine_definition.asl.json", "r") as file:
             state_machine_definition = json.load(file)
+        if extraction_mode == "bedrock":
+            state_machine_definition = use_bedrock_extraction(state_machine_definition)
+        bedrock_model_arn = f"arn:aws:bedrock:{self.region}::foundation-model/{MODEL_ID}"
 
         # Create the Step Functions state machine using the ASL definition
         state_machine = sfn.StateMachine(
@@ -244,6 +408,12 @@ class ApiLambdaS3SfnStack(Stack):
             definition_substitutions={
                 "SQS_QUEUE_URL": sqs_queue.queue_url,
                 "INVOKE_LAMBDA_FUNCTION_ARN": invoke_agent_lambda.function_arn,
+                "TEXTRACT_SNS_TOPIC_ARN": textract_completion_topic.topic_arn,
+                "TEXTRACT_SNS_ROLE_ARN": textract_sns_role.role_arn,
+                "TEXTRACT_COMPLETION_FUNCTION_ARN": textract_completion_lambda.function_arn,
+                "TEXTRACT_RESULTS_FUNCTION_ARN": textract_results_lambda.function_arn,
+                "TEXTRACT_ASSEMBLE_FUNCTION_ARN": textract_assemble_lambda.function_arn,
+                "BEDROCK_MODEL_ARN": bedrock_model_arn,
             },
             # Use definition_body
             state_machine_type=sfn.StateMachineType.STANDARD,
@@ -251,7 +421,13 @@ class ApiLambdaS3SfnStack(Stack):
 
         # Grant the Lambda function permissions to send task success/failure
         state_machine.grant_task_response(sqs_poller_lambda)
+        state_machine.grant_task_response(textract_completion_lambda)
         invoke_agent_lambda.grant_invoke(state_machine)
+        textract_completion_lambda.grant_invoke(state_machine)
+        textract_results_lambda.grant_invoke(state_machine)
+        textract_assemble_lambda.grant_invoke(state_machine)
+        # The state machine hands the SNS publish role to Textract
+        textract_sns_role.grant_pass_role(state_machine.role)
         invoke_agent_lambda.add_environment(
             "ECOMMERCE_TABLE_NAME", ecommerce_table.table_name
         )
@@ -266,6 +442,8 @@ class ApiLambdaS3SfnStack(Stack):
         state_machine.grant_start_execution(
             trigger_step_function_products_lambda_function
         )
+        # Describes the execution of the first upload of duplicated content
+        state_machine.grant_read(trigger_step_function_products_lambda_function)
 
         # Grant the state machine permissions to interact with S3
         grocery_list_bucket.grant_read_write(state_machine)
@@ -282,19 +460,137 @@ class ApiLambdaS3SfnStack(Stack):
             )
         )
 
+        # submitGroceryList starts the workflow with the text itself and waits
+        # for the payment link until its deadline
+        submit_grocery_list_lambda = PythonFunction(
+            self,
+            "SubmitGroceryList",
+            runtime=Runtime.PYTHON_3_11,
+            entry="./submit_grocery_list",
+            index="submit_grocery_list.py",
+            handler="handler",
+            layers=[shared_layer],
+            timeout=Duration.seconds(30),
+            environment={
+                "STATE_MACHINE_ARN": state_machine.state_machine_arn,
+                "TEXT_STORE_BUCKET": grocery_list_bucket.bucket_name,
+            },
+        )
+        state_machine.grant_start_execution(submit_grocery_list_lambda)
+        state_machine.grant_read(submit_grocery_list_lambda)
+        grocery_list_bucket.grant_write(submit_grocery_list_lambda, "extracted/*")
+        api.add_lambda_data_source(
+            "SubmitGroceryListDataSource", submit_grocery_list_lambda
+        ).create_resolver(
+            id="SubmitGroceryListResolver",
+            type_name="Mutation",
+            field_name="submitGroceryList",
+            request_mapping_template=aws_appsync.MappingTemplate.lambda_request(),
+            response_mapping_template=aws_appsync.MappingTemplate.lambda_result(),
+        )
+
         # Grant the state machine permissions to send messages to the SQS queue
         sqs_queue.grant_send_messages(state_machine)
+
+        if extraction_mode == "bedrock":
+            state_machine.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["bedrock:InvokeModel"],
+                    resources=[bedrock_model_arn],
+                )
+            )
+
+        # Express fast lane for single images: one synchronous Textract call
+        # and a direct Lambda extraction, no task tokens
+        if enable_express_image_workflow:
+            extract_grocery_list_lambda = PythonFunction(
+                self,
+                "ExtractGroceryList",
+                runtime=aws_lambda.Runtime.PYTHON_3_11,
+                handler="direct_handler",
+                index="lambda_sqs_poller.py",
+                entry="./sqs_poller",
+                layers=[shared_layer],
+                timeout=Duration.seconds(60),
+                environment={
+                    "ECOMMERCE_TABLE_NAME": ecommerce_table.table_name,
+                    "TEXT_STORE_BUCKET": grocery_list_bucket.bucket_name,
+                },
+            )
+            extract_grocery_list_lambda.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=[
+                        "bedrock:InvokeModel",
+                        "bedrock:InvokeModelWithResponseStream",
+                    ],
+                    resources=["*"],
+                )
+            )
+            ecommerce_table.grant_read_write_data(extract_grocery_list_lambda)
+            grocery_list_bucket.grant_read_write(
+                extract_grocery_list_lambda, "extracted/*"
+            )
+
+            with open("./state_machine/express_image_workflow.asl.json", "r") as file:
+                express_definition = json.load(file)
+
+            express_state_machine = sfn.StateMachine(
+                self,
+                "GroceryImageExpressStateMachine",
+                definition_body=sfn.DefinitionBody.from_string(
+                    json.dumps(express_definition)
+                ),
+                definition_substitutions={
+                    "EXTRACT_FUNCTION_ARN": extract_grocery_list_lambda.function_arn,
+                    "INVOKE_LAMBDA_FUNCTION_ARN": invoke_agent_lambda.function_arn,
+                },
+                state_machine_type=sfn.StateMachineType.EXPRESS,
+                timeout=Duration.minutes(5),
+                logs=sfn.LogOptions(
+                    destination=logs.LogGroup(
+                        self,
+                        "GroceryImageExpressLogs",
+                        retention=logs.RetentionDays.ONE_WEEK,
+                    ),
+                    level=sfn.LogLevel.ERROR,
+                ),
+            )
+            grocery_list_bucket.grant_read(express_state_machine)
+            express_state_machine.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["textract:DetectDocumentText"],
+                    resources=["*"],
+                )
+            )
+            extract_grocery_list_lambda.grant_invoke(express_state_machine)
+            invoke_agent_lambda.grant_invoke(express_state_machine)
+
+            trigger_step_function_products_lambda_function.add_environment(
+                "EXPRESS_STATE_MACHINE_ARN", express_state_machine.state_machine_arn
+            )
+            express_state_machine.grant_start_execution(
+                trigger_step_function_products_lambda_function
+            )
+            # submitGroceryList runs texts synchronously on the Express workflow
+            submit_grocery_list_lambda.add_environment(
+                "EXPRESS_STATE_MACHINE_ARN", express_state_machine.state_machine_arn
+            )
+            express_state_machine.grant_start_sync_execution(submit_grocery_list_lambda)
         # Outputs
 
         # Step 11: Add an SQS event source mapping to trigger the Lambda function
-        sqs_event_source = lambda_event_sources.SqsEventSource(sqs_queue)
+        # Records of a batch are processed concurrently, failed ones are retried alone
+        sqs_event_source = lambda_event_sources.SqsEventSource(
+            sqs_queue,
+            batch_size=10,
+            report_batch_item_failures=True,
+        )
         sqs_poller_lambda.add_event_source(sqs_event_source)
 
-        sqs_poller_lambda.add_environment("SQS_QUEUE_URL", sqs_queue.queue_url)
-
         self.sqs_poller_lambda = sqs_poller_lambda
         self.invoke_agent_lambda = invoke_agent_lambda
         self.secret = secret
+        self.shared_layer = shared_layer
         self.trigger_step_function_products_lambda = (
             trigger_step_function_products_lambda_function
         )
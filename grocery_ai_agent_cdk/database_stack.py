@@ -18,6 +18,8 @@ class DatabaseStack(Stack):
             sort_key=dynamodb.Attribute(name="SK", type=dynamodb.AttributeType.STRING),
             billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
             stream=dynamodb.StreamViewType.NEW_IMAGE,
+            # Cache items (e.g. CARTLINK#) expire through this attribute
+            time_to_live_attribute="expiresAt",
         )
 
         # Add Global Secondary Indexes (GSIs)
@@ -1,3 +1,5 @@
+import json
+
 from aws_cdk import (
     Stack,
     aws_events as events,
@@ -64,6 +66,16 @@ class PipesAndEventbridgeStack(Stack):
             role_arn=pipe_role.role_arn,
             source=ecommerce_table.table_stream_arn,
             source_parameters=pipes.CfnPipe.PipeSourceParametersProperty(
+                # Only payment link rows are events; lookup and cache items are not
+                filter_criteria=pipes.CfnPipe.FilterCriteriaProperty(
+                    filters=[
+                        pipes.CfnPipe.FilterProperty(
+                            pattern=json.dumps(
+                                {"dynamodb": {"Keys": {"PK": {"S": ["PAYMENLINK"]}}}}
+                            )
+                        )
+                    ]
+                ),
                 dynamo_db_stream_parameters=pipes.CfnPipe.PipeSourceDynamoDBStreamParametersProperty(
                     starting_position="LATEST",
                     batch_size=1,
@@ -0,0 +1,36 @@
+import json
+
+from sqs_poller.prompts import NO_GROCERY_LIST, build_extraction_prompt
+
+# "sqs": every document is buffered in the queue for the poller (fast path,
+# extraction cache, batching and streaming); "bedrock": the state machine
+# calls the model itself and only long or throttled texts are queued
+EXTRACTION_MODES = ("sqs", "bedrock")
+
+
+def use_bedrock_extraction(definition: dict) -> dict:
+    """
+    Merge the states of state_machine/bedrock_extraction_states.asl.json into
+    the workflow so inline texts are extracted with the optimized Bedrock
+    integration instead of the SQS queue and the poller Lambda.
+
+    The prompt is the poller's, split around the document text so the
+    JSONata expression only concatenates.
+    """
+    with open("./state_machine/bedrock_extraction_states.asl.json", "r") as file:
+        extraction_states = json.load(file)["States"]
+
+    marker = "\x00"
+    prompt_prefix, prompt_suffix = build_extraction_prompt(marker).split(marker)
+    extraction_states["InvokeModel"]["Arguments"]["Body"]["messages"][0]["content"] = (
+        f"{{% {json.dumps(prompt_prefix)} & $states.input.text & {json.dumps(prompt_suffix)} %}}"
+    )
+    extraction_states["HasGroceryList"]["Choices"][0]["Condition"] = (
+        f"{{% $contains($answer, {json.dumps(NO_GROCERY_LIST)}) %}}"
+    )
+
+    states = definition["States"]
+    for name in ("AssembleText", "Pass", "SubmittedText"):
+        states[name]["Next"] = "ChooseExtractionPath"
+    states.update(extraction_states)
+    return definition
@@ -0,0 +1,17 @@
+from typing import List, Optional
+
+# pydantic comes with the functions using the models (agent, sqs_poller)
+from pydantic import BaseModel, Field, TypeAdapter
+
+
+class Item(BaseModel):
+    name: str = Field(min_length=1)
+    quantity: int = Field(ge=1)
+    unit: Optional[str] = None
+
+
+class ItemList(BaseModel):
+    products: List[Item]
+
+
+items_adapter = TypeAdapter(List[Item])
@@ -0,0 +1,18 @@
+import re
+
+
+def normalize_product_name(name: str) -> str:
+    """
+    Normalize a product name so catalog lookups are case and whitespace insensitive.
+    """
+    return " ".join(name.split()).lower()
+
+
+def price_lookup_key(name: str) -> str:
+    """
+    Deterministic Stripe price lookup_key for a product name, shared by the
+    catalog sync that sets it and the agent that resolves prices with it.
+    """
+    return "grocerly_" + re.sub(r"[^a-z0-9]+", "_", normalize_product_name(name)).strip(
+        "_"
+    )
@@ -0,0 +1,50 @@
+import random
+import threading
+from time import monotonic, sleep
+
+from stripe import APIConnectionError, RateLimitError
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: allows bursts of `capacity` requests and a
+    sustained `rate` requests per second across all worker threads.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+def call_with_backoff(
+    limiter: TokenBucket, func, *args, max_attempts: int = 6, base_delay: float = 0.5, **kwargs
+):
+    """
+    Call a Stripe API method through the limiter, retrying rate limit and
+    connection errors with exponential backoff and full jitter.
+    """
+    for attempt in range(max_attempts):
+        limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except (RateLimitError, APIConnectionError):
+            if attempt == max_attempts - 1:
+                raise
+            sleep(random.uniform(0, base_delay * 2**attempt))
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from time import monotonic
+from typing import Dict, NamedTuple
+
+import boto3
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+
+class _CachedSecret(NamedTuple):
+    value: str
+    fetched_at: float
+
+
+class SecretProvider:
+    """
+    Secrets Manager reader shared by every Lambda of the app.
+
+    One client is reused for the lifetime of the container and values are
+    cached in memory for ttl_seconds. Reads inside the last refresh_ahead_seconds
+    of the TTL trigger a background refresh, and once the TTL has expired a
+    failing refresh keeps serving the last good value.
+    """
+
+    def __init__(
+        self,
+        region_name: str = None,
+        ttl_seconds: int = 300,
+        refresh_ahead_seconds: int = 60,
+    ):
+        self.region_name = region_name
+        self.ttl_seconds = ttl_seconds
+        self.refresh_ahead_seconds = min(refresh_ahead_seconds, ttl_seconds)
+        self._client = None
+        self._cache: Dict[str, _CachedSecret] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client(
+                    "secretsmanager", region_name=self.region_name
+                )
+            return self._client
+
+    def get(self, secret_id: str) -> str:
+        """
+        Return the SecretString of a secret.
+
+        Raises the Secrets Manager error only when no value was ever fetched.
+        """
+        cached = self._cache.get(secret_id)
+        if cached is None:
+            return self._fetch(secret_id)
+
+        age = monotonic() - cached.fetched_at
+        if age >= self.ttl_seconds:
+            try:
+                return self._fetch(secret_id)
+            except Exception as e:
+                logger.warning(f"Refreshing secret {secret_id} failed, serving cached value: {e}")
+                return cached.value
+        if age >= self.ttl_seconds - self.refresh_ahead_seconds:
+            self._refresh_in_background(secret_id)
+        return cached.value
+
+    def get_json_value(self, secret_id: str, key: str) -> str:
+        """Return one key of a secret stored as a JSON object."""
+        return json.loads(self.get(secret_id))[key]
+
+    def invalidate(self, secret_id: str) -> None:
+        self._cache.pop(secret_id, None)
+
+    def _fetch(self, secret_id: str) -> str:
+        response = self.client.get_secret_value(SecretId=secret_id)
+        value = response["SecretString"]
+        self._cache[secret_id] = _CachedSecret(value=value, fetched_at=monotonic())
+        return value
+
+    def _refresh_in_background(self, secret_id: str) -> None:
+        with self._lock:
+            if secret_id in self._refreshing:
+                return
+            self._refreshing.add(secret_id)
+
+        def refresh():
+            try:
+                self._fetch(secret_id)
+            except Exception as e:
+                logger.warning(f"Background refresh of secret {secret_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(secret_id)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+provider = SecretProvider(
+    region_name=os.environ.get("SECRETS_REGION", "us-east-1"),
+    ttl_seconds=int(os.environ.get("SECRETS_TTL_SECONDS", "300")),
+)
+
+
+def get_stripe_key() -> str:
+    """
+    Stripe secret key, stored as {"STRIPE_SECRET_KEY": "sk_..."} in the
+    STRIPE_SECRET_NAME secret.
+    """
+    return provider.get_json_value(
+        os.environ.get("STRIPE_SECRET_NAME", "dev/stripe-secret"), "STRIPE_SECRET_KEY"
+    )
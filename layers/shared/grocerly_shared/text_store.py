@@ -0,0 +1,115 @@
+import gzip
+import hashlib
+import os
+import threading
+from typing import Optional
+
+import boto3
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+
+class TextIntegrityError(ValueError):
+    """Raised when a stored text does not match the size and hash of its reference."""
+
+
+class TextStore:
+    """
+    Claim check for the document text passed between the state machine, SQS
+    and the Lambdas.
+
+    Texts up to inline_limit_bytes stay in the payload as {field: text}.
+    Larger ones are written once, gzip compressed, to
+    s3://bucket/<prefix><sha256>.txt.gz and only
+    {f"{field}_ref": {"bucket", "key", "size", "sha256"}} travels on.
+    """
+
+    def __init__(
+        self,
+        bucket: Optional[str],
+        inline_limit_bytes: int = 32768,
+        prefix: str = "extracted/",
+    ):
+        self.bucket = bucket
+        self.inline_limit_bytes = inline_limit_bytes
+        self.prefix = prefix
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._client = boto3.client("s3")
+            return self._client
+
+    def put(self, text: str, field: str = "text", inline_limit_bytes: int = None) -> dict:
+        """
+        Returns:
+            dict: The payload fields carrying the text, to merge into the payload.
+        """
+        data = text.encode()
+        limit = self.inline_limit_bytes if inline_limit_bytes is None else inline_limit_bytes
+        if len(data) <= limit:
+            return {field: text}
+        if not self.bucket:
+            logger.warning(f"No text store bucket, passing {len(data)} bytes inline")
+            return {field: text}
+
+        digest = hashlib.sha256(data).hexdigest()
+        # Content addressed, identical texts share one object
+        key = f"{self.prefix}{digest}.txt.gz"
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=gzip.compress(data),
+            ContentType="text/plain; charset=utf-8",
+            ContentEncoding="gzip",
+        )
+        logger.info(f"Stored {len(data)} bytes of text in s3://{self.bucket}/{key}")
+        return {
+            f"{field}_ref": {
+                "bucket": self.bucket,
+                "key": key,
+                "size": len(data),
+                "sha256": digest,
+            }
+        }
+
+    def get(self, payload: dict, field: str = "text") -> str:
+        """
+        Return the text of a payload, inline or referenced.
+
+        Raises:
+            TextIntegrityError: When the stored text does not match its reference.
+        """
+        if field in payload:
+            return payload[field]
+
+        reference = payload[f"{field}_ref"]
+        body = self.client.get_object(Bucket=reference["bucket"], Key=reference["key"])[
+            "Body"
+        ]
+        data = gzip.decompress(body.read())
+        if len(data) != reference["size"] or (
+            hashlib.sha256(data).hexdigest() != reference["sha256"]
+        ):
+            raise TextIntegrityError(
+                f"s3://{reference['bucket']}/{reference['key']} does not match its reference"
+            )
+        return data.decode()
+
+
+store = TextStore(
+    bucket=os.environ.get("TEXT_STORE_BUCKET"),
+    inline_limit_bytes=int(os.environ.get("TEXT_INLINE_LIMIT_BYTES", "32768")),
+)
+
+
+def put_text(text: str, field: str = "text", inline_limit_bytes: int = None) -> dict:
+    return store.put(text, field, inline_limit_bytes)
+
+
+def get_text(payload: dict, field: str = "text") -> str:
+    return store.get(payload, field)
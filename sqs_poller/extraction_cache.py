@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from time import time
+from typing import Callable, Optional
+
+from aws_lambda_powertools import Logger
+
+logger = Logger(child=True)
+
+
+def normalize_text(text: str) -> str:
+    """
+    Collapse whitespace and blank lines so re-scans of the same list share a key.
+    """
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def extraction_cache_key(text: str, model_id: str, prompt_version: str) -> str:
+    payload = "\n".join([model_id, prompt_version, normalize_text(text)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ExtractionCache:
+    """
+    Two-level cache of model extractions: an in-process LRU in front of
+    GroceryAppTable items (PK EXTRACTION#<key>) that expire through the table
+    TTL attribute expiresAt.
+    """
+
+    def __init__(
+        self,
+        table,
+        count_metric: Callable[[str], None],
+        ttl_seconds: int = 86400,
+        max_entries: int = 256,
+    ):
+        self.table = table
+        self.count_metric = count_metric
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(key: str) -> dict:
+        return {"PK": f"EXTRACTION#{key}", "SK": "EXTRACTION"}
+
+    def _remember(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: str, count: bool = True) -> Optional[str]:
+        """
+        Args:
+            key: Extraction cache key.
+            count: Record hit/miss metrics; lookups that only decide what to
+                prefetch pass False so each document is counted once.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+        if value is not None:
+            if count:
+                self.count_metric("ExtractionCacheMemoryHit")
+            return value
+
+        try:
+            item = self.table.get_item(Key=self._key(key)).get("Item")
+        except Exception as e:
+            logger.warning(f"Failed to read extraction cache: {e}")
+            item = None
+        if item and int(item.get("expiresAt", 0)) > time():
+            self._remember(key, item["result"])
+            if count:
+                self.count_metric("ExtractionCacheTableHit")
+            return item["result"]
+
+        if count:
+            self.count_metric("ExtractionCacheMiss")
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        self._remember(key, value)
+        try:
+            self.table.put_item(
+                Item={
+                    **self._key(key),
+                    "result": value,
+                    "expiresAt": int(time()) + self.ttl_seconds,
+                }
+            )
+        except Exception as e:
+            logger.warning(f"Failed to write extraction cache: {e}")
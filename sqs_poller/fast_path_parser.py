@@ -0,0 +1,229 @@
+import json
+import re
+from typing import List, NamedTuple, Optional
+
+# Unit spellings found on shopping lists mapped to their canonical form
+UNIT_ALIASES = {
+    "kg": "kg",
+    "kgs": "kg",
+    "kilo": "kg",
+    "kilos": "kg",
+    "kilogram": "kg",
+    "kilograms": "kg",
+    "g": "g",
+    "gr": "g",
+    "grams": "g",
+    "gram": "g",
+    "lb": "lb",
+    "lbs": "lb",
+    "pound": "lb",
+    "pounds": "lb",
+    "oz": "oz",
+    "ounce": "oz",
+    "ounces": "oz",
+    "l": "l",
+    "ltr": "l",
+    "litre": "l",
+    "litres": "l",
+    "liter": "l",
+    "liters": "l",
+    "ml": "ml",
+    "dozen": "dozen",
+    "doz": "dozen",
+    "pack": "pack",
+    "packs": "pack",
+    "pk": "pack",
+    "packet": "pack",
+    "packets": "pack",
+    "bottle": "bottle",
+    "bottles": "bottle",
+    "can": "can",
+    "cans": "can",
+    "tin": "can",
+    "tins": "can",
+    "box": "box",
+    "boxes": "box",
+    "bag": "bag",
+    "bags": "bag",
+    "bunch": "bunch",
+    "bunches": "bunch",
+    "jar": "jar",
+    "jars": "jar",
+    "loaf": "loaf",
+    "loaves": "loaf",
+    "pc": "pcs",
+    "pcs": "pcs",
+    "piece": "pcs",
+    "pieces": "pcs",
+}
+
+# Product words that make a bare number credible as a count ("Lemons 3" but not "Table 4")
+GROCERY_WORDS = frozenset(
+    """
+    apple apricot avocado banana berry blueberry cherry fruit grape kiwi lemon
+    lime mango melon orange peach pear pineapple plum pomegranate prune
+    raspberry strawberry watermelon smoothie
+    bean broccoli cabbage carrot celery corn cucumber garlic ginger herb leek
+    lettuce mushroom onion pea pepper potato spinach tomato vegetable zucchini
+    bagel biscuit bread butter cake cereal cheese chocolate cookie cream egg
+    flour honey jam juice ketchup milk noodle oat oil pasta rice salt sauce
+    soup sugar tofu vinegar yoghurt yogurt
+    bacon beef chicken fish ham lamb meat pork salmon sausage tuna
+    beer coffee soda tea wine almond nut
+    """.split()
+)
+
+_UNIT = "|".join(sorted(map(re.escape, UNIT_ALIASES), key=len, reverse=True))
+_QTY = r"\d+(?:[.,]\d+)?"
+
+# "- ", "* ", "• ", "1. ", "2) ", "[ ] " list markers
+_BULLET = re.compile(r"^(?:[-*•·+]|\d+[.)]|\[\s?[xX]?\s?\])\s+")
+# "2 kg apples", "2kg apples", "3 x eggs", "2 bottles of milk"
+_QTY_FIRST = re.compile(
+    rf"^(?P<qty>{_QTY})\s*(?:(?P<unit>{_UNIT})\.?\s+(?:of\s+)?|(?P<times>[x×])\s*|\s+)(?P<name>.*[^\W\d_].*)$",
+    re.IGNORECASE,
+)
+# "apples 2kg", "Milk x3", "apples - 2", "Milk, 2 l", "eggs: 12"
+_QTY_LAST = re.compile(
+    rf"^(?P<name>.*?[^\W\d_].*?)\s*(?:[-–:,=]\s*|\s)(?:(?P<times>[x×])\s*)?(?P<qty>{_QTY})\s*(?P<unit>{_UNIT})?\.?$",
+    re.IGNORECASE,
+)
+_HEADER = re.compile(
+    r"^(?:(?:my\s+)?(?:shopping|grocery|groceries|to\s*buy|list)\b.*|.*:)$", re.IGNORECASE
+)
+_NAME_ONLY = re.compile(r"^[^\W\d_][^\W_]*(?:[\s'&/-]+[^\W_]+){0,3}$")
+
+# Confidence of a single line by how it was recognized: a unit, an "x N" count
+# or a known product make the quantity explicit
+EXPLICIT_QUANTITY_CONFIDENCE = 1.0
+# "Total: 45", "Table 4": a number after unknown words is as likely a label
+BARE_QUANTITY_CONFIDENCE = 0.6
+# Digits left in the name usually mean prices, dates or times, not an item
+NAME_WITH_DIGITS_CONFIDENCE = 0.3
+NAME_ONLY_CONFIDENCE = 0.6
+UNRECOGNIZED_CONFIDENCE = 0.0
+MAX_NAME_WORDS = 5
+# Larger counts without a unit are order numbers, years or amounts
+MAX_BARE_QUANTITY = 50
+
+
+class ParsedItem(NamedTuple):
+    name: str
+    quantity: float
+    unit: Optional[str]
+
+
+class FastPathResult(NamedTuple):
+    items: List[ParsedItem]
+    confidence: float
+
+    def to_text(self) -> str:
+        """
+        Render the items one JSON object per line, like the model answers.
+        Only whole quantities are accepted by parse_grocery_list.
+        """
+        return "\n".join(
+            json.dumps(
+                {
+                    "name": item.name,
+                    "quantity": int(item.quantity),
+                    "unit": item.unit,
+                }
+            )
+            for item in self.items
+        )
+
+
+def _quantity(value: str) -> float:
+    return float(value.replace(",", "."))
+
+
+def _singular(word: str) -> str:
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def _is_grocery(name: str) -> bool:
+    return any(
+        word in GROCERY_WORDS or _singular(word) in GROCERY_WORDS
+        for word in re.findall(r"[^\W\d_]+", name.lower())
+    )
+
+
+def _quantity_confidence(name: str, quantity: float, unit, times) -> float:
+    if re.search(r"\d", name):
+        return NAME_WITH_DIGITS_CONFIDENCE
+    if unit or times:
+        return EXPLICIT_QUANTITY_CONFIDENCE
+    if quantity > MAX_BARE_QUANTITY:
+        return UNRECOGNIZED_CONFIDENCE
+    return EXPLICIT_QUANTITY_CONFIDENCE if _is_grocery(name) else BARE_QUANTITY_CONFIDENCE
+
+
+def parse_line(line: str):
+    """
+    Parse one line of a list.
+
+    Returns:
+        tuple: (ParsedItem or None, confidence). Blank and header lines return
+        (None, None) so they don't count against the document.
+    """
+    line = " ".join(line.split())
+    line = _BULLET.sub("", line).strip(" .;")
+    if not line or _HEADER.match(line):
+        return None, None
+    # Sentences are never list entries; skipping them also keeps the regexes linear
+    if len(line.split()) > MAX_NAME_WORDS + 3:
+        return None, UNRECOGNIZED_CONFIDENCE
+
+    for pattern in (_QTY_FIRST, _QTY_LAST):
+        match = pattern.match(line)
+        if match:
+            name = match.group("name").strip(" -–:,")
+            if len(name.split()) > MAX_NAME_WORDS:
+                break
+            unit = match.group("unit")
+            quantity = _quantity(match.group("qty"))
+            return (
+                ParsedItem(
+                    name=name,
+                    quantity=quantity,
+                    unit=UNIT_ALIASES[unit.lower()] if unit else None,
+                ),
+                _quantity_confidence(name, quantity, unit, match.group("times")),
+            )
+
+    if _NAME_ONLY.match(line):
+        return ParsedItem(name=line, quantity=1, unit=None), NAME_ONLY_CONFIDENCE
+    return None, UNRECOGNIZED_CONFIDENCE
+
+
+def parse_grocery_list(text: str) -> FastPathResult:
+    """
+    Rule-based extraction of items, quantities and units from a typed list.
+
+    The confidence is the mean confidence of the non-blank, non-header lines:
+    1.0 for lines with a unit, an "x N" count or a known product, 0.6 for bare
+    item names and numbers after unknown words, and 0 for lines that don't look
+    like list entries (prose, prices, addresses...). Zero and fractional counts
+    are not line items as written, so documents with one go to the model.
+    """
+    items, scores = [], []
+    for line in text.splitlines():
+        item, confidence = parse_line(line)
+        if confidence is None:
+            continue
+        scores.append(confidence)
+        if item is not None:
+            items.append(item)
+
+    if not items or any(
+        item.quantity < 1 or item.quantity != int(item.quantity) for item in items
+    ):
+        return FastPathResult(items=[], confidence=0.0)
+    return FastPathResult(items=items, confidence=sum(scores) / len(scores))
@@ -1,95 +1,429 @@
 import json
 import boto3
 import os
-from aws_lambda_powertools import Logger
-from aws_lambda_powertools.utilities.data_classes import event_source, SQSEvent
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from aws_lambda_powertools import Logger, Metrics
+from aws_lambda_powertools.metrics import MetricUnit
+from aws_lambda_powertools.utilities.batch import (
+    BatchProcessor,
+    EventType,
+    process_partial_response,
+)
+from aws_lambda_powertools.utilities.data_classes.sqs_event import SQSRecord
+
+from extraction_cache import ExtractionCache, extraction_cache_key
+from grocerly_shared.text_store import get_text, put_text
+from fast_path_parser import parse_grocery_list
+from models import describe_items, parse_item_lines, render_item_lines
+from prompts import (
+    MODEL_ID,
+    NO_GROCERY_LIST,
+    PROMPT_VERSION,
+    build_batch_extraction_prompt,
+    build_extraction_prompt,
+)
 
 # Initialize AWS clients
-sqs_client = boto3.client("sqs")
 bedrock_client = boto3.client("bedrock-runtime")
 stepfunctions_client = boto3.client("stepfunctions")  # Step Functions client
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ.get("ECOMMERCE_TABLE_NAME"))
+
+# Records of a batch processed at the same time
+MAX_CONCURRENT_RECORDS = int(os.environ.get("MAX_CONCURRENT_RECORDS", "10"))
+
+# Typed lists parsed with at least this confidence skip the model (> 1 disables)
+FAST_PATH_CONFIDENCE_THRESHOLD = float(
+    os.environ.get("FAST_PATH_CONFIDENCE_THRESHOLD", "0.9")
+)
+
+# Pack the documents of an SQS batch into shared Bedrock requests
+BEDROCK_BATCH_MODE = os.environ.get("BEDROCK_BATCH_MODE", "false").lower() == "true"
+BEDROCK_BATCH_MAX_DOCUMENTS = int(os.environ.get("BEDROCK_BATCH_MAX_DOCUMENTS", "5"))
+# Longer documents are always extracted on their own
+BEDROCK_BATCH_MAX_DOCUMENT_CHARS = 4000
+MAX_TOKENS_PER_DOCUMENT = 300
+# Stream single-document responses and stop reading at the negative answer
+BEDROCK_STREAMING = os.environ.get("BEDROCK_STREAMING", "false").lower() == "true"
+# A response starting with this is the negative answer, no need to read further
+NO_GROCERY_LIST_SENTINEL = "No grocery list"
 
-# Get the SQS queue URL from environment variables
-sqs_queue_url = os.environ["SQS_QUEUE_URL"]
+# Deliveries before SQS moves a message to the DLQ (max_receive_count of the
+# queue); the last one fails the task instead of leaving the execution waiting
+MAX_RECEIVE_COUNT = int(os.environ.get("MAX_RECEIVE_COUNT", "3"))
+
+# Bedrock errors that are worth redelivering the message for
+RETRYABLE_BEDROCK_ERRORS = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+}
 
 logger = Logger(service="sqs_poller")
+metrics = Metrics(namespace="grocery_sqs_poller_metrics", service="sqs_poller")
+metrics_lock = threading.Lock()
 
 
-@event_source(data_class=SQSEvent)
-@logger.inject_lambda_context(log_event=True)
-def handler(event: SQSEvent, context):
-    # Log the event for debugging
-    logger.info(f"Received event: {event}")
+def count_metric(name: str) -> None:
+    # Metrics is shared by the threads processing the batch
+    with metrics_lock:
+        metrics.add_metric(name=name, unit=MetricUnit.Count, value=1)
+
+
+extraction_cache = ExtractionCache(
+    table,
+    count_metric,
+    ttl_seconds=int(os.environ.get("EXTRACTION_CACHE_TTL_SECONDS", "86400")),
+)
+
+
+class ThreadedBatchProcessor(BatchProcessor):
+    """
+    BatchProcessor that handles the records of a batch on a bounded thread
+    pool instead of one after the other.
+    """
+
+    def __init__(self, event_type: EventType, max_workers: int):
+        super().__init__(event_type)
+        self.max_workers = max_workers
+
+    def process(self):
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(self._process_record, self.records))
+
+
+processor = ThreadedBatchProcessor(EventType.SQS, MAX_CONCURRENT_RECORDS)
+
+
+def _model_body(prompt: str, max_tokens: int) -> str:
+    return json.dumps(
+        {
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "anthropic_version": "bedrock-2023-05-31",
+        }
+    )
+
+
+def invoke_model(prompt: str, max_tokens: int = MAX_TOKENS_PER_DOCUMENT) -> str:
+    # Call the Bedrock AI model
+    response = bedrock_client.invoke_model(
+        modelId=MODEL_ID,
+        body=_model_body(prompt, max_tokens),
+    )
+
+    # Parse the response from Bedrock
+    response_body = json.loads(response["body"].read())
+    return response_body.get("content", [{}])[0].get("text", "")
+
+
+def invoke_model_streaming(prompt: str, max_tokens: int = MAX_TOKENS_PER_DOCUMENT) -> str:
+    """
+    Stream the model response, collecting list lines as they complete.
+
+    The stream is closed as soon as the response turns out to be the negative
+    answer, so negative documents stop paying for output tokens and latency
+    after the first few tokens.
+    """
+    response = bedrock_client.invoke_model_with_response_stream(
+        modelId=MODEL_ID,
+        body=_model_body(prompt, max_tokens),
+    )
+    stream = response["body"]
+    lines, pending = [], ""
+    try:
+        for event in stream:
+            chunk = event.get("chunk")
+            if not chunk:
+                continue
+            payload = json.loads(chunk["bytes"])
+            if payload.get("type") == "message_stop":
+                break
+            if payload.get("type") != "content_block_delta":
+                continue
+
+            pending += payload["delta"].get("text", "")
+            if not lines and pending.lstrip(' \n"').startswith(
+                NO_GROCERY_LIST_SENTINEL
+            ):
+                logger.info("Negative answer detected, closing the stream")
+                return NO_GROCERY_LIST
+            *complete, pending = pending.split("\n")
+            lines.extend(line.strip() for line in complete if line.strip())
+    finally:
+        stream.close()
+
+    if pending.strip():
+        lines.append(pending.strip())
+    return "\n".join(lines)
+
+
+def extract_grocery_list(input_text: str) -> str:
+    """
+    Extract the grocery list from the text. Clean typed lists are parsed by
+    the rule-based fast path; otherwise the model output of an identical
+    document is reused when one is cached.
+    """
+    fast_path = parse_grocery_list(input_text)
+    if fast_path.confidence >= FAST_PATH_CONFIDENCE_THRESHOLD:
+        logger.info(f"Fast path parsed {len(fast_path.items)} items")
+        count_metric("FastPathHit")
+        return fast_path.to_text()
+
+    key = extraction_cache_key(input_text, MODEL_ID, PROMPT_VERSION)
+    cached = extraction_cache.get(key)
+    if cached is not None:
+        logger.info(f"Extraction cache hit: {key}")
+        return cached
+
+    # Use the Bedrock foundation model to process the text
+    prompt = build_extraction_prompt(input_text)
+    if BEDROCK_STREAMING:
+        manipulated_text = invoke_model_streaming(prompt)
+    else:
+        manipulated_text = invoke_model(prompt)
+    extraction_cache.put(key, manipulated_text)
+    return manipulated_text
+
+
+def parse_batch_response(text: str, document_ids) -> dict:
+    """
+    Map a batched response back to its documents, rendered like single
+    document answers. Entries that are missing, duplicated or fail validation
+    are left out so those documents are retried alone.
+    """
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end < start:
+        return {}
+    try:
+        entries = json.loads(text[start : end + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(entries, list):
+        return {}
 
-    for record in event.records:  # Ensure we handle multiple SQS messages
+    results, seen = {}, set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        document_id = str(entry.get("id"))
+        if document_id in seen:
+            results.pop(document_id, None)
+            continue
+        seen.add(document_id)
+        if document_id not in document_ids or "items" not in entry:
+            continue
+        if not entry["items"]:
+            # An empty list is the negative answer too
+            results[document_id] = NO_GROCERY_LIST
+            continue
         try:
-            logger.info(f"Processing record: {record}")
-            event_body = json.loads(record.body)
-            logger.info(f"Received event body: {event_body}")
-
-            # Extract the input data
-            input_text = event_body["input"]["text"]
-            task_token = event_body["taskToken"]
-            logger.info(f"Extracted Data - Text: {input_text}, TaskToken: {task_token}")
-
-            # Use the Bedrock foundation model to process the text
-            prompt = f"""You are a helpful assistant that extracts grocery items alongside their quantities and unit from text.
-            If the text contains a grocery list, respond with ONLY the list of items alongside their quantity and unit in this format:
-            - Item 1, kg
-            - Item 2, kg
-            - Item 3, kg
-
-            If the text does NOT contain a grocery list, respond with: "No grocery list found."
-
-            Here is the text:
-            {input_text}"""
-
-            # Call the Bedrock AI model
-            response = bedrock_client.invoke_model(
-                modelId="anthropic.claude-3-5-sonnet-20240620-v1:0",
-                body=json.dumps(
-                    {
-                        "messages": [{"role": "user", "content": prompt}],
-                        "max_tokens": 300,
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "anthropic_version": "bedrock-2023-05-31",
-                    }
-                ),
-            )
+            results[document_id] = render_item_lines(entry["items"])
+        except ValueError:
+            continue
+    return results
 
-            # Parse the response from Bedrock
-            response_body = json.loads(response["body"].read())
-            manipulated_text = response_body.get("content", [{}])[0].get("text", "")
-
-            # Log and process response
-            if "No grocery list found." in manipulated_text:
-                logger.info("No grocery list found in the extracted text.")
-                # Send task failure to Step Functions
-                stepfunctions_client.send_task_failure(
-                    taskToken=task_token,
-                    error="NoGroceryListFound",
-                    cause="The input text does not contain a grocery list.",
-                )
-            else:
-                logger.info(f"Grocery List:\n{manipulated_text}")
-                # Send task success to Step Functions
-                stepfunctions_client.send_task_success(
-                    taskToken=task_token,
-                    output=json.dumps(
-                        {"status": "SUCCESS", "grocery_list": manipulated_text}
-                    ),
-                )
-
-            # Delete the processed message from the queue
-            receipt_handle = record.receipt_handle
-            sqs_client.delete_message(
-                QueueUrl=sqs_queue_url, ReceiptHandle=receipt_handle
-            )
 
-        except Exception as e:
-            logger.error(f"Error processing SQS message: {str(e)}")
-            # Send task failure to Step Functions
+def extract_batch(documents) -> None:
+    """
+    Extract several documents with one Bedrock request and cache each result,
+    so the per-record handlers pick them up like any other cache hit.
+
+    Args:
+        documents: (cache key, text) pairs.
+    """
+    document_ids = {str(index): key for index, (key, _) in enumerate(documents)}
+    prompt = build_batch_extraction_prompt(
+        (str(index), text) for index, (_, text) in enumerate(documents)
+    )
+    try:
+        response = invoke_model(prompt, max_tokens=MAX_TOKENS_PER_DOCUMENT * len(documents))
+    except Exception as e:
+        logger.warning(f"Batched extraction failed, extracting documents alone: {e}")
+        return
+
+    results = parse_batch_response(response, document_ids)
+    for document_id, result in results.items():
+        extraction_cache.put(document_ids[document_id], result)
+    count_metric("BatchedExtractionRequest")
+    if len(results) < len(documents):
+        logger.warning(
+            f"Batched response mapped {len(results)} of {len(documents)} documents"
+        )
+
+
+def prefetch_batch_extractions(event: dict) -> None:
+    """
+    Group the documents of the SQS batch that would need their own model call
+    into requests of up to BEDROCK_BATCH_MAX_DOCUMENTS documents.
+    """
+    pending = {}
+    for record in event.get("Records", []):
+        try:
+            # Stored texts are longer than BEDROCK_BATCH_MAX_DOCUMENT_CHARS anyway
+            input_text = json.loads(record["body"])["input"]["text"]
+        except (KeyError, TypeError, ValueError):
+            continue
+        if len(input_text) > BEDROCK_BATCH_MAX_DOCUMENT_CHARS:
+            continue
+        if parse_grocery_list(input_text).confidence >= FAST_PATH_CONFIDENCE_THRESHOLD:
+            continue
+        key = extraction_cache_key(input_text, MODEL_ID, PROMPT_VERSION)
+        if key not in pending and extraction_cache.get(key, count=False) is None:
+            pending[key] = input_text
+
+    documents = list(pending.items())
+    if len(documents) < 2:
+        return
+    groups = [
+        documents[start : start + BEDROCK_BATCH_MAX_DOCUMENTS]
+        for start in range(0, len(documents), BEDROCK_BATCH_MAX_DOCUMENTS)
+    ]
+    with ThreadPoolExecutor(max_workers=len(groups)) as pool:
+        list(pool.map(extract_batch, groups))
+
+
+class NoGroceryListFound(Exception):
+    """The document has no grocery list; the error name the workflows match on."""
+
+
+class BedrockThrottled(Exception):
+    """Retryable Bedrock error, retried by the state machine of the direct path."""
+
+
+def extraction_output(manipulated_text: str):
+    """
+    Task output for the extraction result, or None when the document has no
+    grocery list.
+    """
+    if not manipulated_text.strip() or NO_GROCERY_LIST in manipulated_text:
+        logger.info("No grocery list found in the extracted text.")
+        return None
+
+    output = {"status": "SUCCESS"}
+    grocery_list = manipulated_text
+    item_list = parse_item_lines(manipulated_text)
+    if item_list is not None:
+        # Validated items let invoke_agent create the payment link directly;
+        # long lists go through the text store like the grocery list
+        items = [item.model_dump() for item in item_list.products]
+        stored_items = put_text(json.dumps(items), field="items")
+        output.update({"items": items} if "items" in stored_items else stored_items)
+        grocery_list = describe_items(item_list)
+    else:
+        logger.warning("Model answer is not a valid item list, leaving it to the agent")
+    logger.info(f"Grocery List:\n{grocery_list}")
+    output.update(put_text(grocery_list, field="grocery_list"))
+    return output
+
+
+def send_task_result(task_token: str, manipulated_text: str) -> None:
+    # Log and process response
+    output = extraction_output(manipulated_text)
+    if output is None:
+        # Send task failure to Step Functions
+        stepfunctions_client.send_task_failure(
+            taskToken=task_token,
+            error="NoGroceryListFound",
+            cause="The input text does not contain a grocery list.",
+        )
+        return
+
+    # Send task success to Step Functions
+    stepfunctions_client.send_task_success(
+        taskToken=task_token,
+        output=json.dumps(output),
+    )
+
+
+def record_handler(record: SQSRecord):
+    """
+    Process one SQS message. Raising marks the message as a batch item
+    failure so SQS redelivers it; errors that a retry can't fix are reported
+    to Step Functions instead.
+    """
+    logger.info(f"Processing record: {record.message_id}")
+    event_body = json.loads(record.body)
+
+    # Extract the input data
+    task_token = event_body["taskToken"]
+
+    try:
+        # Long texts are passed by reference to the text store
+        input_text = get_text(event_body["input"])
+        logger.info(f"Extracted Data - Text: {input_text}")
+        manipulated_text = extract_grocery_list(input_text)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in RETRYABLE_BEDROCK_ERRORS:
+            receive_count = int(record.attributes.approximate_receive_count)
+            if receive_count < MAX_RECEIVE_COUNT:
+                logger.warning(f"Bedrock is throttling, redelivering message: {e}")
+                raise
+            logger.error(f"Bedrock still throttling after {receive_count} deliveries: {e}")
             stepfunctions_client.send_task_failure(
-                taskToken=task_token, error="ProcessingError", cause=str(e)
+                taskToken=task_token, error="BedrockThrottled", cause=str(e)
             )
+            return
+        logger.error(f"Error processing SQS message: {str(e)}")
+        stepfunctions_client.send_task_failure(
+            taskToken=task_token, error="ProcessingError", cause=str(e)
+        )
+        return
+    except Exception as e:
+        logger.error(f"Error processing SQS message: {str(e)}")
+        # Send task failure to Step Functions
+        stepfunctions_client.send_task_failure(
+            taskToken=task_token, error="ProcessingError", cause=str(e)
+        )
+        return
+
+    try:
+        send_task_result(task_token, manipulated_text)
+    except (
+        stepfunctions_client.exceptions.TaskTimedOut,
+        stepfunctions_client.exceptions.TaskDoesNotExist,
+        stepfunctions_client.exceptions.InvalidToken,
+    ) as e:
+        # The execution is gone, redelivering the message can't help
+        logger.warning(f"Dropping result for closed task: {e}")
+
+
+@logger.inject_lambda_context(log_event=True)
+@metrics.log_metrics
+def handler(event, context):
+    if BEDROCK_BATCH_MODE:
+        prefetch_batch_extractions(event)
+    return process_partial_response(
+        event=event,
+        record_handler=record_handler,
+        processor=processor,
+        context=context,
+    )
+
+
+@logger.inject_lambda_context
+@metrics.log_metrics
+def direct_handler(event, context):
+    """
+    Synchronous extraction for workflows that invoke the Lambda directly
+    (Express workflows can't wait for a task token). Takes the same input as
+    the SQS message and returns the same output; a document without a
+    grocery list fails the invocation with NoGroceryListFound.
+    """
+    input_text = get_text(event["input"])
+    try:
+        manipulated_text = extract_grocery_list(input_text)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in RETRYABLE_BEDROCK_ERRORS:
+            raise BedrockThrottled(str(e)) from e
+        raise
+
+    output = extraction_output(manipulated_text)
+    if output is None:
+        raise NoGroceryListFound("The input text does not contain a grocery list.")
+    return output
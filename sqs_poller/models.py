@@ -0,0 +1,39 @@
+import json
+from typing import List, Optional
+
+from grocerly_shared.models import ItemList, items_adapter
+from pydantic import ValidationError
+
+
+def render_item_lines(items: List[dict]) -> str:
+    """Serialize items in the one-JSON-object-per-line form the model answers with."""
+    return "\n".join(
+        json.dumps(item.model_dump()) for item in items_adapter.validate_python(items)
+    )
+
+
+def parse_item_lines(text: str) -> Optional[ItemList]:
+    """
+    Validate a one-JSON-object-per-line answer.
+
+    Returns:
+        ItemList, or None when any line is not a valid item.
+    """
+    try:
+        raw_items = [
+            json.loads(line.strip().lstrip("-* ").rstrip(","))
+            for line in text.splitlines()
+            if line.strip()
+        ]
+        products = items_adapter.validate_python(raw_items)
+    except (ValueError, ValidationError):
+        return None
+    return ItemList(products=products) if products else None
+
+
+def describe_items(item_list: ItemList) -> str:
+    """Human readable "- Item, quantity unit" list, as handed to the agent."""
+    return "\n".join(
+        f"- {item.name}, {item.quantity} {item.unit}" if item.unit else f"- {item.name}, {item.quantity}"
+        for item in item_list.products
+    )
@@ -0,0 +1,48 @@
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+# Bump whenever the prompt changes so cached extractions are not reused
+PROMPT_VERSION = "2"
+
+NO_GROCERY_LIST = "No grocery list found."
+
+ITEM_SCHEMA = '{"name": "<item name>", "quantity": <whole number>, "unit": "<unit or null>"}'
+
+
+def build_extraction_prompt(input_text: str) -> str:
+    return f"""You are a helpful assistant that extracts grocery items alongside their quantities and unit from text.
+    If the text contains a grocery list, respond with ONLY the items, one JSON object per line and nothing else, in this format:
+    {ITEM_SCHEMA}
+    {ITEM_SCHEMA}
+
+    Use a quantity of 1 when the text gives none and null when it gives no unit.
+
+    If the text does NOT contain a grocery list, respond with: "{NO_GROCERY_LIST}"
+
+    Here is the text:
+    {input_text}"""
+
+
+def build_batch_extraction_prompt(documents) -> str:
+    """
+    Prompt extracting the grocery lists of several documents in one request.
+
+    Args:
+        documents: (document id, text) pairs.
+    """
+    wrapped = "\n".join(
+        f'<document id="{document_id}">\n{text}\n</document>'
+        for document_id, text in documents
+    )
+    return f"""You are a helpful assistant that extracts grocery items alongside their quantities and unit from text.
+    You will receive several documents, each wrapped in <document id="..."> tags. Handle every document on its own.
+    If a document contains a grocery list, its items are a JSON array of objects in this format:
+    {ITEM_SCHEMA}
+
+    Use a quantity of 1 when the text gives none and null when it gives no unit.
+    If a document does NOT contain a grocery list, its items are null.
+
+    Respond with ONLY a JSON array containing one object per document, in this format:
+    [{{"id": "<document id>", "items": <items of the document>}}]
+
+    Here are the documents:
+    {wrapped}"""
@@ -1,64 +1,277 @@
+import hashlib
 import json
 import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 from urllib.parse import unquote_plus
 from aws_lambda_powertools import Logger
 from aws_lambda_powertools.utilities.data_classes import event_source, S3Event
 
 # Initialize clients
-textract = boto3.client("textract", region_name="us-east-1")
-s3_client = boto3.client("s3", region_name="us-east-1")
-sqs_client = boto3.client("sqs", region_name="us-east-1")
 stepfunctions_client = boto3.client(
     "stepfunctions", region_name="us-east-1"
 )  # Step Functions client
+dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
+table = dynamodb.Table(os.environ.get("ECOMMERCE_TABLE_NAME"))
 
 # Get the Step Functions state machine ARN from environment variables
 state_machine_arn = os.environ["STATE_MACHINE_ARN"]
 
-logger = Logger()
+# Images up to this size take the Express workflow when one is deployed;
+# PDFs and larger images keep the Standard workflow
+express_state_machine_arn = os.environ.get("EXPRESS_STATE_MACHINE_ARN")
+EXPRESS_MAX_IMAGE_BYTES = int(os.environ.get("EXPRESS_MAX_IMAGE_BYTES", str(5 * 1024 * 1024)))
 
+# Allowed file extensions
+ALLOWED_EXTENSIONS = (".pdf", ".png", ".jpg", ".jpeg")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+MAX_CONCURRENT_STARTS = int(os.environ.get("MAX_CONCURRENT_STARTS", "10"))
+# Identical content uploaded again within this window is not processed again,
+# unless the execution of the first upload did not succeed
+UPLOAD_INDEX_TTL_SECONDS = int(os.environ.get("UPLOAD_INDEX_TTL_SECONDS", "604800"))
+# Express executions can't be described; past their maximum duration one that
+# left no payment link has failed
+EXPRESS_MAX_DURATION_SECONDS = 300
 
-@event_source(data_class=S3Event)
-@logger.inject_lambda_context(log_event=True)
-def handler(event: S3Event, context):
-    logger.info(f"Received S3 event: {event}")
+logger = Logger()
 
-    for record in event.records:
-        logger.info(f"Record: {record}")
-        bucket_name = record.s3.bucket.name
-        object_key = unquote_plus(record.s3.get_object.key)
 
-        # Allowed file extensions
-        allowed_extensions = (".pdf", ".png", ".jpg", ".jpeg")
+def execution_name(bucket_name: str, object_key: str, etag: str) -> str:
+    """
+    Deterministic execution name of an upload, so redelivered notifications
+    map to the execution already started for it.
+    """
+    return hashlib.sha256(f"{bucket_name}/{object_key}/{etag}".encode()).hexdigest()
 
-        logger.info(f"Processing file from bucket: {bucket_name}, key: {object_key}")
 
-        # Get the file type
-        file_extension = object_key.split(".")[-1].lower()
+def _claim_item(
+    bucket_name: str, object_key: str, etag: str, name: str, target_arn: str
+) -> dict:
+    now = int(time())
+    return {
+        "PK": f"UPLOAD#{etag}",
+        "SK": "UPLOAD",
+        "bucket": bucket_name,
+        "objectKey": object_key,
+        "executionName": name,
+        "stateMachineArn": target_arn,
+        "claimedAt": now,
+        "expiresAt": now + UPLOAD_INDEX_TTL_SECONDS,
+    }
 
-        # Check if the file has an allowed extension
-        if not object_key.lower().endswith(allowed_extensions):
-            logger.info(f"Skipping file: {object_key} (Not a supported format)")
-            return {"statusCode": 400, "body": "Unsupported file type"}
 
-        # Prepare the input for the Step Functions workflow
-        stepfunctions_input = {
-            "bucket_name": bucket_name,
-            "file_extension": file_extension,
-            "object_key": object_key,
+def claim_content(
+    bucket_name: str, object_key: str, etag: str, name: str, target_arn: str
+):
+    """
+    Record the upload in the content hash index (PK UPLOAD#<ETag>).
+
+    Returns:
+        dict: The upload that claimed the same content first (bucket, key,
+        executionName, stateMachineArn and claimedAt), or None when this
+        upload is the first.
+    """
+    try:
+        table.put_item(
+            Item=_claim_item(bucket_name, object_key, etag, name, target_arn),
+            ConditionExpression="attribute_not_exists(PK)",
+            ReturnValuesOnConditionCheckFailure="ALL_OLD",
+        )
+        return None
+    except table.meta.client.exceptions.ConditionalCheckFailedException as e:
+        claimed = e.response.get("Item", {})
+        return {
+            "bucket": claimed.get("bucket", {}).get("S"),
+            "key": claimed.get("objectKey", {}).get("S"),
+            "executionName": claimed.get("executionName", {}).get("S"),
+            # Claims written before the state machine was recorded
+            "stateMachineArn": claimed.get("stateMachineArn", {}).get(
+                "S", state_machine_arn
+            ),
+            "claimedAt": int(claimed.get("claimedAt", {}).get("N", "0")),
         }
 
-        logger.info("stepfunctions input is: " + str(stepfunctions_input))
 
-        # Start the Step Functions workflow
-        try:
-            response = stepfunctions_client.start_execution(
-                stateMachineArn=state_machine_arn, input=json.dumps(stepfunctions_input)
+def take_over_claim(
+    bucket_name: str,
+    object_key: str,
+    etag: str,
+    name: str,
+    target_arn: str,
+    original: dict,
+) -> bool:
+    """
+    Replace the claim of an upload whose execution did not succeed.
+
+    Returns:
+        bool: False when another upload of the same content took it over first.
+    """
+    try:
+        table.put_item(
+            Item=_claim_item(bucket_name, object_key, etag, name, target_arn),
+            ConditionExpression="executionName = :name",
+            ExpressionAttributeValues={":name": original["executionName"]},
+        )
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+
+def original_outcome(original: dict) -> str:
+    """
+    Outcome of the execution of the upload that claimed the content first:
+    SUCCEEDED once invoke_agent recorded its payment link, RUNNING while the
+    execution may still record it, FAILED otherwise.
+    """
+    name = original["executionName"]
+    # invoke_agent records the link under the session id, the execution name
+    payment_link = table.get_item(
+        Key={"PK": "PAYMENLINK", "SK": f"USERID#{name}"}, ProjectionExpression="PK"
+    )
+    if "Item" in payment_link:
+        return "SUCCEEDED"
+
+    target_arn = original["stateMachineArn"]
+    if express_state_machine_arn and target_arn == express_state_machine_arn:
+        running = time() - original["claimedAt"] < EXPRESS_MAX_DURATION_SECONDS
+        return "RUNNING" if running else "FAILED"
+
+    execution_arn = f"{target_arn.replace(':stateMachine:', ':execution:', 1)}:{name}"
+    try:
+        execution = stepfunctions_client.describe_execution(executionArn=execution_arn)
+    except stepfunctions_client.exceptions.ExecutionDoesNotExist:
+        return "FAILED"
+    # A succeeded execution without a link ended with the agent's error message
+    return "RUNNING" if execution["status"] == "RUNNING" else "FAILED"
+
+
+def release_claim(etag: str, name: str) -> None:
+    """Drop the claim of an upload whose execution could not be started."""
+    try:
+        table.delete_item(
+            Key={"PK": f"UPLOAD#{etag}", "SK": "UPLOAD"},
+            ConditionExpression="executionName = :name",
+            ExpressionAttributeValues={":name": name},
+        )
+    except Exception as e:
+        logger.warning(f"Failed to release upload claim {etag}: {e}")
+
+
+def select_state_machine(object_key: str, size: int) -> str:
+    """Route single images to the Express workflow, everything else to Standard."""
+    if (
+        express_state_machine_arn
+        and object_key.lower().endswith(IMAGE_EXTENSIONS)
+        and size is not None
+        and size <= EXPRESS_MAX_IMAGE_BYTES
+    ):
+        return express_state_machine_arn
+    return state_machine_arn
+
+
+def start_workflow(bucket_name: str, object_key: str, etag: str, size: int = None) -> dict:
+    """Start the workflow for one uploaded object; returns the record result."""
+    result = {"bucket": bucket_name, "key": object_key}
+
+    # Check if the file has an allowed extension
+    if not object_key.lower().endswith(ALLOWED_EXTENSIONS):
+        logger.info(f"Skipping file: {object_key} (Not a supported format)")
+        return {**result, "status": "SKIPPED", "reason": "Unsupported file type"}
+
+    name = execution_name(bucket_name, object_key, etag)
+    target_arn = select_state_machine(object_key, size)
+    # Express executions don't enforce unique names, the claim is their only
+    # guard against redelivered notifications
+    express = target_arn == express_state_machine_arn
+    if etag:
+        original = claim_content(bucket_name, object_key, etag, name, target_arn)
+        if original and (original["bucket"], original["key"]) != (bucket_name, object_key):
+            outcome = original_outcome(original)
+            if outcome != "FAILED" or not take_over_claim(
+                bucket_name, object_key, etag, name, target_arn, original
+            ):
+                logger.info(f"Skipping {object_key}, same content as {original['key']}")
+                return {
+                    **result,
+                    "status": "DUPLICATE_CONTENT",
+                    "duplicateOf": {
+                        "bucket": original["bucket"],
+                        "key": original["key"],
+                        "outcome": outcome,
+                    },
+                }
+            logger.info(
+                f"Processing {object_key}, the execution of {original['key']} did not succeed"
             )
-            logger.info(f"Started Step Functions execution: {response['executionArn']}")
-        except Exception as e:
-            logger.error(f"Failed to start Step Functions execution: {str(e)}")
-            raise e
+        elif original and express and original["executionName"] == name:
+            logger.info(f"Express execution {name} already started for {object_key}")
+            return {**result, "status": "DUPLICATE", "executionName": name}
+
+    # Prepare the input for the Step Functions workflow
+    stepfunctions_input = {
+        "bucket_name": bucket_name,
+        "file_extension": object_key.split(".")[-1].lower(),
+        "object_key": object_key,
+    }
+    logger.info("stepfunctions input is: " + str(stepfunctions_input))
+
+    # Starting a Standard workflow again with the same name and input returns
+    # the existing execution instead of starting a new one
+    try:
+        response = stepfunctions_client.start_execution(
+            stateMachineArn=target_arn,
+            name=name,
+            input=json.dumps(stepfunctions_input),
+        )
+    except stepfunctions_client.exceptions.ExecutionAlreadyExists:
+        logger.info(f"Execution {name} already exists for {object_key}")
+        return {**result, "status": "DUPLICATE", "executionName": name}
+    except Exception:
+        if express and etag:
+            # Let the retried notification claim the upload again
+            release_claim(etag, name)
+        raise
+    logger.info(f"Started Step Functions execution: {response['executionArn']}")
+    return {**result, "status": "STARTED", "executionArn": response["executionArn"]}
+
+
+def _process_record(record) -> dict:
+    bucket_name = record.s3.bucket.name
+    object_key = unquote_plus(record.s3.get_object.key)
+    logger.info(f"Processing file from bucket: {bucket_name}, key: {object_key}")
+    try:
+        return start_workflow(
+            bucket_name,
+            object_key,
+            record.s3.get_object.etag,
+            record.s3.get_object.size,
+        )
+    except Exception as e:
+        logger.error(f"Failed to start Step Functions execution: {str(e)}")
+        return {
+            "bucket": bucket_name,
+            "key": object_key,
+            "status": "FAILED",
+            "reason": str(e),
+        }
+
+
+@event_source(data_class=S3Event)
+@logger.inject_lambda_context(log_event=True)
+def handler(event: S3Event, context):
+    logger.info(f"Received S3 event: {event}")
+
+    records = list(event.records)
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_CONCURRENT_STARTS, len(records)))
+    ) as pool:
+        results = list(pool.map(_process_record, records))
+    logger.info(f"Workflow start results: {results}")
 
-    return "Successfully started the Step Functions workflow"
+    failed = [result for result in results if result["status"] == "FAILED"]
+    if failed:
+        # Lambda retries the notification; records already started are
+        # recognized by their execution name
+        raise RuntimeError(f"Failed to start {len(failed)} of {len(results)} workflows")
+    return {"results": results}
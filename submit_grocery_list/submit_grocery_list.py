@@ -0,0 +1,135 @@
+import json
+import os
+import re
+import uuid
+from time import monotonic, sleep
+
+import boto3
+from aws_lambda_powertools import Logger
+from botocore.config import Config
+from botocore.exceptions import ReadTimeoutError
+from grocerly_shared.text_store import put_text
+
+state_machine_arn = os.environ["STATE_MACHINE_ARN"]
+# Texts run synchronously on the Express workflow when it is deployed
+express_state_machine_arn = os.environ.get("EXPRESS_STATE_MACHINE_ARN")
+
+# The mutation waits this long for the payment link before it returns the
+# execution id to subscribe to (AppSync gives a Lambda resolver 30 seconds)
+RESPONSE_DEADLINE_SECONDS = float(os.environ.get("RESPONSE_DEADLINE_SECONDS", "20"))
+
+# Initialize clients
+stepfunctions_client = boto3.client("stepfunctions")
+# StartSyncExecution answers when the execution ends; the read timeout is the
+# deadline, and a retry would start a second execution
+sync_stepfunctions_client = boto3.client(
+    "stepfunctions",
+    config=Config(
+        read_timeout=RESPONSE_DEADLINE_SECONDS,
+        retries={"max_attempts": 0},
+    ),
+)
+INITIAL_POLL_INTERVAL_SECONDS = 0.2
+MAX_POLL_INTERVAL_SECONDS = 0.5
+
+PAYMENT_LINK_URL = re.compile(r"https://\S+")
+# What invoke_agent returns, as a successful output, when it fails
+AGENT_FAILURE_COMPLETION = "an error occured"
+
+logger = Logger(service="submit_grocery_list")
+
+
+def wait_for_execution(execution_arn: str, deadline: float) -> dict:
+    """
+    Poll the execution with backoff until it stops running or the deadline
+    passes; returns the last description.
+    """
+    interval = INITIAL_POLL_INTERVAL_SECONDS
+    while True:
+        execution = stepfunctions_client.describe_execution(executionArn=execution_arn)
+        remaining = deadline - monotonic()
+        if execution["status"] != "RUNNING" or remaining <= 0:
+            return execution
+        sleep(min(interval, remaining))
+        interval = min(interval * 2, MAX_POLL_INTERVAL_SECONDS)
+
+
+def run_express(name: str, execution_input: dict) -> dict:
+    """
+    Run the Express workflow synchronously. Past the deadline the execution
+    keeps running and only its name, the session id of the progress events,
+    is returned.
+    """
+    try:
+        return sync_stepfunctions_client.start_sync_execution(
+            stateMachineArn=express_state_machine_arn,
+            name=name,
+            input=json.dumps(execution_input),
+        )
+    except ReadTimeoutError:
+        logger.info(f"Express execution {name} still running at the deadline")
+        return {"name": name, "status": "RUNNING"}
+
+
+def run_standard(name: str, execution_input: dict, context) -> dict:
+    # Leave a second to answer AppSync before the Lambda times out
+    deadline = monotonic() + min(
+        RESPONSE_DEADLINE_SECONDS,
+        context.get_remaining_time_in_millis() / 1000 - 1,
+    )
+    response = stepfunctions_client.start_execution(
+        stateMachineArn=state_machine_arn,
+        name=name,
+        input=json.dumps(execution_input),
+    )
+    logger.info(f"Started Step Functions execution: {response['executionArn']}")
+    return wait_for_execution(response["executionArn"], deadline)
+
+
+def submission_result(execution: dict) -> dict:
+    """
+    GroceryListSubmission of the execution, with the link once it succeeded.
+    A succeeded execution whose completion has no link is reported as FAILED.
+    """
+    result = {"executionId": execution["name"], "status": execution["status"]}
+    if execution["status"] == "SUCCEEDED":
+        # Output of the final Lambda Invoke task, the invoke_agent completion
+        completion = json.loads(execution["output"]).get("Payload")
+        match = PAYMENT_LINK_URL.search(completion or "")
+        result["completion"] = completion
+        result["paymentLink"] = match.group(0) if match else None
+        if completion == AGENT_FAILURE_COMPLETION:
+            result.update(status="FAILED", error="Payment link creation failed")
+        elif match is None:
+            result.update(status="FAILED", error="No payment link in the completion")
+    elif execution["status"] != "RUNNING":
+        # FAILED, TIMED_OUT or ABORTED
+        result["error"] = execution.get("error")
+    return result
+
+
+@logger.inject_lambda_context(log_event=True)
+def handler(event, context):
+    """
+    Resolver of the submitGroceryList mutation: runs the extraction and the
+    payment link on the text itself, skipping the upload and Textract, and
+    waits for the link until the deadline.
+
+    The Express workflow goes straight from the extraction Lambda to
+    invoke_agent. Without it, the Standard workflow is started and polled.
+    """
+    text = event["arguments"]["text"].strip()
+    if not text:
+        raise ValueError("Error: `text` is missing or empty.")
+
+    # The execution name is also the session id of the progress events
+    name = str(uuid.uuid4())
+    execution_input = {"source": "submitGroceryList", **put_text(text)}
+    if express_state_machine_arn:
+        execution = run_express(name, execution_input)
+    else:
+        execution = run_standard(name, execution_input, context)
+
+    result = submission_result(execution)
+    logger.info(f"Submission result: {result}")
+    return result
@@ -0,0 +1,11 @@
+def iter_expressions(node, path="$"):
+    """Every JSONata expression ({% ... %}) of an ASL document with its path."""
+    if isinstance(node, str):
+        if node.startswith("{%") and node.endswith("%}"):
+            yield path, node[2:-2].strip()
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            yield from iter_expressions(value, f"{path}.{key}")
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            yield from iter_expressions(value, f"{path}[{index}]")
@@ -0,0 +1,134 @@
+import json
+
+import jsonata
+import pytest
+
+# Synth tests need the CDK packages of requirements-dev.txt
+cdk = pytest.importorskip("aws_cdk")
+from aws_cdk.assertions import Template  # noqa: E402
+
+from grocery_ai_agent_cdk.api_lambda_s3_sfn_stack import ApiLambdaS3SfnStack  # noqa: E402
+from grocery_ai_agent_cdk.database_stack import DatabaseStack  # noqa: E402
+from grocery_ai_agent_cdk.sqs_stack import SQSStack  # noqa: E402
+from tests.unit.helpers import iter_expressions  # noqa: E402
+
+
+def synth(**options) -> Template:
+    # Skip asset bundling, the Lambda code is not under test
+    app = cdk.App(context={"aws:cdk:bundling-stacks": []})
+    sqs_stack = SQSStack(app, "SQSStack")
+    db_stack = DatabaseStack(app, "DatabaseStack")
+    stack = ApiLambdaS3SfnStack(
+        app,
+        "ApiLambdaS3SfnStack",
+        sqs_queue=sqs_stack.sqs_queue,
+        ecommerce_table=db_stack.ecommerce_table,
+        **options,
+    )
+    return Template.from_stack(stack)
+
+
+def state_machines(template: Template) -> dict:
+    """
+    State machine type -> parsed ASL definition, after checking that every
+    JSONata expression of the synthesized definitions parses.
+    """
+    machines = {
+        properties["Properties"]["StateMachineType"]: json.loads(
+            properties["Properties"]["DefinitionString"]
+        )
+        for properties in template.find_resources(
+            "AWS::StepFunctions::StateMachine"
+        ).values()
+    }
+    for machine_type, definition in machines.items():
+        for path, expression in iter_expressions(definition):
+            try:
+                jsonata.Jsonata(expression)
+            except Exception as e:
+                pytest.fail(f"{machine_type} {path}: {e}")
+    return machines
+
+
+def trigger_environment(template: Template) -> dict:
+    for function in template.find_resources("AWS::Lambda::Function").values():
+        variables = function["Properties"].get("Environment", {}).get("Variables", {})
+        if "STATE_MACHINE_ARN" in variables and "ECOMMERCE_TABLE_NAME" in variables:
+            return variables
+    raise AssertionError("Trigger function not found")
+
+
+def test_express_image_workflow_enabled():
+    template = synth(enable_express_image_workflow=True)
+
+    machines = state_machines(template)
+    assert set(machines) == {"STANDARD", "EXPRESS"}
+    express = machines["EXPRESS"]
+    assert express["StartAt"] == "DetectInputType"
+    assert "DetectDocumentText" in express["States"]
+    assert "$exists($states.input.text)" in (
+        express["States"]["DetectInputType"]["Choices"][0]["Condition"]
+    )
+    assert "session_id" in express["States"]["Lambda Invoke"]["Arguments"]["Payload"]
+    assert "EXPRESS_STATE_MACHINE_ARN" in trigger_environment(template)
+
+
+def test_express_image_workflow_disabled():
+    template = synth(enable_express_image_workflow=False)
+
+    assert set(state_machines(template)) == {"STANDARD"}
+    assert "EXPRESS_STATE_MACHINE_ARN" not in trigger_environment(template)
+
+
+def test_sqs_extraction_mode_is_the_default():
+    states = state_machines(synth())["STANDARD"]["States"]
+
+    assert "InvokeModel" not in states
+    for name in ("AssembleText", "Pass", "SubmittedText"):
+        assert states[name]["Next"] == "SQS SendMessage"
+
+
+def test_bedrock_extraction_mode():
+    states = state_machines(synth(extraction_mode="bedrock"))["STANDARD"]["States"]
+
+    assert states["InvokeModel"]["Resource"] == "arn:aws:states:::bedrock:invokeModel"
+    content = states["InvokeModel"]["Arguments"]["Body"]["messages"][0]["content"]
+    assert content.startswith("{% ") and "$states.input.text" in content
+    assert "No grocery list found." in states["HasGroceryList"]["Choices"][0]["Condition"]
+    assert "$itemLines" in states["HasGroceryList"]["Choices"][1]["Condition"]
+    for name in ("AssembleText", "Pass", "SubmittedText"):
+        assert states[name]["Next"] == "ChooseExtractionPath"
+    # Long and throttled texts keep the buffered SQS path
+    assert states["ChooseExtractionPath"]["Default"] == "SQS SendMessage"
+    assert "SQS SendMessage" in states
+
+
+@pytest.mark.parametrize("extraction_mode", ["sqs", "bedrock"])
+def test_extraction_mode_keeps_both_workflows(extraction_mode):
+    machines = state_machines(synth(extraction_mode=extraction_mode))
+
+    assert set(machines) == {"STANDARD", "EXPRESS"}
+
+
+def test_unknown_extraction_mode():
+    with pytest.raises(ValueError):
+        synth(extraction_mode="lambda")
+
+
+def test_extracted_texts_expire_after_the_queue_retention():
+    template = synth()
+    template.has_resource_properties(
+        "AWS::S3::Bucket",
+        {
+            "LifecycleConfiguration": {
+                "Rules": [
+                    {
+                        "Id": "ExpireExtractedTexts",
+                        "Prefix": "extracted/",
+                        "ExpirationInDays": 30,
+                        "Status": "Enabled",
+                    }
+                ]
+            }
+        },
+    )
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+
+from benchmarks.fast_path_parser.benchmark import CORPUS, evaluate
+from sqs_poller.fast_path_parser import parse_grocery_list
+
+# Default FAST_PATH_CONFIDENCE_THRESHOLD of the sqs_poller
+THRESHOLD = 0.9
+
+
+def test_corpus_precision():
+    with open(CORPUS) as corpus_file:
+        report = evaluate(json.load(corpus_file), THRESHOLD)
+    assert report["false_accepts"] == 0
+    assert report["wrong_items"] == 0
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "Total: 45\nTax: 3",
+        "Invoice 12345\nOrder 998",
+        "Call mom at 5\nMeet John at 3",
+        "Table 4\nSeats 2",
+        "0 apples\n2 kg pears",
+        "1.5 kg potatoes\n2 l milk",
+    ],
+)
+def test_left_to_the_model(text):
+    assert parse_grocery_list(text).confidence < THRESHOLD
+
+
+def test_to_text_keeps_quantities():
+    result = parse_grocery_list("Lemons 3\n2 bottles of milk\nbread x2")
+    assert result.confidence >= THRESHOLD
+    assert [json.loads(line) for line in result.to_text().splitlines()] == [
+        {"name": "Lemons", "quantity": 3, "unit": None},
+        {"name": "milk", "quantity": 2, "unit": "bottle"},
+        {"name": "bread", "quantity": 2, "unit": None},
+    ]
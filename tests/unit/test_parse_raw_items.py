@@ -0,0 +1,73 @@
+import pytest
+
+# Puts the agent and the shared layer on sys.path, like the Lambda bundle
+from benchmarks.parse_raw_items.benchmark import build_cart
+from utilities.utils import _iter_raw_items, parse_raw_carts, parse_raw_items
+
+
+def items(products):
+    return [product.model_dump() for product in products]
+
+
+def test_iter_raw_items():
+    text = "[{name=Milk, quantity=2, unit=l}, {name=Eggs, quantity=12}]"
+    assert list(_iter_raw_items(text)) == [
+        {"name": "Milk", "quantity": "2", "unit": "l"},
+        {"name": "Eggs", "quantity": "12"},
+    ]
+
+
+def test_commas_inside_names():
+    # The action group splits the array on every comma
+    text = "[{name=Salt, sea, coarse, quantity=1, unit=kg}, {name=Eggs, quantity=6}]"
+    raw_data = text.split(",")
+    assert items(parse_raw_items(raw_data).products) == [
+        {"name": "Salt, sea, coarse", "quantity": 1, "unit": "kg"},
+        {"name": "Eggs", "quantity": 6, "unit": None},
+    ]
+
+
+def test_nested_braces():
+    raw_data = ["[{name=Bread {whole wheat, sliced}", " quantity=2}]"]
+    assert items(parse_raw_items(raw_data).products) == [
+        {"name": "Bread {whole wheat, sliced}", "quantity": 2, "unit": None}
+    ]
+
+
+@pytest.mark.parametrize("unit", ["", ", unit=null", ", unit=None", ", unit="])
+def test_missing_or_null_unit(unit):
+    raw_data = f"[{{name=Pineapples, quantity=3{unit}}}]".split(",")
+    assert items(parse_raw_items(raw_data).products) == [
+        {"name": "Pineapples", "quantity": 3, "unit": None}
+    ]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "[{name=Milk, quantity=1]",
+        "[{name=Milk, quantity=1}}]",
+        "[name=Milk, quantity=1]",
+        "[{Milk, quantity=1}]",
+        "[{name=Milk, quantity=1}, Eggs]",
+        "[{name=Milk, quantity=1, name=Eggs}]",
+        "[{name=Milk, quantity=two}]",
+        "[{quantity=1}]",
+    ],
+)
+def test_malformed_input_raises(text):
+    with pytest.raises(ValueError):
+        parse_raw_items(text.split(","))
+
+
+def test_empty_carts_keep_their_index():
+    raw_data = "[[{name=Milk, quantity=1}], [], [{name=Eggs, quantity=6}]]".split(",")
+    assert [len(cart.products) for cart in parse_raw_carts(raw_data)] == [1, 0, 1]
+
+
+def test_parse_raw_items_benchmark(request):
+    pytest.importorskip("pytest_benchmark")
+    benchmark = request.getfixturevalue("benchmark")
+    raw_data = build_cart(1000)
+    parsed = benchmark(parse_raw_items, raw_data)
+    assert len(parsed.products) == 1000
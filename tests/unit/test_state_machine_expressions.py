@@ -0,0 +1,97 @@
+import json
+from pathlib import Path
+
+import jsonata
+import pytest
+
+from grocery_ai_agent_cdk.workflow_definitions import use_bedrock_extraction
+from tests.unit.helpers import iter_expressions
+
+ROOT = Path(__file__).resolve().parents[2]
+ASL_FILES = sorted((ROOT / "state_machine").glob("*.asl.json"))
+
+
+@pytest.fixture
+def bedrock_states(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    definition = json.loads((ROOT / "state_machine" / "state_machine_definition.asl.json").read_text())
+    return use_bedrock_extraction(definition)["States"]
+
+
+def evaluate(expression: str, **variables):
+    compiled = jsonata.Jsonata(expression[2:-2].strip())
+    for name, value in variables.items():
+        compiled.assign(name, value)
+    return compiled.evaluate(None)
+
+
+@pytest.mark.parametrize("asl_file", ASL_FILES, ids=lambda path: path.name)
+def test_asl_expressions_parse(asl_file):
+    expressions = list(iter_expressions(json.loads(asl_file.read_text())))
+    assert expressions
+    for path, expression in expressions:
+        try:
+            jsonata.Jsonata(expression)
+        except Exception as e:
+            pytest.fail(f"{asl_file.name} {path}: {e}")
+
+
+def test_bedrock_mode_expressions_parse(bedrock_states):
+    for path, expression in iter_expressions(bedrock_states):
+        try:
+            jsonata.Jsonata(expression)
+        except Exception as e:
+            pytest.fail(f"bedrock mode {path}: {e}")
+
+
+def test_bedrock_mode_prompt_wraps_the_document(bedrock_states):
+    content = bedrock_states["InvokeModel"]["Arguments"]["Body"]["messages"][0]["content"]
+    compiled = jsonata.Jsonata(content[2:-2].strip().replace("$states.input.text", "$text"))
+    compiled.assign("text", "2 apples")
+    prompt = compiled.evaluate(None)
+    assert "grocery items" in prompt
+    assert prompt.rstrip().endswith("2 apples")
+
+
+def item_lines(bedrock_states, answer):
+    expression = bedrock_states["InvokeModel"]["Assign"]["itemLines"]
+    return evaluate(
+        expression.replace("$states.result.Body.content[0].text", "$answer"), answer=answer
+    )
+
+
+def test_bedrock_mode_formats_valid_item_lists(bedrock_states):
+    lines = item_lines(
+        bedrock_states,
+        '{"name": "milk", "quantity": 2, "unit": "l"}\n'
+        '- {"name": "eggs", "quantity": 12, "unit": null},\n',
+    )
+    choices = bedrock_states["HasGroceryList"]["Choices"]
+    assert evaluate(choices[1]["Condition"], itemLines=lines) is True
+
+    output = bedrock_states["FormatItemList"]["Output"]
+    assert evaluate(output["items"], itemLines=lines) == [
+        {"name": "milk", "quantity": 2, "unit": "l"},
+        {"name": "eggs", "quantity": 12, "unit": None},
+    ]
+    assert evaluate(output["grocery_list"], itemLines=lines) == "- milk, 2 l\n- eggs, 12"
+
+
+@pytest.mark.parametrize(
+    "answer",
+    [
+        "milk and eggs",
+        '{"name": "milk", "quantity": 0, "unit": null}',
+        '{"name": "milk \\"fresh\\"", "quantity": 1, "unit": null}',
+    ],
+)
+def test_bedrock_mode_leaves_other_answers_to_the_agent(bedrock_states, answer):
+    lines = item_lines(bedrock_states, answer)
+    condition = bedrock_states["HasGroceryList"]["Choices"][1]["Condition"]
+    assert evaluate(condition, itemLines=lines) is False
+
+
+def test_bedrock_mode_detects_the_negative_answer(bedrock_states):
+    condition = bedrock_states["HasGroceryList"]["Choices"][0]["Condition"]
+    assert evaluate(condition, answer="No grocery list found.") is True
+    assert evaluate(condition, answer='{"name": "milk", "quantity": 1, "unit": null}') is False
@@ -0,0 +1,81 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+ROOT = Path(__file__).resolve().parents[2]
+ETAG = "etag"
+
+
+@pytest.fixture
+def trigger(monkeypatch):
+    for name, value in {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "ECOMMERCE_TABLE_NAME": "GroceryAppTable",
+    }.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("EXPRESS_STATE_MACHINE_ARN", raising=False)
+    with moto.mock_aws():
+        import boto3
+
+        boto3.client("dynamodb").create_table(
+            TableName="GroceryAppTable",
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        state_machine = boto3.client("stepfunctions").create_state_machine(
+            name="GroceryListWorkflow",
+            definition=json.dumps(
+                {"StartAt": "Done", "States": {"Done": {"Type": "Pass", "End": True}}}
+            ),
+            roleArn="arn:aws:iam::123456789012:role/StepFunctions",
+        )
+        monkeypatch.setenv("STATE_MACHINE_ARN", state_machine["stateMachineArn"])
+        monkeypatch.syspath_prepend(str(ROOT / "step_functions_workflow_trigger"))
+        monkeypatch.delitem(sys.modules, "step_functions_workflow_trigger", raising=False)
+        import step_functions_workflow_trigger
+
+        yield step_functions_workflow_trigger
+
+
+def test_duplicate_of_running_upload_is_skipped(trigger):
+    assert trigger.start_workflow("bucket", "a.pdf", ETAG, 10)["status"] == "STARTED"
+    result = trigger.start_workflow("bucket", "b.pdf", ETAG, 10)
+    assert result["status"] == "DUPLICATE_CONTENT"
+    assert result["duplicateOf"] == {
+        "bucket": "bucket",
+        "key": "a.pdf",
+        "outcome": "RUNNING",
+    }
+
+
+def test_duplicate_of_succeeded_upload_is_skipped(trigger):
+    trigger.start_workflow("bucket", "a.pdf", ETAG, 10)
+    name = trigger.execution_name("bucket", "a.pdf", ETAG)
+    trigger.table.put_item(Item={"PK": "PAYMENLINK", "SK": f"USERID#{name}"})
+    result = trigger.start_workflow("bucket", "b.pdf", ETAG, 10)
+    assert result["status"] == "DUPLICATE_CONTENT"
+    assert result["duplicateOf"]["outcome"] == "SUCCEEDED"
+
+
+def test_duplicate_of_failed_upload_is_processed(trigger):
+    started = trigger.start_workflow("bucket", "a.pdf", ETAG, 10)
+    trigger.stepfunctions_client.stop_execution(executionArn=started["executionArn"])
+    assert trigger.start_workflow("bucket", "b.pdf", ETAG, 10)["status"] == "STARTED"
+    claim = trigger.table.get_item(Key={"PK": f"UPLOAD#{ETAG}", "SK": "UPLOAD"})["Item"]
+    assert claim["objectKey"] == "b.pdf"
+    # The new claim keeps further copies from starting again
+    result = trigger.start_workflow("bucket", "c.pdf", ETAG, 10)
+    assert result["duplicateOf"]["key"] == "b.pdf"
@@ -0,0 +1,67 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[2]
+
+
+@pytest.fixture
+def submission_result(monkeypatch):
+    monkeypatch.setenv(
+        "STATE_MACHINE_ARN", "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+    )
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.syspath_prepend(str(ROOT / "layers" / "shared"))
+    monkeypatch.syspath_prepend(str(ROOT / "submit_grocery_list"))
+    monkeypatch.delitem(sys.modules, "submit_grocery_list", raising=False)
+    import submit_grocery_list
+
+    return submit_grocery_list.submission_result
+
+
+def succeeded(completion):
+    return {
+        "name": "execution",
+        "status": "SUCCEEDED",
+        "output": json.dumps({"Payload": completion}),
+    }
+
+
+def test_succeeded_with_link(submission_result):
+    result = submission_result(
+        succeeded("Payment Link URL: https://buy.stripe.com/test_123")
+    )
+    assert result["status"] == "SUCCEEDED"
+    assert result["paymentLink"] == "https://buy.stripe.com/test_123"
+    assert "error" not in result
+
+
+@pytest.mark.parametrize(
+    "completion",
+    ["an error occured", "I could not find these products.", None],
+)
+def test_succeeded_without_link_is_failed(submission_result, completion):
+    result = submission_result(succeeded(completion))
+    assert result["status"] == "FAILED"
+    assert result["paymentLink"] is None
+    assert result["error"]
+
+
+def test_running(submission_result):
+    assert submission_result({"name": "execution", "status": "RUNNING"}) == {
+        "executionId": "execution",
+        "status": "RUNNING",
+    }
+
+
+def test_failed(submission_result):
+    result = submission_result(
+        {"name": "execution", "status": "FAILED", "error": "States.Timeout"}
+    )
+    assert result == {
+        "executionId": "execution",
+        "status": "FAILED",
+        "error": "States.Timeout",
+    }
@@ -0,0 +1,84 @@
+import json
+import os
+from time import time
+
+import boto3
+from aws_lambda_powertools import Logger
+
+# Initialize clients
+stepfunctions_client = boto3.client("stepfunctions")
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table(os.environ.get("ECOMMERCE_TABLE_NAME"))
+
+# Job items only bridge the Textract notification and the waiting execution
+JOB_TTL_SECONDS = int(os.environ.get("TEXTRACT_JOB_TTL_SECONDS", "86400"))
+
+logger = Logger(service="textract_completion")
+
+
+def _record_job(job_id: str, attribute: str, value: str) -> dict:
+    """
+    Store one side of the job (the task token or the completion status) and
+    return what the other side stored before, if it got there first.
+    """
+    response = table.update_item(
+        Key={"PK": f"TEXTRACTJOB#{job_id}", "SK": "TEXTRACTJOB"},
+        UpdateExpression=f"SET {attribute} = :value, expiresAt = :expires_at",
+        ExpressionAttributeValues={
+            ":value": value,
+            ":expires_at": int(time()) + JOB_TTL_SECONDS,
+        },
+        ReturnValues="ALL_OLD",
+    )
+    return response.get("Attributes", {})
+
+
+def _send_job_result(task_token: str, job_id: str, status: str) -> None:
+    try:
+        if status == "SUCCEEDED":
+            stepfunctions_client.send_task_success(
+                taskToken=task_token,
+                output=json.dumps({"JobId": job_id, "JobStatus": status}),
+            )
+        else:
+            stepfunctions_client.send_task_failure(
+                taskToken=task_token,
+                error="TextractJobFailed",
+                cause=f"Textract job {job_id} finished with status {status}.",
+            )
+    except (
+        stepfunctions_client.exceptions.TaskTimedOut,
+        stepfunctions_client.exceptions.TaskDoesNotExist,
+        stepfunctions_client.exceptions.InvalidToken,
+    ) as e:
+        # The execution stopped waiting and polls the job itself
+        logger.warning(f"Dropping result of Textract job {job_id}: {e}")
+
+
+def register_job(job_id: str, task_token: str) -> None:
+    """Called by the state machine right after starting the job."""
+    previous = _record_job(job_id, "taskToken", task_token)
+    if "jobStatus" in previous:
+        # The job finished before the execution started waiting
+        _send_job_result(task_token, job_id, previous["jobStatus"])
+
+
+def complete_job(job_id: str, status: str) -> None:
+    """Called with the Textract SNS completion notification."""
+    previous = _record_job(job_id, "jobStatus", status)
+    if "taskToken" in previous:
+        _send_job_result(previous["taskToken"], job_id, status)
+
+
+@logger.inject_lambda_context(log_event=True)
+def handler(event, context):
+    # Textract completion notifications arrive through SNS
+    if "Records" in event:
+        for record in event["Records"]:
+            message = json.loads(record["Sns"]["Message"])
+            logger.info(f"Textract job {message['JobId']} is {message['Status']}")
+            complete_job(message["JobId"], message["Status"])
+        return
+
+    # Otherwise the state machine registers the task token of a job
+    register_job(event["JobId"], event["TaskToken"])
@@ -0,0 +1,55 @@
+import json
+import os
+
+import boto3
+from aws_lambda_powertools import Logger
+from grocerly_shared.text_store import get_text, put_text
+
+# Initialize clients
+s3_client = boto3.client("s3")
+
+# Page texts above this size are stored in S3 so the Map state output stays
+# small however many pages the document has
+PAGE_INLINE_LIMIT_BYTES = int(os.environ.get("PAGE_INLINE_LIMIT_BYTES", "2048"))
+
+logger = Logger(service="textract_results")
+
+
+def iter_lines(blocks):
+    """LINE texts of a Textract result page, in the reading order Textract returns."""
+    for block in blocks:
+        if block.get("BlockType") == "LINE" and block.get("Text"):
+            yield block["Text"]
+
+
+@logger.inject_lambda_context
+def handler(event, context):
+    """
+    Text of one output file of an asynchronous Textract job
+    (converted/<JobId>/<n>). The state machine maps over the files of the job
+    in order, so only one file is held in memory per invocation.
+    """
+    bucket, key = event["bucket"], event["key"]
+    body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+    try:
+        result = json.load(body)
+    finally:
+        body.close()
+
+    lines = list(iter_lines(result.get("Blocks", [])))
+    logger.info(f"Read {len(lines)} lines from s3://{bucket}/{key}")
+    return {
+        "key": key,
+        **put_text("\n".join(lines), inline_limit_bytes=PAGE_INLINE_LIMIT_BYTES),
+    }
+
+
+@logger.inject_lambda_context
+def assemble_handler(event, context):
+    """
+    Join the page texts of the Map state into the document text, passed on
+    inline when small and through the text store otherwise.
+    """
+    text = "\n".join(get_text(page) for page in event["pages"])
+    logger.info(f"Assembled {len(event['pages'])} pages, {len(text)} characters")
+    return {**put_text(text), "bucket": event["bucket"], "key": event["key"]}